@@ -0,0 +1,41 @@
+'''
+Fixtures shared by the tests: synthetic xphon projects (see xphon.benchmarks.synthetic),
+generated once per session and copied for each test.
+'''
+
+import shutil
+
+import pytest
+
+from xphon.benchmarks.synthetic import write_synthetic_project
+
+
+NATOMS = 8
+
+
+@pytest.fixture(scope='session')
+def synthetic_template(tmp_path_factory):
+    root = tmp_path_factory.mktemp('template') / 'project'
+    write_synthetic_project(str(root), NATOMS, seed=0)
+    return root
+
+
+@pytest.fixture
+def project_dir(synthetic_template, tmp_path):
+    '''
+    Fresh copy of a complete synthetic project (phonons/ and raman_calcs/)
+    '''
+    root = tmp_path / 'project'
+    shutil.copytree(synthetic_template, root)
+    return root
+
+
+@pytest.fixture
+def submit_command(tmp_path):
+    '''
+    Fake submit command, printing the id of the job as sbatch
+    '''
+    script = tmp_path / 'fake_sbatch.sh'
+    script.write_text('#!/bin/sh\necho "Submitted batch job $$"\n')
+    script.chmod(0o755)
+    return str(script)
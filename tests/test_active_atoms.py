@@ -0,0 +1,72 @@
+'''
+Tests of the partial phonon and Raman workflow, with only some atoms active
+'''
+
+import json
+
+import numpy as np
+import pytest
+from ase.constraints import FixAtoms
+from ase.io import read
+
+from xphon import PHONONS_DIR
+from xphon.benchmarks.synthetic import write_synthetic_project
+from xphon.calculations.ir import prepare_ir_calculation
+from xphon.calculations.utils import read_input_parameters, read_vibrations
+from xphon.project import Project
+
+
+ACTIVE_ATOMS = [2, 3, 5]
+
+
+@pytest.fixture
+def partial_project(tmp_path):
+    root = tmp_path / 'partial'
+    write_synthetic_project(str(root), 8, active_atoms=ACTIVE_ATOMS)
+    return root
+
+
+def test_active_atoms_are_read_from_settings(partial_project):
+    atoms, _, _, _ = read_input_parameters(str(partial_project))
+
+    assert len(atoms.constraints) == 1
+    assert isinstance(atoms.constraints[0], FixAtoms)
+    fixed = sorted(atoms.constraints[0].get_indices() + 1)
+    assert fixed == sorted(set(range(1, 9)) - set(ACTIVE_ATOMS))
+
+
+def test_active_atoms_out_of_range(partial_project):
+    with open(partial_project / 'settings.json') as f:
+        settings = json.load(f)
+    settings['active_atoms'] = [0, 1]
+    with open(partial_project / 'settings.json', 'w') as f:
+        json.dump(settings, f)
+
+    with pytest.raises(ValueError, match='active_atoms'):
+        read_input_parameters(str(partial_project))
+
+
+def test_phonon_poscar_has_selective_dynamics(partial_project, tmp_path):
+    atoms, _, _, _ = read_input_parameters(str(partial_project))
+    root = tmp_path / 'new'
+    root.mkdir()
+    (root / 'POSCAR').write_text((partial_project / 'POSCAR').read_text())
+
+    prepare_ir_calculation(atoms, root=str(root))
+
+    poscar = read(root / PHONONS_DIR / 'POSCAR')
+    assert sorted(poscar.constraints[0].get_indices() + 1) == sorted(set(range(1, 9)) - set(ACTIVE_ATOMS))
+
+
+def test_partial_modes_and_spectra(partial_project):
+    project = Project(partial_project)
+
+    frequencies, eigenvectors = read_vibrations(project.phonons_dir)
+    assert eigenvectors.shape == (3*len(ACTIVE_ATOMS), 8, 3)
+    fixed = np.setdiff1d(np.arange(8), np.array(ACTIVE_ATOMS) - 1)
+    assert not np.any(eigenvectors[:, fixed])
+
+    ir_frequencies, _ = project.ir_spectrum()
+    raman_frequencies, activities, _ = project.raman_spectrum()
+    assert len(ir_frequencies) == len(raman_frequencies) == np.sum(frequencies.imag == 0)
+    assert np.all(np.isfinite(activities))
@@ -0,0 +1,75 @@
+'''
+Tests of the archive of finished projects
+'''
+
+import zipfile
+
+import numpy as np
+import pytest
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.calculations.archive import ARCHIVE_FILE, RAW_TARBALL, _memmap_member
+from xphon.calculations.probe import probe_calculation, COMPLETE, MISSING
+from xphon.project import Project
+
+
+def _outputs(root):
+    return {path.relative_to(root): path.read_bytes()
+            for directory in (PHONONS_DIR, RAMAN_DIR) for path in sorted((root / directory).rglob('*'))
+            if path.is_file()}
+
+
+@pytest.mark.parametrize('compression, suffix', [('gz', '.gz'), ('none', '')])
+def test_archive_round_trip(project_dir, compression, suffix):
+    project = Project(project_dir)
+    ir = project.ir_spectrum()
+    raman = project.raman_spectrum()
+    outputs = _outputs(project_dir)
+
+    project.archive(compression=compression)
+
+    assert not (project_dir / PHONONS_DIR).exists()
+    assert not (project_dir / RAMAN_DIR).exists()
+    assert (project_dir / f'{RAW_TARBALL}{suffix}').is_file()
+
+    # the spectra are computed from the archive
+    assert all(np.array_equal(a, b) for a, b in zip(project.ir_spectrum(), ir))
+    assert all(np.array_equal(a, b) for a, b in zip(project.raman_spectrum(), raman))
+    assert probe_calculation(str(project_dir / RAMAN_DIR / '0010.-1')) == COMPLETE
+    assert probe_calculation(str(project_dir / RAMAN_DIR / '9999.-1')) == MISSING
+
+    project.restore()
+
+    assert not (project_dir / ARCHIVE_FILE).exists()
+    assert not (project_dir / f'{RAW_TARBALL}{suffix}').exists()
+    restored = _outputs(project_dir)
+    assert {path: data for path, data in restored.items() if path in outputs} == outputs
+
+
+def test_memory_mapped_archive_members(project_dir):
+    project = Project(project_dir)
+    frequencies, eigenvectors = project.vibrations()
+    eigenvectors = np.array(eigenvectors)
+
+    project.archive()
+    archived_frequencies, archived_eigenvectors = project.vibrations()
+    assert np.array_equal(archived_frequencies, frequencies)
+    assert np.array_equal(archived_eigenvectors, eigenvectors)
+
+    # the small arrays of the test are read in memory: map them explicitly
+    path = str(project_dir / ARCHIVE_FILE)
+    with zipfile.ZipFile(path) as zf, np.load(path) as data:
+        for name in ('eigenvectors', 'hessian', 'raman_epsilons'):
+            member = _memmap_member(path, zf, name)
+            assert isinstance(member, np.memmap)
+            assert np.array_equal(member, data[name])
+
+
+def test_archive_needs_complete_calculations(project_dir):
+    (project_dir / RAMAN_DIR / '0010.+1' / 'vasprun.xml').write_text('<?xml version="1.0"?>\n<modeling>\n')
+
+    with pytest.raises(SystemExit, match='0010.+1'):
+        Project(project_dir).archive()
+
+    assert not (project_dir / ARCHIVE_FILE).exists()
+    assert (project_dir / PHONONS_DIR).is_dir()
@@ -0,0 +1,65 @@
+'''
+Tests of the synthetic-project generator and of the benchmark suite
+'''
+
+import json
+
+import numpy as np
+import pytest
+from ase import units
+
+from xphon.benchmarks.synthetic import make_structure, make_hessian
+from xphon.benchmarks.suite import STAGES, run_benchmarks
+from xphon.calculations.utils import read_vibrations, read_input_parameters
+from xphon.calculations.probe import probe_calculation, COMPLETE
+from xphon.project import Project
+
+
+def test_hessian_is_symmetric_and_translation_invariant():
+    atoms = make_structure(10, seed=1)
+    hessian = make_hessian(atoms, seed=1)
+
+    assert np.allclose(hessian, hessian.T)
+    translation = np.tile(np.eye(3), (len(atoms), 1))  # (3N, 3) rigid translations
+    assert np.allclose(hessian @ translation, 0)
+
+
+def test_synthetic_project_is_readable(project_dir):
+    project = Project(project_dir)
+    atoms, step_size, _, _ = read_input_parameters(str(project_dir))
+
+    frequencies, eigenvectors = read_vibrations(project.phonons_dir)
+    assert eigenvectors.shape == (3*len(atoms), len(atoms), 3)
+
+    # same frequencies as the mass-weighted Hessian of the generator
+    hessian = make_hessian(make_structure(len(atoms)))
+    weights = np.repeat(atoms.get_masses()**-0.5, 3)
+    eigvals = np.linalg.eigvalsh(hessian * weights * weights[:, np.newaxis])  # eV/A^2/amu
+    to_invcm = units._hbar * 1e10 / np.sqrt(units._e * units._amu) / units.invcm
+    expected = np.sqrt(np.abs(eigvals)) * to_invcm
+    # the six rigid translations and rotations are excluded
+    assert np.allclose(np.sort(np.abs(frequencies))[6:], np.sort(expected)[6:], rtol=1e-4)
+
+    assert step_size == 0.01
+    assert project.born_charges().shape == (len(atoms), 3, 3)
+    raman_dirs = sorted(p for p in project_dir.glob('raman_calcs/*'))
+    assert len(raman_dirs) == 2 * 3 * len(atoms)
+    assert all(probe_calculation(str(d)) == COMPLETE for d in raman_dirs)
+
+
+def test_run_benchmarks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    results = run_benchmarks([3, 4], memory=False, plot=False)
+
+    assert list(results) == list(STAGES)
+    assert all(sorted(results[stage]) == [3, 4] for stage in STAGES)
+    with open(tmp_path / 'benchmark_results.json') as f:
+        assert json.load(f)['sizes'] == [3, 4]
+    assert not list((tmp_path / 'xphon_benchmark').iterdir())
+
+
+@pytest.mark.parametrize('sizes, repeats', [([], 1), ([0, 4], 1), ([4], 0)])
+def test_run_benchmarks_rejects_invalid_arguments(sizes, repeats):
+    with pytest.raises(ValueError):
+        run_benchmarks(sizes, repeats=repeats)
@@ -0,0 +1,119 @@
+'''
+Tests of the campaign mode, with synthetic structures and a fake scheduler
+'''
+
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+from xphon import PHONONS_DIR
+from xphon.benchmarks.synthetic import write_synthetic_project
+from xphon.calculations import jobs, raman
+from xphon.calculations.campaign import run_campaign, read_manifest, STATE_FILE, DONE, IR, RAMAN
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    '''
+    Fake scheduler queue: the ids in the returned set are running
+    '''
+    running = set()
+    monkeypatch.setattr(jobs, 'get_running_jobs', lambda: sorted(running))
+    monkeypatch.setattr(raman, 'get_queued_jobs', dict)
+    return running
+
+
+@pytest.fixture
+def campaign_dir(tmp_path, synthetic_template, submit_command):
+    '''
+    Campaign of three structures: finished, with the phonons done,
+    and with nothing done yet
+    '''
+    root = tmp_path / 'campaign'
+    shutil.copytree(synthetic_template, root / 'finished')
+    write_synthetic_project(str(root / 'phonons_done'), 4, seed=1, raman=False)
+    write_synthetic_project(str(root / 'new'), 4, seed=2, raman=False)
+    shutil.rmtree(root / 'new' / PHONONS_DIR)
+
+    for name in ('finished', 'phonons_done', 'new'):
+        with open(root / name / 'settings.json') as f:
+            settings = json.load(f)
+        settings['submit_command'] = submit_command
+        with open(root / name / 'settings.json', 'w') as f:
+            json.dump(settings, f)
+
+    (root / 'structures.txt').write_text('finished\nphonons_done  # comment\n\nnew\n')
+    (root / 'settings.json').write_text(json.dumps({'submission': {'rate': 0}}))
+    return root
+
+
+def _submitted_ids(directory):
+    path = directory / 'submitted_jobs.txt'
+    return [int(line) for line in path.read_text().split()] if path.exists() else []
+
+
+def test_read_manifest(campaign_dir):
+    directories = read_manifest(str(campaign_dir / 'structures.txt'))
+    assert directories == [str(campaign_dir / name) for name in ('finished', 'phonons_done', 'new')]
+
+    (campaign_dir / 'manifest.json').write_text(json.dumps({'structures': ['new', 'finished']}))
+    assert read_manifest(str(campaign_dir / 'manifest.json')) == [str(campaign_dir / 'new'),
+                                                                  str(campaign_dir / 'finished')]
+
+
+def test_campaign_step(campaign_dir, scheduler, tmp_path, monkeypatch):
+    calls = []
+    submit_jobs = jobs.submit_jobs
+    monkeypatch.setattr(jobs, 'submit_jobs', lambda *args: calls.append(args[0]) or submit_jobs(*args))
+    # run from another directory
+    monkeypatch.chdir(tmp_path)
+
+    run_campaign(str(campaign_dir / 'structures.txt'), max_jobs=5, once=True)
+
+    # the state and the tables are next to the manifest
+    assert not (tmp_path / STATE_FILE).exists()
+    with open(campaign_dir / STATE_FILE) as f:
+        state = json.load(f)
+    stages = {campaign_dir / directory: s['stage'] for directory, s in state.items()}
+    assert stages == {campaign_dir / 'finished': DONE,
+                      campaign_dir / 'phonons_done': RAMAN,
+                      campaign_dir / 'new': IR}
+
+    # all the jobs of the step are submitted together, the phonons within the budget first
+    assert len(calls) == 1
+    assert len(calls[0]) == 5
+    assert str(campaign_dir / 'new' / PHONONS_DIR) in calls[0]
+    assert len(_submitted_ids(campaign_dir / 'new')) == 1
+    assert len(_submitted_ids(campaign_dir / 'phonons_done')) == 4
+    assert (campaign_dir / 'new' / PHONONS_DIR / 'jobscript.sh').exists()
+
+    table = np.loadtxt(campaign_dir / 'campaign_ir.dat', skiprows=1)
+    assert (campaign_dir / 'campaign_ir.dat').read_text().split('\n')[0].split()[1:] == ['finished', 'phonons_done']
+    assert table.shape[1] == 3
+    assert (campaign_dir / 'campaign_raman.dat').read_text().split('\n')[0].split()[1:] == ['finished']
+
+
+def test_campaign_resume(campaign_dir, scheduler):
+    manifest = str(campaign_dir / 'structures.txt')
+    run_campaign(manifest, max_jobs=5, once=True)
+    scheduler.update(_submitted_ids(campaign_dir / 'new') + _submitted_ids(campaign_dir / 'phonons_done'))
+
+    # all the jobs are still running: nothing new is submitted
+    run_campaign(manifest, max_jobs=5, once=True)
+    assert len(_submitted_ids(campaign_dir / 'phonons_done')) == 4
+
+    # two Raman jobs left the queue: two more are submitted
+    running_raman = _submitted_ids(campaign_dir / 'phonons_done')
+    scheduler.difference_update(running_raman[:2])
+    run_campaign(manifest, max_jobs=5, once=True)
+    with open(campaign_dir / STATE_FILE) as f:
+        state = json.load(f)[str(campaign_dir / 'phonons_done')]
+    assert len(state['jobs']) == 4
+    assert sum(state['submissions'].values()) == 6
+
+
+def test_campaign_rejects_invalid_max_jobs(campaign_dir):
+    with pytest.raises(ValueError, match='max_jobs'):
+        run_campaign(str(campaign_dir / 'structures.txt'), max_jobs=0, once=True)
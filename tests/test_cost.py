@@ -0,0 +1,62 @@
+'''
+Tests of the core-hour accounting and of the projection of the remaining cost
+'''
+
+import shutil
+
+import pytest
+
+from xphon import RAMAN_DIR
+from xphon.calculations.cost import read_outcar_timing, COST_CACHE_FILE
+from xphon.project import Project
+
+
+NATOMS = 8
+CORES = 4
+PHONON_ELAPSED = 50.0 * NATOMS  # see benchmarks.synthetic.write_synthetic_project
+RAMAN_ELAPSED = 2.0 * NATOMS
+
+
+def test_read_outcar_timing(project_dir):
+    outcar = project_dir / RAMAN_DIR / '0010.+1' / 'OUTCAR'
+    timing = read_outcar_timing(str(outcar))
+    assert timing == {'elapsed': RAMAN_ELAPSED, 'cpu_time': pytest.approx(0.98*RAMAN_ELAPSED), 'cores': CORES}
+
+    outcar.write_text(outcar.read_text().split('General timing')[0])
+    assert read_outcar_timing(str(outcar)) is None
+
+
+def test_cost_of_a_finished_project(project_dir):
+    report = Project(project_dir).cost()
+
+    nraman = len(list((project_dir / RAMAN_DIR).iterdir()))
+    assert report['phonons']['core_hours'] == pytest.approx(PHONON_ELAPSED * CORES / 3600)
+    assert report['raman_finished'] == nraman
+    assert report['raman_elapsed']['mean'] == pytest.approx(RAMAN_ELAPSED)
+    assert report['total_core_hours'] == pytest.approx((PHONON_ELAPSED + nraman*RAMAN_ELAPSED) * CORES / 3600)
+    assert report['raman_pending'] == 0
+    assert 'projected_core_hours' not in report
+
+
+def test_projection_of_the_pending_calculations(project_dir):
+    pending = sorted((project_dir / RAMAN_DIR).iterdir())[-6:]
+    for directory in pending:
+        shutil.rmtree(directory)
+
+    report = Project(project_dir).cost(max_jobs=4)
+
+    assert report['raman_pending'] == 6
+    assert report['projected_core_hours'] == pytest.approx(6 * RAMAN_ELAPSED * CORES / 3600)
+    assert report['projected_wall_hours'] == pytest.approx(2 * RAMAN_ELAPSED / 3600)  # two waves of 4 jobs
+
+
+def test_timings_are_kept_after_archiving(project_dir):
+    project = Project(project_dir)
+    report = project.cost()
+
+    project.archive()
+    archived_report = project.cost()
+
+    assert (project_dir / COST_CACHE_FILE).exists()
+    assert archived_report['total_core_hours'] == pytest.approx(report['total_core_hours'])
+    assert archived_report['raman_pending'] == 0
@@ -0,0 +1,64 @@
+'''
+Tests of the vectorized generation of the displaced structures and of the
+POSCAR writer from a template
+'''
+
+import io
+import shutil
+
+import numpy as np
+from ase.constraints import FixAtoms
+from ase.io import read, write
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.benchmarks.synthetic import make_structure
+from xphon.calculations.raman import DISPS, get_poscar_template, format_poscar, write_displaced_POSCARS
+from xphon.calculations.utils import get_modes, read_input_parameters
+
+
+def _ase_poscar(atoms):
+    buffer = io.StringIO()
+    write(buffer, atoms, format='vasp')
+    return buffer.getvalue()
+
+
+def test_template_matches_ase_write():
+    atoms = make_structure(7)
+    positions = atoms.positions + np.random.default_rng(0).normal(scale=0.01, size=(7, 3))
+
+    for constrained in (False, True):
+        if constrained:
+            atoms.set_constraint(FixAtoms(indices=[0, 3]))
+        displaced = atoms.copy()
+        displaced.positions = positions
+
+        assert format_poscar(get_poscar_template(atoms), positions) == _ase_poscar(displaced)
+
+
+def test_displaced_poscars(project_dir, monkeypatch):
+    monkeypatch.setattr('xphon.calculations.raman.get_queued_jobs', dict)
+    shutil.rmtree(project_dir / RAMAN_DIR)
+    atoms, step_size, _, _ = read_input_parameters(str(project_dir))
+
+    dirs_to_run, labels, failures = write_displaced_POSCARS(atoms, step_size, str(project_dir))
+
+    modes = get_modes(str(project_dir / PHONONS_DIR))
+    assert labels == [f'{mode.id:04d}.{displacement:+d}' for mode in modes for displacement in DISPS]
+    assert dirs_to_run == [f'{RAMAN_DIR}/{label}' for label in labels]
+    assert failures == {}
+    for mode in modes:
+        for displacement in DISPS:
+            displaced = read(project_dir / RAMAN_DIR / f'{mode.id:04d}.{displacement:+d}' / 'POSCAR')
+            expected = atoms.positions + mode.eigvec * step_size * displacement / mode.norm
+            assert np.allclose(displaced.positions, expected, atol=1e-10)
+
+
+def test_complete_calculations_are_not_staged_again(project_dir, monkeypatch):
+    monkeypatch.setattr('xphon.calculations.raman.get_queued_jobs', dict)
+    shutil.rmtree(project_dir / RAMAN_DIR / '0010.-1')
+    atoms, step_size, _, _ = read_input_parameters(str(project_dir))
+
+    dirs_to_run, labels, _ = write_displaced_POSCARS(atoms, step_size, str(project_dir))
+
+    assert dirs_to_run == [f'{RAMAN_DIR}/0010.-1']
+    assert labels == ['0010.-1']
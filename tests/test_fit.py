@@ -0,0 +1,73 @@
+'''
+Tests of the fit of the computed spectra to experimental data
+'''
+
+import argparse
+
+import numpy as np
+import pytest
+
+from xphon.cli.fit import CLICommand
+from xphon.postprocess.broaden import get_broadened_spectrum
+from xphon.postprocess.fit import get_fit_scores, get_exact_score, get_uniform_grid
+from xphon.project import Project
+
+
+SCALE, SHIFT, FWHM = 0.97, 8.0, 12.0
+
+
+def _write_experiment(project_dir, function='lorentz'):
+    frequencies, intensities = Project(project_dir).ir_spectrum()
+    x = np.arange(50, 4000, 1.0)
+    _, y = get_broadened_spectrum(SCALE*frequencies + SHIFT, intensities, fwhm=FWHM, function=function, erange=x)
+    path = project_dir / 'experiment.dat'
+    np.savetxt(path, np.column_stack([x, 3*y]), header='freq intensity', comments='')
+    return frequencies, intensities, x, y
+
+
+@pytest.mark.parametrize('function', ['gauss', 'lorentz'])
+def test_fit_recovers_scale_shift_and_fwhm(project_dir, function):
+    _write_experiment(project_dir, function)
+
+    best = Project(project_dir).fit('ir', str(project_dir / 'experiment.dat'),
+                                    scales=np.arange(0.95, 1.0001, 0.005),
+                                    shift_range=(-20, 20),
+                                    fwhms=np.arange(4, 21, 2.0),
+                                    function=function,
+                                    step=1.0,
+                                    top=3)
+
+    assert best[0]['scale'] == pytest.approx(SCALE)
+    assert best[0]['shift'] == pytest.approx(SHIFT)
+    assert best[0]['fwhm'] == pytest.approx(FWHM)
+    assert best[0]['score'] == pytest.approx(1, abs=1e-6)
+    assert len(np.loadtxt(project_dir / 'ir_fit.dat', skiprows=1, ndmin=2)) == 3
+    assert (project_dir / 'ir_fit.png').exists()
+
+
+def test_grid_scores_match_exact_scores(project_dir):
+    frequencies, intensities, x, y = _write_experiment(project_dir)
+    scales, fwhms = np.array([0.96, 0.97, 0.99]), np.array([6.0, 12.0])
+
+    shifts, scores = get_fit_scores(frequencies, intensities, x, y, scales, (-10, 10), fwhms, step=1.0)
+
+    assert scores.shape == (len(scales), len(shifts), len(fwhms))
+    x_uniform, y_uniform = get_uniform_grid(x, y, 1.0)
+    for i, scale in enumerate(scales):
+        for j in (0, 7, 18):
+            for k, fwhm in enumerate(fwhms):
+                exact = get_exact_score(frequencies, intensities, x_uniform, y_uniform, scale, shifts[j], fwhm)
+                assert scores[i, j, k] == pytest.approx(exact, abs=1e-2)
+
+
+@pytest.mark.parametrize('args, message', [(['-scale', '1.1', '0.9', '0.01'], 'MIN 1.1 is greater than MAX 0.9'),
+                                           (['-fwhm', '2', '40', '0'], 'STEP 0 is not positive'),
+                                           (['-fwhm', '2', '40', '-1'], 'STEP -1 is not positive'),
+                                           (['-shift', '10', '-10'], 'MIN 10 is greater than MAX -10')])
+def test_cli_rejects_invalid_grids(args, message, capsys):
+    parser = argparse.ArgumentParser()
+    CLICommand.add_arguments(parser)
+
+    with pytest.raises(SystemExit):
+        parser.parse_args(['ir', 'exp.dat'] + args)
+    assert message in capsys.readouterr().err
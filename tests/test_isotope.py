@@ -0,0 +1,70 @@
+'''
+Tests of the isotope substitution from the cached Hessian
+'''
+
+import numpy as np
+import pytest
+from ase import units
+from ase.io import read
+
+from xphon.benchmarks.synthetic import make_structure, make_hessian
+from xphon.calculations.isotope import parse_masses, get_isotope_masses
+from xphon.project import Project
+
+
+def test_parse_masses():
+    assert parse_masses(['H=2.014', ' 3 = 13.003']) == {'H': 2.014, '3': 13.003}
+
+
+@pytest.mark.parametrize('spec', ['H', 'H=x', 'H=1=2', 'H=0', 'C=-12'])
+def test_parse_masses_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError, match='Invalid mass substitution'):
+        parse_masses([spec])
+
+
+def test_get_isotope_masses():
+    atoms = make_structure(8)
+    element = atoms.get_chemical_symbols()[0]
+    masses = get_isotope_masses(atoms, {element: 100.0, 2: 50.0})
+
+    expected = atoms.get_masses()
+    expected[np.array(atoms.get_chemical_symbols()) == element] = 100.0
+    expected[1] = 50.0  # indices take precedence over elements
+    assert np.array_equal(masses, expected)
+
+
+@pytest.mark.parametrize('substitutions, message', [({'Xe': 131.3}, 'Element Xe'),
+                                                    ({9: 2.0}, 'out of range'),
+                                                    ({1: 0.0}, 'atom 1'),
+                                                    ({'C': -1.0}, 'element C')])
+def test_get_isotope_masses_rejects_invalid_substitutions(substitutions, message):
+    with pytest.raises(ValueError, match=message):
+        get_isotope_masses(make_structure(8), substitutions)
+
+
+def test_unchanged_masses_give_the_ir_spectrum(project_dir):
+    project = Project(project_dir)
+    frequencies, intensities = project.ir_spectrum()
+    symbol = read(project_dir / 'POSCAR').get_chemical_symbols()[0]
+    mass = read(project_dir / 'POSCAR').get_masses()[0]
+
+    spectra = project.isotope_spectra({'same': {symbol: mass}})
+
+    assert np.allclose(spectra['same'][0], frequencies)
+    assert np.allclose(spectra['same'][1], intensities)
+    assert (project_dir / 'ir_spectrum_same.dat').read_text() == (project_dir / 'ir_spectrum.dat').read_text()
+
+
+def test_substituted_frequencies(project_dir):
+    atoms = read(project_dir / 'POSCAR')
+    masses = atoms.get_masses()
+    masses[0] *= 3
+
+    spectra = Project(project_dir).isotope_spectra({'heavy': {1: masses[0]}})
+
+    # frequencies from the Hessian of the generator, weighted with the new masses
+    weights = np.repeat(masses**-0.5, 3)
+    eigvals = np.linalg.eigvalsh(make_hessian(make_structure(len(atoms))) * weights * weights[:, np.newaxis])
+    to_invcm = units._hbar * 1e10 / np.sqrt(units._e * units._amu) / units.invcm
+    expected = np.sort(np.sqrt(np.abs(eigvals)) * to_invcm)[6:]
+    assert np.allclose(np.sort(spectra['heavy'][0])[-len(expected):], expected, rtol=1e-4)
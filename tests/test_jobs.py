@@ -0,0 +1,147 @@
+'''
+Tests of the concurrent asynchronous job submission, with fake submit commands
+'''
+
+import asyncio
+import time
+
+import pytest
+
+from xphon.calculations import jobs
+from xphon.calculations.jobs import submit_jobs, launch_jobs, read_submission_settings, SUBMISSION_DEFAULTS
+
+
+def _script(tmp_path, name, body):
+    '''
+    Fake submit command (run in the directory of the job)
+    '''
+    script = tmp_path / name
+    script.write_text('#!/bin/sh\n' + body)
+    script.chmod(0o755)
+    return str(script)
+
+
+def _job_dirs(tmp_path, njobs):
+    job_dirs = []
+    for i in range(njobs):
+        (tmp_path / f'job{i}').mkdir()
+        job_dirs.append(str(tmp_path / f'job{i}'))
+    return job_dirs
+
+
+def _submit(tmp_path, command, njobs=1, **settings):
+    job_dirs = _job_dirs(tmp_path, njobs)
+    ids_path = str(tmp_path / 'submitted_jobs.txt')
+    settings = {**SUBMISSION_DEFAULTS, 'rate': 0, 'backoff': 0.01, **settings}
+    return submit_jobs(job_dirs, [command]*njobs, [ids_path]*njobs, settings)
+
+
+def _calls(tmp_path, njobs=1):
+    return [int((tmp_path / f'job{i}' / 'calls').read_text()) for i in range(njobs)]
+
+
+# the script counts its calls in the directory of the job
+COUNT_CALLS = 'echo $(( $(cat calls 2>/dev/null || echo 0) + 1 )) > calls\n'
+
+
+def test_job_ids_in_order(tmp_path):
+    command = _script(tmp_path, 'sbatch.sh', 'sleep 0.$(( $(basename $PWD | tr -d job) % 3 ))\n'
+                                             'echo "Submitted batch job 10$(basename $PWD | tr -d job)"\n')
+
+    job_ids = _submit(tmp_path, command, njobs=6, max_in_flight=3)
+
+    assert job_ids == [100, 101, 102, 103, 104, 105]
+    ids = sorted(int(line) for line in (tmp_path / 'submitted_jobs.txt').read_text().split())
+    assert ids == job_ids
+
+
+def test_concurrency_and_rate_limits(tmp_path):
+    command = _script(tmp_path, 'sbatch.sh', 'sleep 0.2\necho "Submitted batch job 1"\n')
+
+    start = time.perf_counter()
+    _submit(tmp_path, command, njobs=4, max_in_flight=2)
+    assert time.perf_counter() - start > 0.35  # two waves of two jobs
+
+    (tmp_path / 'rate').mkdir()
+    start = time.perf_counter()
+    _submit(tmp_path / 'rate', command, njobs=4, max_in_flight=8, rate=10)
+    assert time.perf_counter() - start > 0.29  # 0.1 s between the submissions
+
+
+def test_retry_after_transient_error(tmp_path):
+    command = _script(tmp_path, 'sbatch.sh', COUNT_CALLS +
+                      'if [ $(cat calls) -lt 3 ]; then\n'
+                      '  echo "sbatch: error: Batch job submission failed: Unable to contact slurm controller" >&2\n'
+                      '  exit 1\n'
+                      'fi\n'
+                      'echo "Submitted batch job 42"\n')
+
+    assert _submit(tmp_path, command) == [42]
+    assert _calls(tmp_path) == [3]
+
+
+def test_no_retry_after_other_errors(tmp_path, capsys):
+    command = _script(tmp_path, 'sbatch.sh', COUNT_CALLS +
+                      'echo "sbatch: error: invalid partition specified: foo" >&2\nexit 1\n')
+
+    assert _submit(tmp_path, command) == [None]
+    assert _calls(tmp_path) == [1]
+    assert 'invalid partition' in capsys.readouterr().out
+    assert not (tmp_path / 'submitted_jobs.txt').read_text()
+
+
+def test_job_id_from_stdout_only(tmp_path):
+    command = _script(tmp_path, 'qsub.sh', 'echo "1234.pbs-server"\necho "warning: node 99" >&2\n')
+
+    assert _submit(tmp_path, command) == [1234]
+
+
+@pytest.mark.parametrize('queue, job_id', [('echo "5555 $PWD/job0"', 5555),   # accepted anyway
+                                           ('false', None)])                 # queue not available
+def test_ambiguous_error(tmp_path, monkeypatch, queue, job_id):
+    monkeypatch.setattr(jobs, 'QUEUE_COMMAND', queue.replace('$PWD', str(tmp_path)))
+    command = _script(tmp_path, 'sbatch.sh', COUNT_CALLS +
+                      'echo "sbatch: error: Socket timed out on send/recv operation" >&2\nexit 1\n')
+
+    assert _submit(tmp_path, command) == [job_id]
+    # not submitted again
+    assert _calls(tmp_path) == [1]
+
+
+def test_ambiguous_error_not_in_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'QUEUE_COMMAND', 'true')
+    command = _script(tmp_path, 'sbatch.sh', COUNT_CALLS +
+                      'if [ $(cat calls) -lt 2 ]; then\n'
+                      '  echo "sbatch: error: Socket timed out on send/recv operation" >&2\n'
+                      '  exit 1\n'
+                      'fi\n'
+                      'echo "Submitted batch job 7"\n')
+
+    assert _submit(tmp_path, command) == [7]
+    assert _calls(tmp_path) == [2]
+
+
+def test_launch_jobs_from_running_event_loop(project_dir, submit_command):
+    async def launch():
+        return launch_jobs(subdir_paths=['phonons'],
+                           jobscript_path=str(project_dir / 'jobscript.sh'),
+                           submit_command=submit_command,
+                           jobnames=['phon'],
+                           incar_tags='\n IBRION = 7\n',
+                           root=str(project_dir))
+
+    job_ids = asyncio.run(launch())
+
+    assert len(job_ids) == 1 and job_ids[0] is not None
+    assert (project_dir / 'submitted_jobs.txt').read_text() == f'{job_ids[0]}\n'
+    assert 'job-name=phon' in (project_dir / 'phonons' / 'jobscript.sh').read_text()
+    assert (project_dir / 'phonons' / 'INCAR').read_text().endswith('IBRION = 7\n')
+
+
+def test_submission_settings(tmp_path):
+    (tmp_path / 'settings.json').write_text('{"submission": {"rate": 2}}')
+    assert read_submission_settings(str(tmp_path)) == {**SUBMISSION_DEFAULTS, 'rate': 2}
+
+    (tmp_path / 'settings.json').write_text('{"submission": {"max_jobs": 2}}')
+    with pytest.raises(ValueError, match='Unknown keys'):
+        read_submission_settings(str(tmp_path))
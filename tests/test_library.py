@@ -0,0 +1,101 @@
+'''
+Tests of the spectral library and of the nearest-neighbour queries
+'''
+
+import argparse
+import os
+
+import numpy as np
+import pytest
+
+from xphon.cli.library import CLICommand
+from xphon.benchmarks.synthetic import write_synthetic_project
+from xphon.postprocess.broaden import get_broadened_spectrum
+from xphon.postprocess.library import update_library, read_library, query_library, find_projects
+from xphon.project import Project
+
+
+@pytest.fixture
+def projects(project_dir, tmp_path):
+    '''
+    Directory with four projects with IR and Raman spectra
+    '''
+    roots = [project_dir]
+    for seed in (1, 2, 3):
+        roots.append(tmp_path / f'conf{seed}')
+        write_synthetic_project(str(roots[-1]), 6, seed=seed)
+    for root in roots:
+        Project(root).ir_spectrum()
+        Project(root).raman_spectrum()
+    return roots
+
+
+def _query(root, spectrum='ir', shift=0.0):
+    '''
+    Spectrum of a project as it would be measured, broadened on a fine grid
+    '''
+    column = 3 if spectrum == 'ir' else 6
+    data = np.loadtxt(root / f'{spectrum}_spectrum.dat', skiprows=1, usecols=(2, column))
+    return get_broadened_spectrum(data[:, 0] + shift, data[:, 1], fwhm=10, erange=np.arange(100, 3800, 0.5))
+
+
+@pytest.mark.parametrize('spectrum', ['ir', 'raman'])
+def test_project_ranks_first(projects, tmp_path, spectrum):
+    library_dir = str(tmp_path / 'library')
+    assert update_library([str(tmp_path)], library_dir=library_dir) == (len(projects), 0)
+    library = read_library(library_dir)
+
+    for root in projects:
+        matches = query_library(*_query(root, spectrum), spectrum=spectrum, k=3, library=library)
+        assert len(matches) == 3
+        assert matches[0]['path'] == str(root)
+        assert matches[0]['score'] == pytest.approx(1, abs=1e-3)
+        assert matches[0]['score'] > matches[1]['score']
+
+
+def test_shift_metric(projects, tmp_path):
+    library_dir = str(tmp_path / 'library')
+    update_library([str(tmp_path)], library_dir=library_dir)
+
+    x, y = _query(projects[1], shift=10)
+    matches = query_library(x, y, metric='shift', max_shift=20, library_dir=library_dir)
+
+    assert matches[0]['path'] == str(projects[1])
+    assert matches[0]['shift'] == pytest.approx(10)
+    assert matches[0]['score'] > query_library(x, y, library_dir=library_dir)[0]['score']
+
+
+def test_incremental_update(projects, tmp_path):
+    library_dir = str(tmp_path / 'library')
+    update_library([str(tmp_path)], library_dir=library_dir)
+    assert update_library([str(tmp_path)], library_dir=library_dir) == (0, 0)
+
+    path = projects[2] / 'ir_spectrum.dat'
+    mtime = os.stat(path).st_mtime
+    os.utime(path, (mtime + 10, mtime + 10))
+    assert update_library([str(tmp_path)], library_dir=library_dir) == (0, 1)
+
+    index, spectra = read_library(library_dir)
+    assert len(index['entries']) == len(projects)
+    assert spectra['ir'].shape[0] == len(projects)
+    assert np.allclose(np.linalg.norm(spectra['ir'], axis=1), 1, atol=1e-5)
+
+
+def test_find_projects_skips_calculations(projects, tmp_path):
+    assert find_projects([str(tmp_path)]) == sorted(str(root) for root in projects)
+
+
+@pytest.mark.parametrize('grid_settings', [{'step': 0}, {'fwhm': -1}, {'fmin': 100, 'fmax': 50}])
+def test_invalid_grid(projects, tmp_path, grid_settings):
+    with pytest.raises(ValueError, match='Invalid grid'):
+        update_library([str(tmp_path)], library_dir=str(tmp_path / 'library'), grid_settings=grid_settings)
+
+
+@pytest.mark.parametrize('args', [['-step', '0'], ['-fwhm', '0'], ['-fwhm', '-2'], ['-k', '0']])
+def test_cli_rejects_non_positive_values(args, capsys):
+    parser = argparse.ArgumentParser()
+    CLICommand.add_arguments(parser)
+
+    with pytest.raises(SystemExit):
+        parser.parse_args(['add', '.'] + args)
+    assert 'is not positive' in capsys.readouterr().err
@@ -0,0 +1,55 @@
+'''
+Tests of the sparse mode-contribution matrix and of the peak-to-mode assignment
+'''
+
+import numpy as np
+import pytest
+
+from xphon.postprocess.broaden import get_broadened_spectrum, get_mode_contributions, assign_peaks
+from xphon.project import Project
+
+
+@pytest.mark.parametrize('function', ['gauss', 'lorentz'])
+def test_contributions_sum_to_broadened_spectrum(function):
+    rng = np.random.default_rng(0)
+    frequencies = np.sort(rng.uniform(100, 3000, size=50))
+    intensities = rng.uniform(0.1, 1, size=50)
+    erange = np.arange(0, 3200, 1.0)
+
+    _, spectrum = get_broadened_spectrum(frequencies, intensities, fwhm=10, function=function,
+                                         normalize=False, erange=erange)
+    contributions = get_mode_contributions(frequencies, intensities, erange, fwhm=10,
+                                           function=function, cutoff=1000)
+
+    assert contributions.shape == (len(erange), len(frequencies))
+    assert np.allclose(np.asarray(contributions.sum(axis=1)).ravel(), spectrum)
+
+
+def test_assign_peaks_to_nearest_mode():
+    frequencies = np.array([500.0, 505.0, 1500.0])
+    intensities = np.array([1.0, 0.2, 1.0])
+    erange = np.arange(0, 2000, 1.0)
+    contributions = get_mode_contributions(frequencies, intensities, erange, fwhm=10)
+
+    assignments = assign_peaks(contributions, peaks=np.array([500, 1500]),
+                               mode_ids=np.array([7, 8, 9]), max_modes=2)
+
+    assert [mode_id for mode_id, _ in assignments[0]] == [7, 8]
+    assert assignments[1][0][0] == 9
+    assert assignments[1][0][1] > 0.99
+    assert sum(weight for _, weight in assignments[0]) <= 1 + 1e-12
+
+
+def test_peak_assignment_table(project_dir):
+    project = Project(project_dir)
+    frequencies, _ = project.ir_spectrum()
+    project.plot('ir', broaden_type='lorentz', fwhm=5, show_peaks=True, assign_modes=1)
+
+    data = np.loadtxt(project_dir / 'ir_peaks.dat', skiprows=1, dtype=str, ndmin=2)
+    assert len(data) > 0
+    ids = np.loadtxt(project_dir / 'ir_spectrum.dat', skiprows=1, usecols=0, dtype=int)
+    for peak, _, assignment in data:
+        mode_id = int(assignment.split(':')[0])
+        assert mode_id in ids
+        # the dominant mode of a peak is close to it
+        assert abs(frequencies[list(ids).index(mode_id)] - float(peak)) < 20
@@ -0,0 +1,84 @@
+'''
+Tests of the polarized and orientation-resolved Raman intensities
+'''
+
+import numpy as np
+import pytest
+
+from xphon.calculations.raman import get_raman_data_for_mode
+from xphon.postprocess.polarized import CONFIGS, get_rotation_matrices, get_polarization_vectors, \
+    get_polarized_intensities, read_raman_tensors
+from xphon.project import Project
+
+
+def _orientation_average(raman_tensors, config):
+    '''
+    Average over all the orientations of the sample (ZYZ Euler angles), exact
+    for the fourth-degree polynomials of the rotation matrices
+    '''
+    cos_theta, weights = np.polynomial.legendre.leggauss(8)
+    angles = np.arange(16) * 360/16
+    phi, theta, psi = np.meshgrid(angles, np.rad2deg(np.arccos(cos_theta)), angles, indexing='ij')
+    weights = np.broadcast_to(weights[np.newaxis, :, np.newaxis], phi.shape).ravel()
+
+    rotations = get_rotation_matrices(phi.ravel(), theta.ravel(), psi.ravel())
+    e_in, e_out = get_polarization_vectors([0], config)
+    intensities = get_polarized_intensities(raman_tensors, rotations, e_in, e_out)[:, :, 0]
+
+    return intensities @ weights / weights.sum()
+
+
+def test_rotation_matrices_are_orthogonal():
+    rotations = get_rotation_matrices([0, 30, 250], [0, 45, 170], [10, 0, 90])
+
+    assert np.allclose(rotations @ rotations.transpose(0, 2, 1), np.eye(3))
+    assert np.allclose(np.linalg.det(rotations), 1)
+    assert np.allclose(get_rotation_matrices(90, 0), [[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+
+
+def test_orientation_average_equals_placzek_invariants(project_dir):
+    project = Project(project_dir)
+    project.raman_spectrum()
+    _, _, raman_tensors = read_raman_tensors(str(project_dir))
+    # also non-symmetric tensors, with antisymmetric anisotropy
+    raman_tensors = np.concatenate([raman_tensors, np.random.default_rng(0).normal(size=(4, 3, 3))])
+
+    invariants = np.array([get_raman_data_for_mode(ra)[:3] for ra in raman_tensors])
+    a, gamma2, delta2 = invariants.T
+
+    assert np.allclose(_orientation_average(raman_tensors, 'parallel'), (45*a**2 + 4*gamma2)/45)
+    assert np.allclose(_orientation_average(raman_tensors, 'crossed'), (3*gamma2 + 5*delta2)/45)
+
+
+def test_polarization_sweep(project_dir):
+    project = Project(project_dir)
+    frequencies, _, raman_tensors = project.raman_spectrum()
+
+    angles, intensities = project.polarization_sweep(npoints=5, mode_ids=[10, 12], plot=False)
+
+    assert np.array_equal(angles, [0, 90, 180, 270, 360])
+    ids = np.loadtxt(project_dir / 'raman_spectrum.dat', skiprows=1, usecols=0, dtype=int)
+    tensors = raman_tensors[[list(ids).index(10), list(ids).index(12)]]
+    # unrotated sample: xx and yy components for the parallel polarizations along x and y
+    assert np.allclose(intensities['parallel'][:, 0], tensors[:, 0, 0]**2)
+    assert np.allclose(intensities['parallel'][:, 1], tensors[:, 1, 1]**2)
+    assert np.allclose(intensities['crossed'][:, 0], tensors[:, 1, 0]**2)
+    table = np.loadtxt(project_dir / 'raman_polarization_sweep.dat', skiprows=1)
+    assert table.shape == (5, 1 + 2*len(CONFIGS))
+
+
+def test_orientation_map(project_dir):
+    project = Project(project_dir)
+    project.raman_spectrum()
+
+    theta, phi, intensities = project.orientation_map(ntheta=7, nphi=13, mode_ids=[10], plot_modes=[10])
+
+    assert intensities.shape == (1, 7, 13)
+    assert (project_dir / 'raman_orientation_map_010.png').exists()
+    with np.load(project_dir / 'raman_orientation_map.npz') as data:
+        assert np.array_equal(data['intensities'], intensities)
+        assert np.array_equal(data['theta'], theta)
+        assert np.array_equal(data['phi'], phi)
+
+    with pytest.raises(ValueError, match='not found'):
+        project.orientation_map(mode_ids=[999])
@@ -0,0 +1,61 @@
+'''
+Tests of the fast completion probe of the displacement outputs
+'''
+
+import numpy as np
+import pytest
+from ase.io import read
+
+from xphon.calculations import probe
+from xphon.calculations.probe import probe_calculation, read_epsilon_fast, \
+    MISSING, COMPLETE, INCOMPLETE, FAILED, UNKNOWN
+
+
+def test_read_epsilon_fast_matches_ase(project_dir):
+    vasprun_paths = sorted(project_dir.glob('raman_calcs/*/vasprun.xml')) + [project_dir / 'phonons' / 'vasprun.xml']
+
+    for path in vasprun_paths:
+        expected = read(path).calc.results['dielectric_tensor']
+        assert np.array_equal(read_epsilon_fast(str(path)), expected)
+
+
+def test_read_epsilon_fast_across_blocks(project_dir, monkeypatch):
+    path = str(project_dir / 'phonons' / 'vasprun.xml')
+    expected = read_epsilon_fast(path)
+
+    # the marker straddles the boundary of the blocks read backwards
+    monkeypatch.setattr(probe, 'BLOCK_BYTES', 7)
+    assert np.array_equal(read_epsilon_fast(path), expected)
+
+
+def test_read_epsilon_fast_without_dielectric_block(tmp_path):
+    path = tmp_path / 'vasprun.xml'
+    path.write_text('<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n</modeling>\n')
+
+    assert read_epsilon_fast(str(path)) is None
+
+
+def _truncate(path, fraction=0.5):
+    text = path.read_text()
+    path.write_text(text[:int(len(text)*fraction)])
+
+
+def _append(path, line):
+    with open(path, 'a') as f:
+        f.write(line)
+
+
+@pytest.mark.parametrize('modify, state', [
+    (lambda d: None, COMPLETE),
+    (lambda d: (d / 'vasprun.xml').unlink(), MISSING),
+    (lambda d: (_truncate(d / 'vasprun.xml'), _truncate(d / 'OUTCAR')), INCOMPLETE),
+    (lambda d: _truncate(d / 'vasprun.xml'), UNKNOWN),
+    (lambda d: _truncate(d / 'OUTCAR', 0.3), UNKNOWN),
+    (lambda d: _append(d / 'OUTCAR', ' ZBRENT: fatal error in bracketing\n'), FAILED),
+    (lambda d: _append(d / 'OUTCAR', ' EDIFF was not reached (unconverged)\n'), FAILED),
+])
+def test_probe_calculation(project_dir, modify, state):
+    directory = project_dir / 'raman_calcs' / '0010.+1'
+    modify(directory)
+
+    assert probe_calculation(str(directory)) == state
@@ -0,0 +1,56 @@
+'''
+Tests of the per-stage timing instrumentation
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+import pytest
+
+from xphon import profiling
+from xphon.profiling import Timer
+from xphon.project import Project
+
+
+@pytest.fixture
+def enabled():
+    profiling.enable()
+    yield
+    profiling.ENABLED = False
+    profiling._stats.clear()
+
+
+@Timer('test_stage')
+def _stage(x):
+    with Timer('test_stage.inner'):
+        return 2*x
+
+
+def test_disabled_timer_records_nothing():
+    assert not profiling.ENABLED
+    assert _stage(1) == 2
+    assert 'test_stage' not in profiling.get_stats()
+
+
+def test_timer_counts_calls_from_threads(enabled):
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(_stage, range(20))) == [2*x for x in range(20)]
+
+    stats = profiling.get_stats()
+    assert stats['test_stage']['calls'] == 20
+    assert stats['test_stage.inner']['calls'] == 20
+    assert stats['test_stage']['wall_time'] >= 0
+    assert stats['test_stage']['rss_growth_mb'] >= 0
+
+
+def test_report_of_the_pipeline_stages(enabled, project_dir, tmp_path):
+    Project(project_dir).ir_spectrum()
+
+    report_path = tmp_path / 'profile.json'
+    profiling.write_report(str(report_path))
+
+    with open(report_path) as f:
+        report = json.load(f)
+    assert report['peak_rss_mb'] > 0
+    assert report['stages']['write_ir_spectrum']['calls'] == 1
+    assert report['stages']['read_vibrations']['bytes_read'] >= 0
@@ -0,0 +1,62 @@
+'''
+Tests of the cwd-independent Project API
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+
+import numpy as np
+
+from xphon.benchmarks.synthetic import write_synthetic_project
+from xphon.project import Project
+
+
+def _process(project):
+    frequencies, intensities = project.ir_spectrum()
+    _, activities, _ = project.raman_spectrum()
+    project.plot('ir', broaden_type='gauss', fwhm=10)
+    return frequencies, intensities, activities
+
+
+def test_projects_in_threads(project_dir, tmp_path):
+    roots = [project_dir]
+    for seed in (1, 2, 3):
+        roots.append(tmp_path / f'project{seed}')
+        write_synthetic_project(str(roots[-1]), 5, seed=seed)
+    references = [tmp_path / f'reference{i}' for i in range(len(roots))]
+    for root, reference in zip(roots, references):
+        shutil.copytree(root, reference)
+    cwd = os.getcwd()
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(_process, map(Project, roots)))
+
+    assert os.getcwd() == cwd
+    for root, reference, result in zip(roots, references, results):
+        assert all(np.array_equal(a, b) for a, b in zip(result, _process(Project(reference))))
+        for filename in ('ir_spectrum.dat', 'raman_spectrum.dat', 'ir_spectrum_plotted.dat'):
+            assert (root / filename).read_text() == (reference / filename).read_text()
+        assert (root / 'ir_spectrum_broaden.png').exists()
+        assert not (tmp_path / 'ir_spectrum.dat').exists()
+
+
+def test_relative_root(project_dir, monkeypatch):
+    monkeypatch.chdir(project_dir.parent)
+    project = Project(project_dir.name)
+
+    frequencies, _ = project.ir_spectrum()
+
+    assert (project_dir / 'ir_spectrum.dat').exists()
+    assert project.phonons_dir == os.path.join(project_dir.name, 'phonons')
+    assert np.allclose(project.vibrations()[0].real[-len(frequencies):], frequencies)
+
+
+def test_arrays(project_dir):
+    project = Project(project_dir)
+
+    modes = project.modes()
+    assert project.born_charges().shape == (8, 3, 3)
+    assert project.epsilon().shape == (3, 3)
+    assert np.allclose(project.ir_spectrum()[0], [mode.frequency for mode in modes])
+    assert repr(project) == f'Project({str(project_dir)!r})'
@@ -0,0 +1,59 @@
+'''
+Tests of the multi-laser, multi-temperature Raman intensity table
+'''
+
+import numpy as np
+
+from xphon.project import Project
+
+
+LASER_FREQS = [15000.0, 18797.0, 20000.0]
+TEMPERATURES = (100, 300, 500)
+
+
+def _reference_intensity(x, y, laser_freq, temperature):
+    '''
+    Correction of a single laser frequency and temperature, as applied when plotting
+    '''
+    one_plus_n = 1/( 1 - np.exp(-1.9865e-23 * x / (1.38064852e-23 * temperature) ))
+    return y * one_plus_n/(30*x) * (x - laser_freq)**4
+
+
+def test_intensity_table(project_dir):
+    frequencies, activities, _ = Project(project_dir).raman_spectrum(laser_freqs=LASER_FREQS,
+                                                                     temperatures=TEMPERATURES)
+
+    with np.load(project_dir / 'raman_intensities.npz') as table:
+        assert np.array_equal(table['laser_freqs'], LASER_FREQS)
+        assert np.array_equal(table['temperatures'], TEMPERATURES)
+        assert np.allclose(table['frequencies'], frequencies)
+        assert np.allclose(table['activities'], activities)
+        intensities = table['intensities']
+
+    assert intensities.shape == (len(frequencies), len(LASER_FREQS), len(TEMPERATURES))
+    for i, laser_freq in enumerate(LASER_FREQS):
+        for j, temperature in enumerate(TEMPERATURES):
+            expected = _reference_intensity(frequencies, activities, laser_freq, temperature)
+            assert np.allclose(intensities[:, i, j], expected)
+
+
+def test_plot_uses_the_same_correction(project_dir):
+    project = Project(project_dir)
+    frequencies, _, _ = project.raman_spectrum(laser_freqs=[LASER_FREQS[1]], temperatures=[200])
+
+    x, y = project.plot('raman', laser_freq=LASER_FREQS[1], temperature=200)
+
+    with np.load(project_dir / 'raman_intensities.npz') as table:
+        expected = table['intensities'][:, 0, 0]
+    assert np.allclose(x, frequencies, atol=1e-5)
+    # the plot reads the frequencies rounded to 5 decimals from raman_spectrum.dat,
+    # which changes the Bose factor of the (near zero) rigid modes
+    vibrational = frequencies > 1
+    assert np.allclose(y[vibrational], expected[vibrational], rtol=1e-5)
+
+
+def test_no_table_without_lasers(project_dir):
+    Project(project_dir).raman_spectrum()
+
+    assert not (project_dir / 'raman_intensities.npz').exists()
+    assert (project_dir / 'raman_tensors.npz').exists()
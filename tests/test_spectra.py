@@ -0,0 +1,119 @@
+'''
+Tests of the IR and Raman spectra computed from the cached, memory-mapped
+eigenvectors, against a per-mode reference implementation (the one used before
+the eigenvector cache) reading everything with ASE.
+'''
+
+import os
+from math import pi
+
+import numpy as np
+from ase.io import read
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.calculations import utils
+from xphon.calculations.raman import DISPS, COEFFS
+from xphon.calculations.utils import read_vibrations, _read_ase_vibrations, FREQUENCIES_FILE, EIGENVECTORS_FILE
+from xphon.project import Project
+
+
+def _reference_modes(phonons_dir):
+    '''
+    (id, id_vasp, frequency, eigvec, norm) of the real modes, from ASE
+    '''
+    vibrations = _read_ase_vibrations(phonons_dir)
+    frequencies = vibrations.get_frequencies()
+    eigenvectors = vibrations.get_modes()
+    n = len(frequencies)
+    return [(i+1, n-i, frequencies[i].real, eigenvectors[i], np.linalg.norm(eigenvectors[i]))
+            for i in range(n) if frequencies[i].imag == 0]
+
+
+def _reference_ir(root):
+    modes = _reference_modes(f'{root}/{PHONONS_DIR}')
+    born_charges = read(f'{root}/{PHONONS_DIR}/vasprun.xml').calc.results['born_effective_charges']
+
+    rows = []
+    for mode_id, id_vasp, frequency, eigvec, _ in modes:
+        intensity = 0.0
+        for alpha in range(3):
+            innersums = 0.0
+            for l in range(len(born_charges)):
+                for beta in range(3):
+                    innersums += born_charges[l][alpha][beta]*eigvec[l][beta]
+            intensity += innersums**2
+        rows.append((mode_id, id_vasp, frequency, intensity))
+    return np.array(rows)
+
+
+def _reference_raman(root, step_size):
+    modes = _reference_modes(f'{root}/{PHONONS_DIR}')
+    volume = read(f'{root}/POSCAR').get_volume()
+
+    rows = []
+    for mode_id, id_vasp, frequency, _, norm in modes:
+        ra = np.zeros((3, 3))
+        for j, displacement in enumerate(DISPS):
+            vasprun = f'{root}/{RAMAN_DIR}/{mode_id:04d}.{displacement:+d}/vasprun.xml'
+            eps = read(vasprun).calc.results['dielectric_tensor']
+            ra += eps * COEFFS[j]/step_size * norm * volume/(4.0*pi)
+
+        a = 1./3 * np.trace(ra)
+        gamma2 = 1./2 * ((ra[0][0] - ra[1][1])**2 + (ra[0][0] - ra[2][2])**2 + (ra[1][1] - ra[2][2])**2) + \
+                 3./4 * ((ra[0][1] + ra[1][0])**2 + (ra[0][2] + ra[2][0])**2 + (ra[1][2] + ra[2][1])**2)
+        delta2 = 3./4 * ((ra[0][1] - ra[1][0])**2 + (ra[0][2] - ra[2][0])**2 + (ra[1][2] - ra[2][1])**2)
+        rows.append((mode_id, id_vasp, frequency, a, gamma2, delta2, 45.0*a**2 + 7.0*gamma2 + 5*delta2))
+    return np.array(rows)
+
+
+def test_ir_spectrum_matches_per_mode_reference(project_dir):
+    frequencies, intensities = Project(project_dir).ir_spectrum()
+
+    data = np.loadtxt(project_dir / 'ir_spectrum.dat', skiprows=1)
+    reference = _reference_ir(str(project_dir))
+
+    assert np.array_equal(data[:, :2], reference[:, :2])
+    assert np.allclose(data[:, 2:], reference[:, 2:], rtol=1e-6, atol=1e-5)  # values written with 5-7 decimals
+    assert np.allclose(frequencies, reference[:, 2])
+    assert np.allclose(intensities, reference[:, 3])
+
+
+def test_raman_spectrum_matches_per_mode_reference(project_dir):
+    frequencies, activities, raman_tensors = Project(project_dir).raman_spectrum()
+
+    data = np.loadtxt(project_dir / 'raman_spectrum.dat', skiprows=1)
+    reference = _reference_raman(str(project_dir), step_size=0.01)
+
+    assert np.array_equal(data[:, :2], reference[:, :2])
+    assert np.allclose(data[:, 2:], reference[:, 2:], rtol=1e-6, atol=1e-5)  # values written with 5-7 decimals
+    assert np.allclose(activities, reference[:, 6])
+    assert raman_tensors.shape == (len(frequencies), 3, 3)
+
+
+def test_chunked_ir_intensities(project_dir, monkeypatch):
+    project = Project(project_dir)
+    _, intensities = project.ir_spectrum()
+
+    # one eigenvector per chunk
+    monkeypatch.setattr(utils, 'CHUNK_BYTES', 1)
+    _, chunked = project.ir_spectrum()
+
+    assert np.array_equal(chunked, intensities)
+
+
+def test_eigenvector_cache(project_dir):
+    phonons_dir = str(project_dir / PHONONS_DIR)
+    frequencies, eigenvectors = read_vibrations(phonons_dir)
+    assert isinstance(eigenvectors, np.memmap)
+
+    reference = _read_ase_vibrations(phonons_dir)
+    assert np.allclose(frequencies, reference.get_frequencies())
+    assert np.allclose(eigenvectors, reference.get_modes(all_atoms=True))
+
+    # the cache is rebuilt when vasprun.xml is newer
+    cache = project_dir / PHONONS_DIR / FREQUENCIES_FILE
+    np.save(cache, np.zeros_like(frequencies))
+    mtime = os.stat(cache).st_mtime
+    os.utime(project_dir / PHONONS_DIR / 'vasprun.xml', (mtime + 10, mtime + 10))
+    assert np.allclose(read_vibrations(phonons_dir)[0], frequencies)
+    assert (project_dir / PHONONS_DIR / EIGENVECTORS_FILE).is_file()
@@ -0,0 +1,61 @@
+'''
+Tests of the vectorized trajectory writer and of the mode selection
+'''
+
+import numpy as np
+import pytest
+from ase.io import read
+
+from xphon import PHONONS_DIR
+from xphon.calculations.utils import read_vibrations, _read_ase_vibrations
+from xphon.postprocess.trajectories import select_modes
+from xphon.project import Project
+
+
+def test_select_modes():
+    frequencies = np.array([0, 0, 100, 200, 300j, 400], dtype=complex)
+
+    assert list(select_modes(frequencies)) == [2, 3, 4, 5]
+    assert list(select_modes(frequencies, mode_ids=[1, 3, 6])) == [2, 5]
+    assert list(select_modes(frequencies, freq_range=(150, 500))) == [3, 5]
+
+
+@pytest.mark.parametrize('mode_ids', [[0], [7], [-1, 2]])
+def test_select_modes_rejects_invalid_ids(mode_ids):
+    with pytest.raises(ValueError, match='Invalid mode ids'):
+        select_modes(np.arange(6, dtype=complex), mode_ids=mode_ids)
+
+
+def test_frames_match_ase_animation(project_dir):
+    project = Project(project_dir)
+    frequencies, _ = read_vibrations(project.phonons_dir)
+    mode_ids = list(select_modes(frequencies)[-3:] + 1)
+
+    project.write_trajectories(mode_ids=mode_ids, traj_format='npz')
+    with np.load(project_dir / 'trajectories' / 'modes.npz') as npz:
+        assert list(npz['mode_ids']) == mode_ids
+        frames = npz['positions']
+
+    vibrations = _read_ase_vibrations(str(project_dir / PHONONS_DIR))
+    for mode_id, mode_frames in zip(mode_ids, frames):
+        expected = [atoms.positions for atoms in vibrations.iter_animated_mode(mode_id - 1)]
+        assert np.allclose(mode_frames, expected)
+
+
+def test_output_formats_agree(project_dir):
+    project = Project(project_dir)
+    directory = project_dir / 'trajectories'
+    mode_ids = [10, 20]
+
+    project.write_trajectories(mode_ids=mode_ids, traj_format='npz')
+    project.write_trajectories(mode_ids=mode_ids, traj_format='single')
+    project.write_trajectories(mode_ids=mode_ids, traj_format='xyz')
+
+    with np.load(directory / 'modes.npz') as npz:
+        frames = npz['positions']
+    single = np.array([atoms.positions for atoms in read(directory / 'modes.xyz', ':')])
+    per_mode = np.concatenate([[atoms.positions for atoms in read(directory / f'{i}.xyz', ':')]
+                               for i in mode_ids])
+
+    assert np.allclose(single, frames.reshape(-1, *frames.shape[2:]), atol=1e-7)
+    assert np.allclose(per_mode, single)
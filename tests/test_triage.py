@@ -0,0 +1,50 @@
+'''
+Tests of the parsing and escalation of the time limits of the jobscripts
+'''
+
+import pytest
+
+from xphon.calculations.triage import _parse_walltime, _format_walltime, apply_escalation
+
+
+@pytest.mark.parametrize('walltime, seconds', [
+    ('90', 90*60),                          # M
+    ('90:30', 90*60 + 30),                  # M:S
+    ('1:30:15', 3600 + 30*60 + 15),         # H:M:S
+    ('1-12', 86400 + 12*3600),              # D-H
+    ('1-12:30', 86400 + 12*3600 + 30*60),   # D-H:M
+    ('1-12:30:15', 86400 + 12*3600 + 30*60 + 15),  # D-H:M:S
+])
+def test_parse_slurm_walltime(walltime, seconds):
+    assert _parse_walltime(walltime) == seconds
+
+
+@pytest.mark.parametrize('walltime, seconds', [
+    ('3600', 3600),          # S
+    ('30:00', 30*60),        # M:S
+    ('48:00:00', 48*3600),   # H:M:S
+])
+def test_parse_pbs_walltime(walltime, seconds):
+    assert _parse_walltime(walltime, pbs=True) == seconds
+
+
+@pytest.mark.parametrize('walltime', ['UNLIMITED', 'infinite', '1-x', '1:2:3:4'])
+def test_parse_non_numeric_walltime(walltime):
+    assert _parse_walltime(walltime) is None
+
+
+def test_format_walltime():
+    assert _format_walltime(86400 + 12*3600) == '1-12:00:00'
+    assert _format_walltime(48*3600, days_format=False) == '48:00:00'
+
+
+@pytest.mark.parametrize('line, escalated', [
+    ('#SBATCH --time=1-12\n', '#SBATCH --time=3-00:00:00\n'),
+    ('#SBATCH -t 90\n', '#SBATCH -t 03:00:00\n'),
+    ('#SBATCH --time=UNLIMITED\n', '#SBATCH --time=UNLIMITED\n'),
+    ('#PBS -l nodes=1:ppn=4,walltime=30:00\n', '#PBS -l nodes=1:ppn=4,walltime=01:00:00\n'),
+])
+def test_apply_walltime_escalation(tmp_path, line, escalated):
+    (tmp_path / 'jobscript.sh').write_text(f'#!/bin/bash\n{line}srun vasp_std\n')
+    apply_escalation(str(tmp_path), {'walltime_factor': 2, 'nodes_factor': 1, 'incar': {}})
+    assert (tmp_path / 'jobscript.sh').read_text() == f'#!/bin/bash\n{escalated}srun vasp_std\n'
@@ -0,0 +1,3 @@
+'''
+Synthetic projects and benchmarks of the xphon pipeline (no VASP needed).
+'''
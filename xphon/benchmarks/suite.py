@@ -0,0 +1,248 @@
+'''
+Benchmark suite for the xphon pipeline, running on synthetic projects
+(see xphon.benchmarks.synthetic), so that no VASP is needed.
+
+Every stage is timed for each system size, then run again under tracemalloc
+to measure its peak memory. The results are printed as a table, together with
+the fitted scaling exponent of each stage (t ~ N^k), and written to
+benchmark_results.json (and optionally plotted to benchmark_scaling.png).
+'''
+
+from __future__ import annotations
+from contextlib import redirect_stdout
+import glob
+import io
+import json
+import os
+import shutil
+import time
+import tracemalloc
+
+import numpy as np
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.benchmarks.synthetic import write_synthetic_project
+
+
+STAGES = ('get_modes',
+          'get_born_charges',
+          'get_epsilon',
+          'write_ir_spectrum',
+          'write_raman_spectrum',
+          'get_broadened_spectrum',
+          'write_displaced_POSCARS',
+          'launch_jobs')
+
+SCRATCH_DIR = 'scratch'
+FAKE_SUBMIT_SCRIPT = 'fake_submit.sh'
+
+
+def _prepare_scratch():
+    '''
+    Prepare an empty scratch project (sharing the input files and the
+    phonons/ directory of the current one) to write the displaced POSCARs
+    and launch the jobs with a fake submit script.
+    '''
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+    os.makedirs(SCRATCH_DIR)
+    for filename in ('INCAR', 'KPOINTS', 'POTCAR', 'POSCAR', 'settings.json', PHONONS_DIR):
+        os.symlink(os.path.abspath(filename), f'{SCRATCH_DIR}/{filename}')
+
+
+def _run_stage(stage : str):
+    '''
+    Run a stage of the pipeline in the current (synthetic project) directory.
+
+    Returns:
+    - calls: number of times the underlying function was called
+    '''
+
+    if stage == 'get_modes':
+        from xphon.calculations.utils import get_modes
+        get_modes(PHONONS_DIR)
+        return 1
+
+    if stage == 'get_born_charges':
+        from xphon.calculations.utils import get_born_charges
+        get_born_charges(f'{PHONONS_DIR}/vasprun.xml')
+        return 1
+
+    if stage == 'get_epsilon':
+        from xphon.calculations.utils import get_epsilon
+        files = sorted(glob.glob(f'{RAMAN_DIR}/*/vasprun.xml'))
+        for file in files:
+            get_epsilon(file)
+        return len(files)
+
+    if stage == 'write_ir_spectrum':
+        from xphon.calculations.ir import write_ir_spectrum
+        write_ir_spectrum()
+        return 1
+
+    if stage == 'write_raman_spectrum':
+        from xphon.calculations.raman import write_raman_spectrum
+        write_raman_spectrum()
+        return 1
+
+    if stage == 'get_broadened_spectrum':
+        from xphon.postprocess.broaden import get_broadened_spectrum
+        data = np.loadtxt('raman_spectrum.dat', skiprows=1, usecols=(2, 6))
+        get_broadened_spectrum(data[:, 0], data[:, 1], fwhm=10.0, function='lorentz')
+        return 1
+
+    if stage == 'write_displaced_POSCARS':
+        from xphon.calculations.raman import write_displaced_POSCARS
+        from xphon.calculations.utils import read_input_parameters
+        _prepare_scratch()
+        atoms, step_size, _, _ = read_input_parameters(SCRATCH_DIR)
+        dirs, _, _ = write_displaced_POSCARS(atoms, step_size, root=SCRATCH_DIR)
+        return len(dirs)
+
+    if stage == 'launch_jobs':
+        from xphon.calculations import jobs
+        from xphon.calculations.raman import INCAR_TAGS
+        from xphon.calculations.utils import read_input_parameters
+        _, _, jobscript_path, _ = read_input_parameters(SCRATCH_DIR)
+        dirs = sorted(os.path.relpath(d, SCRATCH_DIR)
+                      for d in glob.glob(f'{SCRATCH_DIR}/{RAMAN_DIR}/*'))
+        # fake scheduler, answering like sbatch
+        fake_submit = os.path.abspath(f'{SCRATCH_DIR}/{FAKE_SUBMIT_SCRIPT}')
+        with open(fake_submit, 'w') as f:
+            f.write('#!/bin/sh\necho "Submitted batch job $$"\n')
+        jobs.launch_jobs(subdir_paths=dirs,
+                         jobscript_path=jobscript_path,
+                         submit_command=f'sh {fake_submit}',
+                         jobnames=[os.path.basename(d) for d in dirs],
+                         incar_tags=INCAR_TAGS,
+                         root=SCRATCH_DIR,
+                         submission={'rate': 0})
+        return len(dirs)
+
+    raise ValueError(f"Unknown stage {stage}.")
+
+
+def _measure(stage : str, repeats : int = 1, memory : bool = True):
+    '''
+    Time a stage (best of repeats) and measure its peak memory with tracemalloc.
+    The output of the stage is suppressed.
+    '''
+
+    times = []
+    with redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            calls = _run_stage(stage)
+            times.append(time.perf_counter() - start)
+
+        peak = None
+        if memory:
+            tracemalloc.start()
+            _run_stage(stage)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    return {'time': min(times), 'calls': calls, 'peak_memory': peak}
+
+
+def _scaling_exponent(sizes : list[int], times : list[float]):
+    '''
+    Fitted exponent k of t ~ N^k (None if less than two sizes)
+    '''
+    if len(sizes) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(np.maximum(times, 1e-9)), 1)[0])
+
+
+def run_benchmarks(sizes : list[int],
+                   workdir : str = 'xphon_benchmark',
+                   stages : list[str] | None = None,
+                   repeats : int = 1,
+                   memory : bool = True,
+                   max_raman_modes : int | None = None,
+                   plot : bool = True,
+                   keep : bool = False):
+    '''
+    Generate a synthetic project for each size and time every stage of the pipeline.
+
+    Args:
+    - sizes: list of numbers of atoms
+    - workdir: directory where the synthetic projects are generated
+    - stages: stages to benchmark (default: all, see STAGES). Note that
+        get_broadened_spectrum needs write_raman_spectrum and launch_jobs
+        needs write_displaced_POSCARS.
+    - repeats: number of timed runs of each stage (the best one is reported)
+    - memory: whether to also measure the peak memory of each stage
+    - max_raman_modes: only generate the Raman displacements for the first
+        max_raman_modes modes (default: all)
+    - plot: whether to plot the scaling curves to benchmark_scaling.png
+    - keep: whether to keep the synthetic projects after the benchmark
+
+    Returns:
+    - results: dict {stage: {natoms: {'time', 'calls', 'peak_memory'}}}
+    '''
+
+    if repeats < 1:
+        raise ValueError("repeats must be at least 1.")
+    if not sizes or min(sizes) < 1:
+        raise ValueError("The numbers of atoms must be at least 1.")
+
+    # the stages depend on the outputs of the previous ones, so they are always run in order
+    stages = [stage for stage in STAGES if stages is None or stage in stages]
+    sizes = sorted(sizes)
+    results = {stage: {} for stage in stages}
+
+    main_dir = os.getcwd()
+    os.makedirs(workdir, exist_ok=True)
+
+    for natoms in sizes:
+        project_dir = f'{workdir}/N{natoms:05d}'
+        print(f'Generating synthetic project with {natoms} atoms in {project_dir}...')
+        shutil.rmtree(project_dir, ignore_errors=True)
+        write_synthetic_project(project_dir, natoms, max_raman_modes=max_raman_modes)
+
+        os.chdir(project_dir)
+        try:
+            for stage in stages:
+                print(f'  {stage}...', end=' ', flush=True)
+                results[stage][natoms] = _measure(stage, repeats=repeats, memory=memory)
+                print(f"{results[stage][natoms]['time']:.3f} s")
+        finally:
+            os.chdir(main_dir)
+
+        if not keep:
+            shutil.rmtree(project_dir)
+
+    # report
+    header = f"{'stage':<25}" + ''.join(f'{f"N={n}":>14}' for n in sizes) + f"{'exponent':>10}"
+    print('\nWall time (s)' + (' / peak memory (MB)' if memory else ''))
+    print(header)
+    summary = {}
+    for stage in stages:
+        times = [results[stage][n]['time'] for n in sizes]
+        exponent = _scaling_exponent(sizes, times)
+        summary[stage] = exponent
+        exp_str = f'{exponent:10.2f}' if exponent is not None else f"{'-':>10}"
+        print(f'{stage:<25}' + ''.join(f'{t:14.4f}' for t in times) + exp_str)
+        if memory:
+            peaks = [results[stage][n]['peak_memory']/1e6 for n in sizes]
+            print(f"{'':<25}" + ''.join(f'{p:14.2f}' for p in peaks))
+
+    with open('benchmark_results.json', 'w') as f:
+        json.dump({'sizes': sizes,
+                   'stages': {stage: {str(n): res for n, res in results[stage].items()}
+                              for stage in stages},
+                   'scaling_exponents': summary}, f, indent=4)
+    print('Results written to benchmark_results.json')
+
+    if plot:
+        import matplotlib.pyplot as plt
+
+        for stage in stages:
+            plt.loglog(sizes, [results[stage][n]['time'] for n in sizes], 'o-', label=stage)
+        plt.xlabel('Number of atoms')
+        plt.ylabel('Wall time (s)')
+        plt.legend(fontsize=7)
+        plt.savefig('benchmark_scaling.png', dpi=300, bbox_inches='tight')
+        print('Scaling curves saved in benchmark_scaling.png')
+
+    return results
@@ -0,0 +1,346 @@
+'''
+Generator of synthetic xphon projects, with fake (but realistic) VASP outputs
+in phonons/ and raman_calcs/, to test and benchmark the pipeline offline
+without running VASP.
+
+The structure is a random molecule-like cluster of N atoms in a box with vacuum,
+held together by harmonic springs between neighbouring atoms, so that the
+Hessian is symmetric, translationally invariant and has frequencies
+in the usual molecular range (~100-3500 cm-1).
+'''
+
+from __future__ import annotations
+import json
+import os
+
+import numpy as np
+from ase import Atoms
+from ase.constraints import FixAtoms
+from ase.io import write
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.calculations.raman import DISPS
+
+
+ELEMENTS = ('C', 'H', 'O', 'N')
+ELEMENT_WEIGHTS = (0.4, 0.4, 0.1, 0.1)
+
+INCAR = """ EDIFF = 1E-10
+ PREC = Accurate
+ NELMIN = 10
+ ISMEAR = 0
+ SIGMA = 0.01
+ ISYM = 0
+ LCHARG = .FALSE.
+ LWAVE = .FALSE.
+"""
+
+KPOINTS = """Gamma point only
+0
+Gamma
+1 1 1
+"""
+
+# header of a POTCAR entry, with the keys read by ASE (no actual pseudopotential)
+POTCAR_ENTRY = """  PAW_PBE {symbol} 08Apr2002
+   VRHFIN ={symbol}
+   LEXCH  = PE
+   TITEL  = PAW_PBE {symbol} 08Apr2002
+ End of Dataset
+"""
+
+JOBSCRIPT = """#!/bin/bash
+#SBATCH --job-name=xphon
+#SBATCH --nodes=1
+#SBATCH --ntasks-per-node=4
+#SBATCH --time=01:00:00
+
+mpirun vasp_std > vasp.out
+"""
+
+
+def make_structure(natoms : int, seed : int = 0):
+    '''
+    Random cluster of natoms atoms on a jittered cubic grid (~1.4 A spacing),
+    in a box with 8 A of vacuum.
+
+    Args:
+    - natoms: number of atoms
+    - seed: seed of the random number generator
+
+    Returns:
+    - atoms: ASE Atoms object
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    side = int(np.ceil(natoms**(1/3)))
+    grid = np.indices((side, side, side)).reshape(3, -1).T[:natoms]
+    positions = 1.4 * grid + rng.uniform(-0.15, 0.15, size=(natoms, 3))
+    symbols = rng.choice(ELEMENTS, size=natoms, p=ELEMENT_WEIGHTS)
+
+    atoms = Atoms(symbols, positions=positions, pbc=True)
+    atoms.center(vacuum=8.0)
+
+    return atoms
+
+
+def make_hessian(atoms : Atoms, cutoff : float = 2.1, seed : int = 0):
+    '''
+    Unweighted Hessian (eV/A^2) of a network of harmonic springs between
+    all the pairs of atoms closer than cutoff.
+
+    Args:
+    - atoms: ASE Atoms object
+    - cutoff: maximum distance for two atoms to be bonded
+    - seed: seed of the random number generator
+
+    Returns:
+    - hessian: (3N, 3N) array
+    '''
+
+    rng = np.random.default_rng(seed)
+    natoms = len(atoms)
+
+    dist = atoms.positions[:, np.newaxis, :] - atoms.positions[np.newaxis, :, :]
+    norms = np.linalg.norm(dist, axis=-1)
+    ii, jj = np.nonzero(np.triu((norms < cutoff) & (norms > 0)))
+
+    units = dist[ii, jj] / norms[ii, jj, np.newaxis]
+    k = rng.uniform(2.0, 40.0, size=len(ii))
+    blocks = k[:, np.newaxis, np.newaxis] * units[:, :, np.newaxis] * units[:, np.newaxis, :]
+
+    hessian = np.zeros((natoms, 3, natoms, 3))
+    np.add.at(hessian, (ii, slice(None), jj, slice(None)), -blocks)
+    np.add.at(hessian, (jj, slice(None), ii, slice(None)), -blocks)
+    np.add.at(hessian, (ii, slice(None), ii, slice(None)), blocks)
+    np.add.at(hessian, (jj, slice(None), jj, slice(None)), blocks)
+
+    return hessian.reshape(3*natoms, 3*natoms)
+
+
+def _varray(name : str, array : np.ndarray, indent : str = '  ', fmt : str = '%16.8f'):
+    '''
+    Format a 2D array as a vasprun.xml <varray>
+    '''
+    row_fmt = f'{indent} <v>' + ' '.join([fmt]*array.shape[1]) + ' </v>\n'
+    rows = (row_fmt * len(array)) % tuple(array.ravel())
+    return f'{indent}<varray name="{name}" >\n{rows}{indent}</varray>\n'
+
+
+def _structure_xml(atoms : Atoms, name : str | None = None):
+    '''
+    Format the structure block of vasprun.xml
+    '''
+    name_attr = f' name="{name}"' if name else ''
+    return (f' <structure{name_attr}>\n'
+            '  <crystal>\n'
+            + _varray('basis', atoms.cell.array, indent='   ') +
+            '  </crystal>\n'
+            + _varray('positions', atoms.get_scaled_positions(), indent='  ') +
+            ' </structure>\n')
+
+
+def write_vasprun(path : str,
+                  atoms : Atoms,
+                  epsilon : np.ndarray,
+                  born_charges : np.ndarray | None = None,
+                  hessian_mw : np.ndarray | None = None):
+    '''
+    Write a minimal vasprun.xml, with the same layout of the VASP one
+    for the blocks read by ASE (and xphon).
+
+    Args:
+    - path: path of the file to write
+    - atoms: structure
+    - epsilon: (3, 3) dielectric tensor
+    - born_charges: (N, 3, 3) Born effective charges (optional)
+    - hessian_mw: (3N, 3N) mass-weighted Hessian in VASP sign convention
+        (negative of ASE one), written in the <dynmat> block (optional)
+    '''
+
+    symbols = atoms.get_chemical_symbols()
+    species = list(dict.fromkeys(symbols))
+
+    parts = ['<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n',
+             ' <generator>\n  <i name="program" type="string">vasp </i>\n'
+             '  <i name="version" type="string">6.3.2  </i>\n </generator>\n',
+             ' <kpoints>\n'
+             '  <varray name="kpointlist" >\n   <v>       0.00000000       0.00000000       0.00000000 </v>\n  </varray>\n'
+             '  <varray name="weights" >\n   <v>       1.00000000 </v>\n  </varray>\n'
+             ' </kpoints>\n'
+             ' <atominfo>\n'
+             f'  <atoms>{len(atoms)}</atoms>\n'
+             f'  <types>{len(species)}</types>\n'
+             '  <array name="atoms" >\n'
+             '   <dimension dim="1">ion</dimension>\n'
+             '   <field type="string">element</field>\n'
+             '   <field type="int">atomtype</field>\n'
+             '   <set>\n'
+             + ''.join(f'    <rc><c>{s:2s}</c><c>{species.index(s)+1:4d}</c></rc>\n' for s in symbols) +
+             '   </set>\n'
+             '  </array>\n'
+             ' </atominfo>\n',
+             _structure_xml(atoms, name='initialpos'),
+             ' <calculation>\n',
+             '  <scstep>\n   <energy>\n'
+             '    <i name="e_fr_energy">   -100.00000000 </i>\n'
+             '    <i name="e_wo_entrp">   -100.00000000 </i>\n'
+             '    <i name="e_0_energy">   -100.00000000 </i>\n'
+             '   </energy>\n  </scstep>\n',
+             _structure_xml(atoms),
+             _varray('forces', np.zeros((len(atoms), 3)), indent='  '),
+             '  <energy>\n'
+             '   <i name="e_fr_energy">   -100.00000000 </i>\n'
+             '   <i name="e_wo_entrp">   -100.00000000 </i>\n'
+             '   <i name="e_0_energy">   -100.00000000 </i>\n'
+             '  </energy>\n']
+
+    if hessian_mw is not None:
+        eigvals, eigvecs = np.linalg.eigh(hessian_mw)
+        parts += ['  <dynmat>\n',
+                  _varray('hessian', hessian_mw, indent='   ', fmt='%14.8f'),
+                  '   <v name="eigenvalues">' + ' '.join(f'{e:14.8f}' for e in eigvals) + ' </v>\n',
+                  _varray('eigenvectors', eigvecs.T, indent='   ', fmt='%14.8f'),
+                  '  </dynmat>\n']
+
+    if born_charges is not None:
+        parts += ['  <array name="born_charges" >\n   <dimension dim="1">ion</dimension>\n']
+        parts += ['   <set>\n'
+                  + ''.join(f'    <v> {c[0]:12.5f} {c[1]:12.5f} {c[2]:12.5f} </v>\n' for c in charges)
+                  + '   </set>\n' for charges in born_charges]
+        parts += ['  </array>\n']
+
+    parts += [_varray('dielectric_dft', epsilon, indent='  '),
+              ' </calculation>\n',
+              _structure_xml(atoms, name='finalpos'),
+              '</modeling>\n']
+
+    with open(path, 'w') as f:
+        f.write(''.join(parts))
+
+
+def write_outcar(path : str, natoms : int, elapsed : float = 100.0, cores : int = 4):
+    '''
+    Write a minimal OUTCAR of a completed calculation, with the lines
+    read by ASE and the final timing summary.
+
+    Args:
+    - path: path of the file to write
+    - natoms: number of atoms
+    - elapsed: elapsed (wall) time in seconds
+    - cores: number of cores
+    '''
+
+    with open(path, 'w') as f:
+        f.write(f" vasp.6.3.2 18Feb22 (build Mar 01 2022 12:00:00) complex\n"
+                f" running on {cores:4d} total cores\n"
+                f"   NIONS = {natoms:7d}\n"
+                f"   number of dos      NEDOS =    301   number of ions     NIONS = {natoms:7d}\n"
+                f"   k-points           NKPTS =      1   k-points in BZ     NKDIM =      1"
+                f"   number of bands    NBANDS= {2*natoms+8:6d}\n"
+                "   EDIFF  = 0.1E-09   stopping-criterion for ELM\n"
+                "   NELM   =     60;   NELMIN= 10; NELMDL= -5     # of ELM steps\n"
+                "       total energy-change (2. order) :-0.1234567E-10  (-0.1111111E-10)\n"
+                " ------------------------ aborting loop because EDIFF is reached ----------------------------------------\n"
+                "\n\n"
+                " General timing and accounting informations for this job:\n"
+                " ========================================================\n"
+                "\n"
+                f"                  Total CPU time used (sec):     {elapsed*0.98:10.3f}\n"
+                f"                            User time (sec):     {elapsed*0.95:10.3f}\n"
+                f"                          System time (sec):     {elapsed*0.03:10.3f}\n"
+                f"                         Elapsed time (sec):     {elapsed:10.3f}\n")
+
+
+def write_synthetic_project(root : str,
+                            natoms : int,
+                            seed : int = 0,
+                            step_size : float = 0.01,
+                            raman : bool = True,
+                            max_raman_modes : int | None = None,
+                            active_atoms : list[int] | None = None):
+    '''
+    Write a synthetic xphon project in root: input files, phonons/ with a completed
+    IBRION=7 calculation and (optionally) raman_calcs/ with completed
+    calculations for all the displacements.
+
+    Args:
+    - root: directory of the project (created if it does not exist)
+    - natoms: number of atoms
+    - seed: seed of the random number generator
+    - step_size: step size written in settings.json
+    - raman: whether to write the raman_calcs/ tree
+    - max_raman_modes: only write the Raman displacements for the first
+        max_raman_modes modes (default: all)
+    - active_atoms: indices (starting from 1) of the active atoms, written to
+        settings.json; the phonon calculation only contains the partial Hessian
+        of these atoms (default: all atoms are active)
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    atoms = make_structure(natoms, seed=seed)
+    hessian = make_hessian(atoms, seed=seed)
+
+    # input files
+    os.makedirs(f'{root}/{PHONONS_DIR}', exist_ok=True)
+    write(f'{root}/POSCAR', atoms, format='vasp')
+    with open(f'{root}/INCAR', 'w') as f:
+        f.write(INCAR)
+    with open(f'{root}/KPOINTS', 'w') as f:
+        f.write(KPOINTS)
+    with open(f'{root}/POTCAR', 'w') as f:
+        f.write(''.join(POTCAR_ENTRY.format(symbol=symbol) for symbol in dict.fromkeys(atoms.symbols)))
+    with open(f'{root}/jobscript.sh', 'w') as f:
+        f.write(JOBSCRIPT)
+    settings = {'step_size': step_size,
+                'jobscript_path': os.path.abspath(f'{root}/jobscript.sh'),
+                'submit_command': 'sbatch'}
+    if active_atoms is not None:
+        settings['active_atoms'] = list(active_atoms)
+    with open(f'{root}/settings.json', 'w') as f:
+        json.dump(settings, f, indent=4)
+
+    # phonon calculation
+    epsilon0 = np.diag(rng.uniform(1.5, 3.0, size=3))
+    born_charges = rng.normal(scale=0.3, size=(natoms, 3, 3))
+    born_charges -= born_charges.mean(axis=0)  # acoustic sum rule
+
+    mass_weights = np.repeat(atoms.get_masses()**-0.5, 3)
+    hessian_mw = - hessian * mass_weights * mass_weights[:, np.newaxis]
+
+    nactive = natoms
+    if active_atoms is not None:
+        mask = np.ones(natoms, dtype=bool)
+        mask[np.array(active_atoms) - 1] = False
+        atoms.set_constraint(FixAtoms(mask=mask))
+        free = np.repeat(3*(np.array(sorted(active_atoms)) - 1), 3) + np.tile([0, 1, 2], len(active_atoms))
+        hessian_mw = hessian_mw[np.ix_(free, free)]
+        nactive = len(active_atoms)
+
+    for filename in ('POSCAR', 'CONTCAR'):
+        write(f'{root}/{PHONONS_DIR}/{filename}', atoms, format='vasp')
+    for filename in ('INCAR', 'KPOINTS', 'POTCAR'):
+        with open(f'{root}/{filename}') as fin, open(f'{root}/{PHONONS_DIR}/{filename}', 'w') as fout:
+            fout.write(fin.read())
+    write_vasprun(f'{root}/{PHONONS_DIR}/vasprun.xml', atoms, epsilon0,
+                  born_charges=born_charges, hessian_mw=hessian_mw)
+    write_outcar(f'{root}/{PHONONS_DIR}/OUTCAR', natoms, elapsed=50.0*natoms)
+
+    if not raman:
+        return
+
+    # displaced calculations: eps = eps0 + d(eps)/dQ * displacement, with a random
+    # symmetric derivative for each mode
+    nmodes = 3*nactive if max_raman_modes is None else min(3*nactive, max_raman_modes)
+    os.makedirs(f'{root}/{RAMAN_DIR}', exist_ok=True)
+    for mode_id in range(1, nmodes + 1):
+        deps = rng.normal(scale=0.05, size=(3, 3))
+        deps = (deps + deps.T) / 2
+        for displacement in DISPS:
+            subdir = f'{root}/{RAMAN_DIR}/{mode_id:04d}.{displacement:+d}'
+            os.makedirs(subdir, exist_ok=True)
+            write(f'{subdir}/POSCAR', atoms, format='vasp')
+            write_vasprun(f'{subdir}/vasprun.xml', atoms, epsilon0 + displacement*step_size*deps)
+            write_outcar(f'{subdir}/OUTCAR', natoms, elapsed=2.0*natoms)
@@ -0,0 +1,222 @@
+'''
+Archive of a finished project: everything xphon needs from the calculations
+(frequencies, eigenvectors, Hessian, Born charges and dielectric tensor from
+phonons/, and the dielectric tensors of all the displaced calculations from
+raman_calcs/) is extracted to a single binary file, xphon_archive.npz, and the
+raw outputs are packed in a (compressed) tarball, so that the directories with
+thousands of files can be deleted.
+
+The readers of utils and probe fall back to the archive when the vasprun.xml of
+a calculation is not present, so all the write/plot commands work transparently
+after archiving. The archive is an uncompressed npz, so that its arrays (e.g.
+the eigenvectors) can be memory-mapped directly from the file.
+'''
+
+from __future__ import annotations
+from functools import lru_cache
+import io
+import os
+import shutil
+import sys
+import tarfile
+import zipfile
+
+import numpy as np
+from ase import Atoms
+from ase.io import read
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.profiling import Timer
+
+
+ARCHIVE_FILE = 'xphon_archive.npz'
+RAW_TARBALL = 'xphon_raw_outputs.tar'
+COMPRESSIONS = ('gz', 'xz', 'none')
+
+
+def _memmap_member(path : str, zf : zipfile.ZipFile, name : str):
+    '''
+    Memory-map an array stored (uncompressed) in a npz file
+    '''
+    info = zf.getinfo(f'{name}.npy')
+    with open(path, 'rb') as f:
+        # local file header: 30 bytes, then file name and extra field
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+@lru_cache(maxsize=8)
+def _load_archive(path : str, mtime : float): #pylint: disable=unused-argument
+    '''
+    Load the archive (cached as long as the file is not modified).
+    Large arrays are memory-mapped, the small ones are read in memory.
+    '''
+    archive = {}
+    with zipfile.ZipFile(path) as zf, np.load(path) as data:
+        for name in data.files:
+            if zf.getinfo(f'{name}.npy').compress_type == zipfile.ZIP_STORED \
+                    and zf.getinfo(f'{name}.npy').file_size > 1024**2:
+                archive[name] = _memmap_member(path, zf, name)
+            else:
+                archive[name] = data[name]
+
+    archive['raman_index'] = {str(label): i for i, label in enumerate(archive['raman_labels'])}
+
+    return archive
+
+
+def get_archive(directory : str):
+    '''
+    Archive of the project containing directory, which can be the root
+    of the project, phonons/ or a directory in raman_calcs/.
+
+    Returns:
+    - archive: dict with the arrays of the archive, or None if there is no archive
+    '''
+    directory = os.path.normpath(directory)
+    if os.path.basename(directory) == PHONONS_DIR:
+        root = os.path.dirname(directory)
+    elif os.path.basename(os.path.dirname(directory)) == RAMAN_DIR:
+        root = os.path.dirname(os.path.dirname(directory))
+    else:
+        root = directory
+
+    path = os.path.join(root, ARCHIVE_FILE)
+    if not os.path.isfile(path):
+        return None
+
+    return _load_archive(os.path.abspath(path), os.stat(path).st_mtime)
+
+
+def read_archived_epsilon(directory : str):
+    '''
+    Dielectric tensor of the calculation in directory (phonons/ or raman_calcs/<label>)
+    from the archive, or None if not archived.
+    '''
+    archive = get_archive(directory)
+    if archive is None:
+        return None
+
+    directory = os.path.normpath(directory)
+    if os.path.basename(directory) == PHONONS_DIR:
+        return archive['epsilon']
+
+    index = archive['raman_index'].get(os.path.basename(directory))
+    return None if index is None else archive['raman_epsilons'][index]
+
+
+def read_archived_structure(directory : str) -> Atoms | None:
+    '''
+    Structure of the phonon calculation (with its constraints) of the project
+    containing directory, from the archive, or None if not archived.
+    '''
+    archive = get_archive(directory)
+    if archive is None:
+        return None
+    return read(io.StringIO(str(archive['poscar'])), format='vasp')
+
+
+@Timer('write_archive')
+def write_archive(root : str = '.', compression : str = 'gz'):
+    '''
+    Extract the data needed by xphon from phonons/ and raman_calcs/ to xphon_archive.npz,
+    pack the raw outputs in a tarball and delete the directories.
+    All the displaced calculations must be complete.
+
+    Args:
+    - root: directory of the project
+    - compression: compression of the tarball ('gz', 'xz' or 'none')
+    '''
+    from xphon.calculations.utils import read_vibrations, read_hessian, \
+        get_born_charges, get_epsilon
+    from xphon.calculations.cost import collect_timings
+
+    phonons_dir = os.path.join(root, PHONONS_DIR)
+    raman_dir = os.path.join(root, RAMAN_DIR)
+    archive_path = os.path.join(root, ARCHIVE_FILE)
+
+    if not os.path.isfile(f'{phonons_dir}/vasprun.xml'):
+        if os.path.isfile(archive_path):
+            sys.exit(f"The project is already archived in {archive_path}")
+        sys.exit(f"vasprun.xml file not found in {phonons_dir}")
+
+    # cache the timings of the calculations, which are kept after archiving
+    collect_timings(root)
+
+    print(f"Reading phonons from {phonons_dir}")
+    frequencies, eigenvectors = read_vibrations(phonons_dir)
+    _, hessian, indices = read_hessian(phonons_dir)
+    born_charges = get_born_charges(f'{phonons_dir}/vasprun.xml')
+    epsilon = get_epsilon(f'{phonons_dir}/vasprun.xml')
+    with open(f'{phonons_dir}/POSCAR') as f:
+        poscar = f.read()
+
+    labels = sorted(os.listdir(raman_dir)) if os.path.isdir(raman_dir) else []
+    print(f"Reading dielectric tensors of {len(labels)} calculations from {raman_dir}")
+    raman_epsilons = np.zeros((len(labels), 3, 3))
+    for i, label in enumerate(labels):
+        try:
+            raman_epsilons[i] = get_epsilon(f'{raman_dir}/{label}/vasprun.xml')
+        except Exception as e: #pylint: disable=broad-exception-caught
+            sys.exit(f"{raman_dir}/{label}: {e}. Complete the calculations before archiving.")
+
+    with Timer('write_archive.save'):
+        tmp_path = f'{archive_path}.tmp.npz'
+        np.savez(tmp_path,
+                 frequencies=frequencies,
+                 eigenvectors=eigenvectors,
+                 hessian=hessian,
+                 indices=indices,
+                 born_charges=np.asarray(born_charges),
+                 epsilon=np.asarray(epsilon),
+                 poscar=np.array(poscar),
+                 raman_labels=np.array(labels, dtype=str),
+                 raman_epsilons=raman_epsilons)
+        os.replace(tmp_path, archive_path)
+    print(f"Data written to {archive_path}")
+
+    mode = 'w' if compression == 'none' else f'w:{compression}'
+    tarball = os.path.join(root, RAW_TARBALL + ('' if compression == 'none' else f'.{compression}'))
+    print(f"Packing raw outputs in {tarball}...")
+    with Timer('write_archive.pack'), tarfile.open(tarball, mode) as tar:
+        tar.add(phonons_dir, arcname=PHONONS_DIR)
+        if labels:
+            tar.add(raman_dir, arcname=RAMAN_DIR)
+
+    shutil.rmtree(phonons_dir)
+    if os.path.isdir(raman_dir):
+        shutil.rmtree(raman_dir)
+    print(f"Directories {PHONONS_DIR} and {RAMAN_DIR} deleted.")
+
+
+def restore_archive(root : str = '.'):
+    '''
+    Extract the raw outputs from the tarball, and delete tarball and archive.
+    '''
+    for compression in COMPRESSIONS:
+        tarball = os.path.join(root, RAW_TARBALL + ('' if compression == 'none' else f'.{compression}'))
+        if os.path.isfile(tarball):
+            break
+    else:
+        sys.exit(f"No {RAW_TARBALL} file found in {root}")
+
+    print(f"Extracting raw outputs from {tarball}...")
+    with tarfile.open(tarball) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(root, filter='data')
+        else:
+            tar.extractall(root)
+
+    os.remove(tarball)
+    os.remove(os.path.join(root, ARCHIVE_FILE))
+    print("Raw outputs restored.")
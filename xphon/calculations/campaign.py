@@ -0,0 +1,372 @@
+'''
+Campaign mode: IR and Raman calculations for many structures (e.g. conformers
+or adsorption sites), each in its own project directory with the usual input
+files (INCAR, POSCAR, KPOINTS, POTCAR, settings.json).
+
+All the structures share a single submission queue and a maximum number of
+jobs in the scheduler queue at the same time. The campaign is a polling loop:
+at each step the state of every structure is updated from the scheduler and
+from the output files, and new jobs are submitted within the budget.
+For each structure:
+1) the phonon calculation is submitted;
+2) as soon as it is finished, the IR spectrum is written and the
+   displaced calculations for Raman are staged and queued;
+3) when all of them are finished, the Raman spectrum is written.
+Phonon calculations have priority in the queue, since they unlock the
+Raman stage of their structure. Finally, all the spectra are broadened on
+a common frequency grid and collected in campaign_ir.dat and campaign_raman.dat.
+
+The state of the campaign is saved in campaign_state.json after each step,
+so that an interrupted campaign can be resumed by running it again.
+'''
+
+from __future__ import annotations
+from dataclasses import dataclass, field, asdict
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from xphon import PHONONS_DIR
+from xphon.calculations import jobs
+from xphon.calculations.ir import prepare_ir_calculation, write_ir_spectrum, \
+    INCAR_TAGS as IR_INCAR_TAGS
+from xphon.calculations.raman import write_displaced_POSCARS, write_raman_spectrum, \
+    INCAR_TAGS as RAMAN_INCAR_TAGS
+from xphon.calculations.probe import probe_calculation, COMPLETE, UNKNOWN
+from xphon.calculations.triage import triage, get_escalations, record_resubmissions
+from xphon.calculations.utils import read_input_parameters
+from xphon.postprocess.broaden import get_broadened_spectrum
+
+
+# stages of a structure
+IR = 'ir'
+RAMAN = 'raman'
+DONE = 'done'
+FAILED = 'failed'
+
+STATE_FILE = 'campaign_state.json'
+
+@dataclass
+class Structure:
+    '''
+    State of a structure of the campaign
+    '''
+    directory: str
+    stage: str = IR
+    jobs: dict = field(default_factory=dict)         # subdir: id of the job in the scheduler queue
+    queued: list = field(default_factory=list)       # subdirs waiting to be submitted
+    submissions: dict = field(default_factory=dict)  # subdir: number of submissions
+    failed: list = field(default_factory=list)       # subdirs given up
+    failures: dict = field(default_factory=dict)     # subdir: failure, for the queued resubmissions
+
+    @property
+    def name(self):
+        return os.path.basename(os.path.normpath(self.directory))
+
+
+def read_manifest(manifest_path : str):
+    '''
+    Read the list of structure directories from the manifest, either a json file
+    with a list of directories (or a dict with the key "structures"),
+    or a text file with one directory per line (# for comments).
+    Relative paths are relative to the directory of the manifest.
+
+    Returns:
+    - directories: list of absolute paths
+    '''
+
+    with open(manifest_path) as f:
+        if manifest_path.endswith('.json'):
+            directories = json.load(f)
+            if isinstance(directories, dict):
+                directories = directories['structures']
+        else:
+            directories = [line.split('#')[0].strip() for line in f]
+            directories = [d for d in directories if d]
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    directories = [os.path.normpath(os.path.join(base_dir, d)) for d in directories]
+
+    for directory in directories:
+        if not os.path.isfile(f'{directory}/settings.json'):
+            sys.exit(f"settings.json file not found in {directory}")
+
+    if len({os.path.basename(d) for d in directories}) != len(directories):
+        raise ValueError("The names of the structure directories must be unique.")
+
+    return directories
+
+
+def load_state(directories : list[str], state_path : str = STATE_FILE):
+    '''
+    Initialize the structures of the campaign, restoring the state
+    saved by a previous run if present.
+    '''
+    saved = {}
+    if os.path.isfile(state_path):
+        print(f"Resuming campaign from {state_path}")
+        with open(state_path) as f:
+            saved = json.load(f)
+
+    return [Structure(**saved[d]) if d in saved else Structure(directory=d)
+            for d in directories]
+
+
+def save_state(structures : list[Structure], state_path : str = STATE_FILE):
+    '''
+    Save the state of the campaign to a json file
+    '''
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({s.directory: asdict(s) for s in structures}, f, indent=4)
+    os.replace(tmp_path, state_path)
+
+
+def _requeue(structure : Structure, subdirs : list[str]):
+    '''
+    Put failed calculations back in the queue, unless they failed too many times
+    (see triage)
+    '''
+    failures, given_up = triage(subdirs, structure.directory)
+    structure.queued.extend(failures)
+    structure.failures.update(failures)
+    structure.failed.extend(given_up)
+
+
+def _finish_ir_stage(structure : Structure):
+    '''
+    Write the IR spectrum and stage the displaced calculations for Raman.
+    Returns False if the phonon calculation could not be read.
+    '''
+
+    root = structure.directory
+    try:
+        write_ir_spectrum(root)
+    except Exception as e: #pylint: disable=broad-exception-caught
+        print(f"{structure.name}: {PHONONS_DIR}/vasprun.xml could not be read ({e}).")
+        return False
+
+    atoms, step_size, _, _ = read_input_parameters(root)
+    dirs_to_run, _, failures = write_displaced_POSCARS(atoms, step_size, root)
+    structure.queued.extend(d for d in dirs_to_run if d not in structure.jobs)
+    structure.failures.update(failures)
+    structure.stage = RAMAN
+    print(f"{structure.name}: phonons done, {len(dirs_to_run)} Raman calculations queued.")
+
+    return True
+
+
+def update_structure(structure : Structure, running_jobs : set[int]):
+    '''
+    Advance the state of a structure, checking which of its jobs have left
+    the scheduler queue and whether they completed successfully.
+    '''
+    root = structure.directory
+
+    finished = [subdir for subdir, job_id in structure.jobs.items() if job_id not in running_jobs]
+    for subdir in finished:
+        del structure.jobs[subdir]
+
+    if structure.stage == IR:
+        if PHONONS_DIR in structure.jobs or PHONONS_DIR in structure.queued:
+            return
+        state = probe_calculation(f'{root}/{PHONONS_DIR}')
+        if state not in (COMPLETE, UNKNOWN) or not _finish_ir_stage(structure):
+            if PHONONS_DIR in structure.submissions:
+                failures, given_up = triage([PHONONS_DIR], root)
+                if given_up:
+                    print(f"{structure.name}: phonon calculation failed too many times, giving up.")
+                    structure.stage = FAILED
+                    return
+                structure.failures.update(failures)
+            atoms, _, _, _ = read_input_parameters(root)
+            prepare_ir_calculation(atoms, root)
+            structure.queued.append(PHONONS_DIR)
+            return
+
+    if structure.stage == RAMAN:
+        _requeue(structure, [subdir for subdir in finished if subdir != PHONONS_DIR
+                             and probe_calculation(f'{root}/{subdir}') not in (COMPLETE, UNKNOWN)])
+
+        if not structure.jobs and not structure.queued:
+            if structure.failed:
+                print(f"{structure.name}: {len(structure.failed)} Raman calculations failed, "\
+                      "Raman spectrum not written.")
+                structure.stage = FAILED
+                return
+            try:
+                write_raman_spectrum(root=root)
+            except Exception as e: #pylint: disable=broad-exception-caught
+                # a calculation that looked complete could not be read: run again the Raman stage
+                print(f"{structure.name}: Raman spectrum could not be written ({e}).")
+                atoms, step_size, _, _ = read_input_parameters(root)
+                dirs_to_run, _, failures = write_displaced_POSCARS(atoms, step_size, root)
+                if not dirs_to_run:
+                    structure.stage = FAILED
+                structure.queued.extend(dirs_to_run)
+                structure.failures.update(failures)
+                return
+            structure.stage = DONE
+            print(f"{structure.name}: done.")
+
+
+def submit_queued(structures : list[Structure], budget : int, settings : dict):
+    '''
+    Submit up to budget queued calculations, phonon calculations first,
+    then the Raman ones in the order of the structures.
+    The calculations of all the structures are staged, then submitted together
+    by a single submitter, sharing its concurrency and rate limits (see jobs.submit_jobs).
+
+    Args:
+    - structures: structures of the campaign
+    - budget: maximum number of jobs to submit
+    - settings: settings of the submitter (see jobs.read_submission_settings)
+
+    Returns:
+    - number of submitted jobs
+    '''
+
+    phonon_first = sorted(((subdir != PHONONS_DIR, i, subdir)
+                           for i, s in enumerate(structures) for subdir in s.queued))[:max(budget, 0)]
+
+    groups = []  # (structure, subdirs, failures)
+    job_dirs, submit_commands, ids_paths = [], [], []
+    for i, structure in enumerate(structures):
+        subdirs = [subdir for _, j, subdir in phonon_first if j == i]
+        if not subdirs:
+            continue
+
+        _, _, jobscript_path, submit_command = read_input_parameters(structure.directory)
+        for incar_tags, group in ((IR_INCAR_TAGS, [d for d in subdirs if d == PHONONS_DIR]),
+                                  (RAMAN_INCAR_TAGS, [d for d in subdirs if d != PHONONS_DIR])):
+            if not group:
+                continue
+            labels = ['phon' if d == PHONONS_DIR else os.path.basename(d) for d in group]
+            failures = {d: structure.failures.pop(d) for d in group if d in structure.failures}
+            job_dirs += jobs.stage_jobs(subdir_paths=group,
+                                        jobscript_path=jobscript_path,
+                                        jobnames=[f'{structure.name}.{label}' for label in labels],
+                                        incar_tags=incar_tags,
+                                        root=structure.directory,
+                                        escalations=get_escalations(failures, structure.directory))
+            submit_commands += [submit_command] * len(group)
+            ids_paths += [f'{structure.directory}/submitted_jobs.txt'] * len(group)
+            groups.append((structure, group, failures))
+
+    if not job_dirs:
+        return 0
+
+    # in TEST mode no job ids are returned
+    job_ids = jobs.submit_jobs(job_dirs, submit_commands, ids_paths, settings) or [None]*len(job_dirs)
+
+    start = 0
+    for structure, group, failures in groups:
+        group_ids = job_ids[start:start + len(group)]
+        start += len(group)
+        record_resubmissions(failures, group, group_ids, structure.directory)
+        for subdir, job_id in zip(group, group_ids):
+            structure.jobs[subdir] = job_id
+            structure.submissions[subdir] = structure.submissions.get(subdir, 0) + 1
+            structure.queued.remove(subdir)
+
+    return len(job_dirs)
+
+
+def write_comparison_tables(structures : list[Structure],
+                            fwhm : float = 10,
+                            function : str = 'lorentz',
+                            directory : str = '.'):
+    '''
+    Broaden the spectra of all the structures on a common frequency grid
+    and write them side by side to campaign_ir.dat and campaign_raman.dat
+    in directory.
+    Each spectrum is normalized to a maximum of 1.
+    '''
+    from xphon.postprocess.plot import COLUMNS
+
+    for spectrum, columns in COLUMNS.items():
+        names, data = [], []
+        for structure in structures:
+            filename = f'{structure.directory}/{spectrum}_spectrum.dat'
+            if os.path.isfile(filename):
+                names.append(structure.name)
+                data.append(np.loadtxt(filename, skiprows=1, usecols=columns, ndmin=2))
+
+        if not data:
+            continue
+
+        frequencies = np.concatenate([d[:, 0] for d in data])
+        fmin = max(frequencies.min() - 5*fwhm, 0)
+        fmax = frequencies.max() + 5*fwhm
+        erange = np.arange(fmin, fmax, fwhm/10)
+
+        table = [erange]
+        for d in data:
+            _, intensities = get_broadened_spectrum(d[:, 0], d[:, 1], fwhm=fwhm,
+                                                    function=function, erange=erange)
+            table.append(intensities)
+
+        filename = os.path.join(directory, f'campaign_{spectrum}.dat')
+        np.savetxt(filename, np.column_stack(table), fmt='%.6f',
+                   header='freq(cm-1)  ' + '  '.join(names), comments='')
+        print(f"{spectrum.upper()} spectra of {len(names)} structures written to {filename}")
+
+
+def run_campaign(manifest_path : str,
+                 max_jobs : int = 50,
+                 poll_interval : float = 60,
+                 once : bool = False,
+                 fwhm : float = 10,
+                 function : str = 'lorentz'):
+    '''
+    Run the IR and Raman calculations for all the structures of the manifest.
+    The state of the campaign and the comparison tables are written in the
+    directory of the manifest, where an optional settings.json can set the
+    limits of the submitter shared by all the structures (key "submission",
+    see jobs.read_submission_settings).
+
+    Args:
+    - manifest_path: file with the list of structure directories (see read_manifest)
+    - max_jobs: maximum number of jobs of the campaign in the scheduler queue at the same time
+    - poll_interval: time in seconds between two checks of the scheduler queue
+    - once: only do a single step (update the states and submit), e.g. to run
+        the campaign from a cron job, or with jobs.TEST
+    - fwhm, function: broadening of the spectra in the comparison tables
+    '''
+
+    if max_jobs < 1:
+        raise ValueError("max_jobs must be at least 1.")
+
+    campaign_dir = os.path.dirname(os.path.abspath(manifest_path))
+    state_path = os.path.join(campaign_dir, STATE_FILE)
+    settings = jobs.read_submission_settings(campaign_dir)
+
+    structures = load_state(read_manifest(manifest_path), state_path)
+    print(f"Campaign of {len(structures)} structures, at most {max_jobs} jobs at the same time.")
+
+    while True:
+        running_jobs = set(jobs.get_running_jobs()) if not jobs.TEST else set()
+
+        for structure in structures:
+            if structure.stage in (DONE, FAILED):
+                continue
+            update_structure(structure, running_jobs)
+
+        in_flight = sum(len(s.jobs) for s in structures)
+        nsubmitted = submit_queued(structures, max_jobs - in_flight, settings)
+        save_state(structures, state_path)
+
+        stages = [s.stage for s in structures]
+        nqueued = sum(len(s.queued) for s in structures)
+        print(f"[{time.strftime('%H:%M:%S')}] {stages.count(IR)} phonons, {stages.count(RAMAN)} Raman, "\
+              f"{stages.count(DONE)} done, {stages.count(FAILED)} failed; "\
+              f"{in_flight + nsubmitted} jobs in the queue, {nqueued} waiting.", flush=True)
+
+        if once or all(stage in (DONE, FAILED) for stage in stages):
+            break
+        time.sleep(poll_interval)
+
+    write_comparison_tables(structures, fwhm=fwhm, function=function, directory=campaign_dir)
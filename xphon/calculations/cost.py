@@ -0,0 +1,231 @@
+'''
+Core-hour accounting of the finished calculations, and projection of the
+cost of the pending ones.
+
+The timing summary ("Total CPU time used", "Elapsed time") at the end of
+OUTCAR and the number of cores at its beginning are read for every finished
+calculation in phonons/ and raman_calcs/. The numbers are cached in
+cost_cache.json, so that each OUTCAR is read only once (as long as it is not
+modified), and the cached timings of archived calculations are kept.
+'''
+
+from __future__ import annotations
+import json
+import math
+import os
+import re
+
+import numpy as np
+from ase.vibrations import VibrationsData
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.calculations.probe import read_tail, probe_calculation, COMPLETE
+from xphon.calculations.raman import DISPS
+from xphon.calculations.utils import get_modes, read_input_parameters
+from xphon.profiling import Timer
+
+
+COST_CACHE_FILE = 'cost_cache.json'
+COST_REPORT_FILE = 'cost_report.json'
+COST_JOBS_FILE = 'cost_jobs.dat'
+
+HEAD_BYTES = 64 * 1024
+
+CPU_TIME_RE = re.compile(r'Total CPU time used \(sec\):\s+([\d.]+)')
+ELAPSED_RE = re.compile(r'Elapsed time \(sec\):\s+([\d.]+)')
+CORES_RE = (re.compile(r'running on\s+(\d+) total cores'),                   # vasp 5
+            re.compile(r'running\s+(\d+) mpi-ranks,\s+with\s+(\d+) threads/rank'))  # vasp 6
+
+
+def read_head(path : str, nbytes : int = HEAD_BYTES):
+    '''
+    Read the first nbytes of a file, as text.
+    '''
+    with open(path, 'rb') as f:
+        return f.read(nbytes).decode('latin-1')
+
+
+def read_outcar_timing(outcar_path : str):
+    '''
+    Read the timing summary of a finished calculation from OUTCAR.
+
+    Returns:
+    - timing: dict with elapsed and cpu_time (s) and cores,
+        or None if the timing summary is not present
+    '''
+
+    tail = read_tail(outcar_path)
+    elapsed = ELAPSED_RE.search(tail)
+    if elapsed is None:
+        return None
+    cpu_time = CPU_TIME_RE.search(tail)
+
+    cores = None
+    head = read_head(outcar_path)
+    for regex in CORES_RE:
+        match = regex.search(head)
+        if match is not None:
+            cores = int(np.prod([int(group) for group in match.groups()]))
+            break
+
+    return {'elapsed': float(elapsed.group(1)),
+            'cpu_time': float(cpu_time.group(1)) if cpu_time else None,
+            'cores': cores}
+
+
+def _job_dirs(root : str):
+    '''
+    Directories (relative to root) of the calculations of the project
+    '''
+    job_dirs = [PHONONS_DIR] if os.path.isdir(os.path.join(root, PHONONS_DIR)) else []
+    raman_dir = os.path.join(root, RAMAN_DIR)
+    if os.path.isdir(raman_dir):
+        job_dirs += sorted(f'{RAMAN_DIR}/{entry.name}' for entry in os.scandir(raman_dir) if entry.is_dir())
+    return job_dirs
+
+
+@Timer('collect_timings')
+def collect_timings(root : str = '.'):
+    '''
+    Timings of all the finished calculations of the project,
+    read from the OUTCARs or from the cache.
+
+    Returns:
+    - timings: dict {job directory: {elapsed, cpu_time, cores, core_hours}}
+    '''
+
+    cache_path = os.path.join(root, COST_CACHE_FILE)
+    cache = {}
+    if os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    timings = {}
+    for job_dir in _job_dirs(root):
+        outcar_path = os.path.join(root, job_dir, 'OUTCAR')
+        if not os.path.isfile(outcar_path):
+            continue
+        mtime = os.stat(outcar_path).st_mtime
+        cached = cache.get(job_dir)
+        if cached is not None and cached['mtime'] == mtime:
+            timings[job_dir] = cached
+            continue
+
+        timing = read_outcar_timing(outcar_path)
+        if timing is not None:
+            timing['mtime'] = mtime
+            timing['core_hours'] = timing['elapsed'] * (timing['cores'] or 1) / 3600
+            timings[job_dir] = timing
+
+    # keep the timings of the calculations that were archived or deleted
+    for job_dir, timing in cache.items():
+        if job_dir not in timings and not os.path.isdir(os.path.join(root, job_dir)):
+            timings[job_dir] = timing
+
+    with open(cache_path, 'w') as f:
+        json.dump(timings, f, indent=1)
+
+    return timings
+
+
+def count_pending(root : str = '.'):
+    '''
+    Number of displaced calculations for Raman that are not complete yet.
+    If the phonon calculation is not finished, the number of displacements
+    is estimated from the number of active atoms.
+    '''
+    if probe_calculation(os.path.join(root, PHONONS_DIR)) != COMPLETE:
+        atoms, _, _, _ = read_input_parameters(root)
+        return 3 * len(VibrationsData.indices_from_constraints(atoms)) * len(DISPS)
+
+    pending = 0
+    for mode in get_modes(os.path.join(root, PHONONS_DIR)):
+        for displacement in DISPS:
+            subdir = os.path.join(root, RAMAN_DIR, f'{mode.id:04d}.{displacement:+d}')
+            if probe_calculation(subdir) != COMPLETE:
+                pending += 1
+
+    return pending
+
+
+def _stats(values : list[float]):
+    '''
+    Summary statistics of a list of values
+    '''
+    values = np.asarray(values, dtype=float)
+    return {'mean': float(values.mean()),
+            'median': float(np.median(values)),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'std': float(values.std())}
+
+
+@Timer('write_cost_report')
+def write_cost_report(max_jobs : int | None = None, root : str = '.'):
+    '''
+    Print the cost of the finished calculations and the projected cost of the
+    pending ones, and write it to cost_report.json (and the timings of
+    each job to cost_jobs.dat).
+
+    Args:
+    - max_jobs: number of jobs running at the same time, for the projection of
+        the wall time of the pending calculations
+    - root: directory of the project
+
+    Returns:
+    - report: dict with the statistics
+    '''
+
+    timings = collect_timings(root)
+
+    with open(os.path.join(root, COST_JOBS_FILE), 'w') as f:
+        f.write("job    cores    elapsed(s)    cpu_time(s)    core_hours\n")
+        for job_dir, t in timings.items():
+            cpu_time = f"{t['cpu_time']:12.1f}" if t['cpu_time'] is not None else f"{'-':>12}"
+            f.write(f"{job_dir:<24} {t['cores'] or 0:5d}  {t['elapsed']:12.1f}  {cpu_time}  {t['core_hours']:10.4f}\n")
+
+    report = {'phonons': timings.get(PHONONS_DIR)}
+
+    raman = [t for job_dir, t in timings.items() if job_dir != PHONONS_DIR]
+    report['raman_finished'] = len(raman)
+    if raman:
+        report['raman_elapsed'] = _stats([t['elapsed'] for t in raman])
+        report['raman_core_hours'] = _stats([t['core_hours'] for t in raman])
+
+    report['total_core_hours'] = sum(t['core_hours'] for t in timings.values())
+    report['total_elapsed_hours'] = sum(t['elapsed'] for t in timings.values()) / 3600
+
+    pending = count_pending(root)
+    report['raman_pending'] = pending
+    if raman and pending:
+        report['projected_core_hours'] = pending * report['raman_core_hours']['mean']
+        if max_jobs:
+            waves = math.ceil(pending / max_jobs)
+            report['projected_wall_hours'] = waves * report['raman_elapsed']['mean'] / 3600
+
+    with open(os.path.join(root, COST_REPORT_FILE), 'w') as f:
+        json.dump(report, f, indent=4)
+
+    # print summary
+    if report['phonons'] is not None:
+        p = report['phonons']
+        print(f"Phonons:     {p['elapsed']/3600:10.2f} h on {p['cores'] or '?'} cores, "\
+              f"{p['core_hours']:10.2f} core-h")
+    print(f"Raman:       {len(raman)} finished, {pending} pending")
+    if raman:
+        e, c = report['raman_elapsed'], report['raman_core_hours']
+        print(f"  per job:   elapsed (s) mean {e['mean']:.1f}, median {e['median']:.1f}, "\
+              f"min {e['min']:.1f}, max {e['max']:.1f}, std {e['std']:.1f}")
+        print(f"             core-h mean {c['mean']:.3f}, median {c['median']:.3f}, max {c['max']:.3f}")
+    print(f"Total used:  {report['total_core_hours']:.2f} core-h")
+    if 'projected_core_hours' in report:
+        print(f"Projection:  {report['projected_core_hours']:.2f} core-h for the {pending} pending calculations", end='')
+        if 'projected_wall_hours' in report:
+            print(f", {report['projected_wall_hours']:.2f} h wall time with {max_jobs} jobs at a time")
+        else:
+            print()
+    elif pending:
+        print("Projection:  no finished Raman calculations to estimate the cost of the pending ones.")
+    print(f"Report written to {COST_REPORT_FILE}, timings of each job to {COST_JOBS_FILE}")
+
+    return report
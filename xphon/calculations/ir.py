@@ -9,10 +9,19 @@ import sys
 import os
 import shutil
 
+import numpy as np
+from ase import Atoms
+from ase.io import write
+from ase.vibrations import VibrationsData
+
 from xphon.calculations.utils import Mode, read_input_parameters, \
-    get_modes, get_born_charges
-from xphon.calculations.jobs import launch_jobs
+    get_modes, get_born_charges, iter_mode_chunks
+from xphon.calculations.jobs import launch_jobs, get_queued_jobs
+from xphon.calculations.archive import get_archive
+from xphon.calculations.probe import probe_calculation, COMPLETE, INCOMPLETE, FAILED
+from xphon.calculations.triage import triage, get_escalations, record_resubmissions
 from xphon import PHONONS_DIR
+from xphon.profiling import Timer
 
 
 INCAR_TAGS = """
@@ -22,22 +31,74 @@ INCAR_TAGS = """
  LEPSILON=.TRUE.
 """
 
-def launch_ir_calculation():
+def prepare_ir_calculation(atoms : Atoms, root : str = '.'):
+    '''
+    Prepare the directory of the DFPT calculation, writing the POSCAR.
+    If only some atoms are active (see read_input_parameters), the others are
+    fixed with selective dynamics, so that only the partial Hessian is computed.
+    '''
+
+    os.makedirs(f'{root}/{PHONONS_DIR}', exist_ok=True)
+    if atoms.constraints:
+        nactive = len(VibrationsData.indices_from_constraints(atoms))
+        print(f"Only {nactive}/{len(atoms)} atoms are active: computing {3*nactive} modes.")
+        write(f'{root}/{PHONONS_DIR}/POSCAR', atoms, format='vasp', direct=True)
+    else:
+        shutil.copyfile(f'{root}/POSCAR', f'{root}/{PHONONS_DIR}/POSCAR')
+
+
+def launch_ir_calculation(root : str = '.'):
     '''
-    Launches the DFPT calculation for IR intensities
+    Launches the DFPT calculation for IR intensities.
+    If a previous run failed, it is submitted again with the escalation
+    for the cause of the failure (see triage). Nothing is submitted if a job
+    of the calculation is in the scheduler queue (pending or running).
     '''
 
-    _, _, jobscript_path, submit_command = read_input_parameters()
+    atoms, _, jobscript_path, submit_command = read_input_parameters(root)
+
+    state = probe_calculation(f'{root}/{PHONONS_DIR}')
+    if state != COMPLETE:
+        job_id = get_queued_jobs().get(os.path.realpath(f'{root}/{PHONONS_DIR}'))
+        if job_id is not None:
+            print(f"The phonon calculation is already in the queue (job {job_id}).")
+            return
+
+    failures = {}
+    if state in (INCOMPLETE, FAILED):
+        failures, given_up = triage([PHONONS_DIR], root)
+        if given_up:
+            sys.exit(f"The phonon calculation failed too many times, see {PHONONS_DIR}/OUTCAR.")
 
+    prepare_ir_calculation(atoms, root)
 
-    os.makedirs(PHONONS_DIR, exist_ok=True)
-    shutil.copyfile('POSCAR', f'{PHONONS_DIR}/POSCAR')
+    job_ids = launch_jobs(subdir_paths=[PHONONS_DIR],
+                          jobscript_path=jobscript_path,
+                          submit_command=submit_command,
+                          jobnames=['phon'],
+                          incar_tags=INCAR_TAGS,
+                          root=root,
+                          escalations=get_escalations(failures, root))
+    record_resubmissions(failures, [PHONONS_DIR], job_ids, root)
 
-    launch_jobs(subdir_paths=[PHONONS_DIR],
-                jobscript_path=jobscript_path,
-                submit_command=submit_command,
-                jobnames=['phon'],
-                incar_tags=INCAR_TAGS)
+
+def get_ir_intensities(eigvecs : np.ndarray, born_charges : np.ndarray):
+    """
+    Computes the IR intensities for a batch of modes,
+    using the formula in: https://utheses.univie.ac.at/detail/9139#, (Eq. 2.51)
+
+    Args:
+    - eigvecs: eigenvectors of the modes, shape (M, N, 3)
+    - born_charges: Born charges, shape (N, 3, 3)
+
+    Returns:
+    - ir_intensities: IR intensities of the modes, shape (M,)
+    """
+
+    # dipole derivative along each cartesian direction alpha, for each mode
+    dipole_derivatives = np.einsum('lab,mlb->ma', born_charges, eigvecs)
+
+    return np.sum(dipole_derivatives**2, axis=1)
 
 
 def get_ir_intensity_for_mode(mode : Mode, born_charges : list):
@@ -53,46 +114,69 @@ def get_ir_intensity_for_mode(mode : Mode, born_charges : list):
     - ir_intensity: IR intensity for the mode
     """
 
-    intensity = 0.0
-    for alpha in range(3):
+    return get_ir_intensities(np.asarray(mode.eigvec)[np.newaxis], np.asarray(born_charges))[0]
+
 
-        innersums = 0.0
-        for l in range(len(born_charges)): #natoms
-            for beta in range(3): #cartesian components of the displacement
-                innersums += born_charges[l][alpha][beta]*mode.eigvec[l][beta]
+@Timer('write_ir_intensities')
+def write_ir_intensities(modes_list : list[Mode], born_charges : np.ndarray, filename : str):
+    '''
+    Compute the IR intensities of the modes and write them to file
+
+    Args:
+    - modes_list: list of Mode objects
+    - born_charges: Born charges, shape (N, 3, 3)
+    - filename: output file
+
+    Returns:
+    - intensities: (M,) array with the IR intensities of the modes
+    '''
+
+    all_intensities = []
+    with open(filename, 'w') as f:
+        f.write("mode    mode_vasp    freq(cm-1)    intensity\n")
 
-        intensity += innersums**2
+        #loop over chunks of phonon modes
+        for modes_chunk, eigvecs in iter_mode_chunks(modes_list):
 
-    return intensity
+            intensities = get_ir_intensities(eigvecs, born_charges)
+            all_intensities.append(intensities)
+
+            #write to output file
+            for mode, intensity in zip(modes_chunk, intensities):
+                f.write(f"{mode.id:03d}  {mode.id_vasp:03d}   {mode.frequency:10.5f}  {intensity:10.7f}\n")
 
+    return np.concatenate(all_intensities) if all_intensities else np.zeros(0)
 
-def write_ir_spectrum():
+
+@Timer('write_ir_spectrum')
+def write_ir_spectrum(root : str = '.'):
     '''
     Writes the IR spectrum to file
-    '''
 
-    if not os.path.isfile(f'{PHONONS_DIR}/vasprun.xml'):
-        sys.exit(f"vasprun.xml file not found in {PHONONS_DIR}")
+    Args:
+    - root: directory of the project
 
+    Returns:
+    - frequencies: (M,) frequencies of the (non-imaginary) modes in cm-1
+    - intensities: (M,) IR intensities of the modes
+    '''
 
-    print(f"Reading eigenvectors from {PHONONS_DIR}/vasprun.xml")
-    modes_list = get_modes(PHONONS_DIR)
+    phonons_dir = f'{root}/{PHONONS_DIR}'
+    if not os.path.isfile(f'{phonons_dir}/vasprun.xml') and get_archive(phonons_dir) is None:
+        sys.exit(f"vasprun.xml file not found in {phonons_dir}")
 
 
-    print(f"Reading Born charges from {PHONONS_DIR}/vasprun.xml")
-    born_charges = get_born_charges(f'{PHONONS_DIR}/vasprun.xml')
+    print(f"Reading eigenvectors from {phonons_dir}/vasprun.xml")
+    modes_list = get_modes(phonons_dir)
 
 
-    print("Computing IR intensities...")
-    with open('ir_spectrum.dat', 'w') as f:
-        f.write("mode    mode_vasp    freq(cm-1)    intensity\n")
+    print(f"Reading Born charges from {phonons_dir}/vasprun.xml")
+    born_charges = get_born_charges(f'{phonons_dir}/vasprun.xml')
 
-        #loop over phonon modes
-        for mode in modes_list:
 
-            intensity = get_ir_intensity_for_mode(mode, born_charges)
+    print("Computing IR intensities...")
+    intensities = write_ir_intensities(modes_list, born_charges, f'{root}/ir_spectrum.dat')
 
-            #write to output file
-            f.write(f"{mode.id:03d}  {mode.id_vasp:03d}   {mode.frequency:10.5f}  {intensity:10.7f}\n")
+    print(f"IR spectrum written to {root}/ir_spectrum.dat")
 
-    print("IR spectrum written to ir_spectrum.dat")
+    return np.array([mode.frequency for mode in modes_list]), intensities
@@ -0,0 +1,163 @@
+'''
+Isotope substitution: IR spectra of isotopologues from the cached Hessian
+of the phonon calculation, without new VASP runs.
+
+Isotope substitution only changes the masses, not the force constants, so the
+dynamical matrix is rebuilt with the new masses from the (non mass-weighted)
+Hessian of phonons/vasprun.xml and diagonalized again. The IR intensities are
+then recomputed with the Born charges of the original calculation.
+'''
+
+from __future__ import annotations
+import json
+import os
+import sys
+
+import numpy as np
+from ase import Atoms, units
+from ase.vibrations import VibrationsData
+
+from xphon import PHONONS_DIR
+from xphon.calculations.ir import write_ir_intensities
+from xphon.calculations.archive import get_archive
+from xphon.calculations.utils import read_hessian, get_born_charges, build_modes_list
+from xphon.profiling import Timer
+
+
+def parse_masses(specs : list[str]):
+    '''
+    Parse the mass substitutions from strings 'X=mass', where X is either
+    an element symbol (all the atoms of that element) or an atom index
+    (starting from 1, in the order of POSCAR).
+
+    Args:
+    - specs: list of 'X=mass' strings
+
+    Returns:
+    - masses: dict {element or index: mass}
+    '''
+
+    masses = {}
+    for spec in specs:
+        try:
+            key, value = spec.split('=')
+            masses[key.strip()] = float(value)
+        except ValueError as exc:
+            raise ValueError(f"Invalid mass substitution '{spec}', must be 'X=mass', "\
+                             "with X element symbol or atom index.") from exc
+        if not masses[key.strip()] > 0:
+            raise ValueError(f"Invalid mass substitution '{spec}', the mass must be positive.")
+
+    return masses
+
+
+def get_isotope_masses(atoms : Atoms, substitutions : dict):
+    '''
+    Masses of the atoms after the isotope substitutions.
+    Substitutions by atom index take precedence over those by element.
+
+    Args:
+    - atoms: original structure
+    - substitutions: dict {element or index (str or int, starting from 1): mass}
+
+    Returns:
+    - masses: (N,) array of the new masses in amu
+    '''
+
+    masses = atoms.get_masses()
+    symbols = np.array(atoms.get_chemical_symbols())
+
+    by_index = {}
+    for key, mass in substitutions.items():
+        if not mass > 0:
+            target = f"atom {key}" if isinstance(key, int) or str(key).isdigit() else f"element {key}"
+            raise ValueError(f"Invalid mass {mass} for {target}, the masses must be positive.")
+        if isinstance(key, int) or str(key).isdigit():
+            index = int(key)
+            if not 1 <= index <= len(atoms):
+                raise ValueError(f"Atom index {index} out of range (1-{len(atoms)}).")
+            by_index[index - 1] = mass
+        elif key in symbols:
+            masses[symbols == key] = mass
+        else:
+            raise ValueError(f"Element {key} not present in the structure.")
+
+    for index, mass in by_index.items():
+        masses[index] = mass
+
+    return masses
+
+
+def get_isotope_modes(atoms : Atoms, hessian : np.ndarray, indices : np.ndarray, masses : np.ndarray):
+    '''
+    Diagonalize the dynamical matrix built from the Hessian with the given masses.
+
+    Args:
+    - atoms: original structure
+    - hessian: (3n, 3n) non mass-weighted Hessian for the n free atoms
+    - indices: indices of the n free atoms
+    - masses: (N,) masses of all the atoms
+
+    Returns:
+    - modes_list: list of Mode objects (excluding imaginary modes)
+    '''
+
+    atoms = atoms.copy()
+    atoms.set_masses(masses)
+    vibrations = VibrationsData.from_2d(atoms, hessian, indices)
+
+    energies, eigenvectors = vibrations.get_energies_and_modes(all_atoms=True)
+
+    return build_modes_list(energies / units.invcm, eigenvectors)
+
+
+@Timer('write_isotope_spectra')
+def write_isotope_spectra(isotopologues : dict, root : str = '.'):
+    '''
+    Write the IR spectra of a batch of isotopologues to ir_spectrum_<label>.dat,
+    reading Hessian and Born charges only once.
+
+    Args:
+    - isotopologues: dict {label: {element or index: mass}}
+    - root: directory of the project
+
+    Returns:
+    - spectra: dict {label: (frequencies, intensities)} with (M,) arrays
+    '''
+
+    phonons_dir = f'{root}/{PHONONS_DIR}'
+    if not os.path.isfile(f'{phonons_dir}/vasprun.xml') and get_archive(phonons_dir) is None:
+        sys.exit(f"vasprun.xml file not found in {phonons_dir}")
+
+    print(f"Reading Hessian from {phonons_dir}/vasprun.xml")
+    atoms, hessian, indices = read_hessian(phonons_dir)
+
+    print(f"Reading Born charges from {phonons_dir}/vasprun.xml")
+    born_charges = get_born_charges(f'{phonons_dir}/vasprun.xml')
+
+    spectra = {}
+    for label, substitutions in isotopologues.items():
+        print(f"Computing IR spectrum for isotopologue {label}...")
+        masses = get_isotope_masses(atoms, substitutions)
+        modes_list = get_isotope_modes(atoms, hessian, indices, masses)
+
+        intensities = write_ir_intensities(modes_list, born_charges, f'{root}/ir_spectrum_{label}.dat')
+        spectra[label] = (np.array([mode.frequency for mode in modes_list]), intensities)
+        print(f"IR spectrum written to {root}/ir_spectrum_{label}.dat")
+
+    return spectra
+
+
+def read_isotopologues(batch_file : str):
+    '''
+    Read a batch of isotopologues from a json file, with format:
+    {
+        "label1": {"H": 2.014},
+        "label2": {"1": 13.00335, "2": 13.00335}
+    }
+    '''
+
+    with open(batch_file) as f:
+        isotopologues : dict = json.load(f)
+
+    return isotopologues
@@ -4,75 +4,377 @@
 # Author: Enrico Pedretti
 
 '''
-Module for launching the jobs in parallel
+Module for launching the jobs in parallel.
+
+The submit commands are run concurrently by an asyncio event loop, with at most
+max_in_flight commands running at the same time and at most rate submissions
+per second, so that a busy scheduler is not flooded. A submission rejected with a
+transient error of the scheduler (e.g. slurmctld not reachable) is retried
+after a wait, doubled at each retry. After an ambiguous error (e.g. a socket
+timeout), the job may have been accepted anyway: the scheduler queue is checked
+for a job running from the same directory, whose id is taken instead of
+submitting a second copy, and the submission is retried only if the queue could
+be checked and no such job was found. The job ids are appended to
+submitted_jobs.txt as soon as they are returned, one atomic write per id.
+The defaults can be changed with the optional key "submission" of settings.json, e.g.:
+
+    "submission": {"max_in_flight": 4, "rate": 2, "retries": 5, "backoff": 5}
+
+The submitter can be tested without a scheduler with a fake submit command,
+e.g. a script printing "Submitted batch job <id>".
 '''
 
 from __future__ import annotations
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
 from pathlib import Path
+import re
 import shutil
 import subprocess
 import sys
 
+from xphon.calculations.triage import apply_escalation, rotate_failed_outputs
+from xphon.profiling import Timer
+
 TEST = False
 
+SUBMISSION_DEFAULTS = {'max_in_flight': 8,  # submit commands running at the same time
+                       'rate': 5.0,         # submissions per second (0: no limit)
+                       'retries': 4,        # retries after a transient error
+                       'backoff': 2.0}      # wait (s) before the first retry
+
+# (lower case) messages of transient errors of the scheduler, the job was not submitted
+TRANSIENT_ERRORS = ('unable to contact slurm controller',
+                    'connection refused',
+                    'pbs_iff: cannot read reply')
+# (lower case) messages of errors after which the job may have been submitted anyway
+AMBIGUOUS_ERRORS = ('timed out',
+                    'slurm_receive_msg',
+                    'resource temporarily unavailable')
+
+# jobs of the user in the queue, as lines "<id> <working directory>"
+QUEUE_COMMAND = 'squeue --me --noheader --format="%i %Z"'
+
+# job id at the end of the standard output of the submit command
+# (e.g. "Submitted batch job 1234" for slurm, "1234.server" for PBS)
+JOB_ID_RE = re.compile(r'(\d+)(?:\.[\w.-]*)?\s*$')
+
+
+def _stage_job(job_dir : str,
+               jobscript_path : str,
+               jobname : str,
+               incar_tags : str,
+               root : str,
+               escalation : dict | None = None):
+    '''
+    Copy the input files of the project to job_dir, appending the tags to
+    the INCAR and setting the job name in the jobscript.
+    For a resubmitted calculation (see triage), the outputs of the failed run are
+    moved away and the escalation is applied last.
+    '''
+
+    shutil.copyfile(jobscript_path, f'{job_dir}/jobscript.sh')
+    shutil.copyfile(f'{root}/INCAR', f'{job_dir}/INCAR')
+    shutil.copyfile(f'{root}/KPOINTS', f'{job_dir}/KPOINTS')
+    shutil.copyfile(f'{root}/POTCAR', f'{job_dir}/POTCAR')
+
+    # modify INCAR, adding the tags
+    with open(f'{job_dir}/INCAR', 'a',encoding=sys.getfilesystemencoding()) as f:
+        f.write(incar_tags)
+
+    #change job title (only for slumr jobscripts)
+    with open(f'{job_dir}/jobscript.sh', 'r',encoding=sys.getfilesystemencoding()) as f:
+        lines = f.readlines()
+        for i, line in enumerate(lines):
+            if "job-name" in line:
+                lines[i] = f"{line.split('=')[0]}={jobname}\n"
+                break
+    with open(f'{job_dir}/jobscript.sh', 'w',encoding=sys.getfilesystemencoding()) as f:
+        f.writelines(lines)
+
+    if escalation is not None:
+        rotate_failed_outputs(job_dir)
+        apply_escalation(job_dir, escalation)
+
+
+def read_submission_settings(root : str = '.'):
+    '''
+    Settings of the submitter: SUBMISSION_DEFAULTS, updated with the optional
+    key "submission" of settings.json.
+    '''
+    settings = dict(SUBMISSION_DEFAULTS)
+    settings_path = os.path.join(root, 'settings.json')
+    if os.path.isfile(settings_path):
+        with open(settings_path) as f:
+            settings.update(json.load(f).get('submission', {}))
+
+    unknown = set(settings) - set(SUBMISSION_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown keys {sorted(unknown)} in submission of settings.json, "\
+                         f"must be among {list(SUBMISSION_DEFAULTS)}.")
+    if settings['max_in_flight'] < 1:
+        raise ValueError("max_in_flight in settings.json must be at least 1.")
+
+    return settings
+
+
+class RateLimiter:
+    '''
+    Space the submissions at least 1/rate seconds apart
+    '''
+
+    def __init__(self, rate : float):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if self.next_time > now:
+                await asyncio.sleep(self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.interval
+
+
+def _parse_queue(output : str):
+    '''
+    Map the working directories of the jobs in the queue (see QUEUE_COMMAND)
+    to their ids.
+
+    Returns:
+    - queued: dict {real path of the working directory: job id}
+    '''
+    queued = {}
+    for line in output.splitlines():
+        fields = line.split(maxsplit=1)
+        if len(fields) == 2 and fields[0].isdigit():
+            queued[os.path.realpath(fields[1].strip())] = int(fields[0])
+    return queued
+
+
+def get_queued_jobs():
+    '''
+    Jobs of the user in the scheduler queue (pending or running), by working directory.
+
+    Returns:
+    - queued: dict {real path of the working directory: job id}, empty if the
+        queue could not be checked (e.g. no scheduler)
+    '''
+    process = subprocess.run(QUEUE_COMMAND, shell=True, capture_output=True, text=True, check=False)
+    return _parse_queue(process.stdout) if process.returncode == 0 else {}
+
+
+async def _find_queued_job(job_dir : str):
+    '''
+    Look for a job submitted from job_dir in the scheduler queue.
+
+    Returns:
+    - found: whether the queue could be checked
+    - job_id: id of the job, or None if not found
+    '''
+    process = await asyncio.create_subprocess_shell(QUEUE_COMMAND,
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.DEVNULL)
+    output, _ = await process.communicate()
+    if process.returncode != 0:
+        return False, None
+
+    return True, _parse_queue(output.decode(errors='replace')).get(os.path.realpath(job_dir))
+
+
+async def _submit_job(job_dir : str,
+                      launch_string : str,
+                      settings : dict,
+                      semaphore : asyncio.Semaphore,
+                      limiter : RateLimiter,
+                      ids_fd : int):
+    '''
+    Run the submit command in job_dir, retrying after transient errors
+    (see the module docstring).
+
+    Returns:
+    - job_id: id of the submitted job, or None if the submission failed
+    '''
+
+    for attempt in range(settings['retries'] + 1):
+        async with semaphore:
+            await limiter.wait()
+            with Timer('launch_jobs.submit'):
+                process = await asyncio.create_subprocess_shell(launch_string, cwd=job_dir,
+                                                                stdout=asyncio.subprocess.PIPE,
+                                                                stderr=asyncio.subprocess.PIPE)
+                stdout, stderr = await process.communicate()
+        stdout = stdout.decode(errors='replace').strip()
+        stderr = stderr.decode(errors='replace').strip()
+        outstring = '\n'.join(text for text in (stdout, stderr) if text)
+
+        # the id is read from the standard output only: warnings can follow on stderr
+        match = JOB_ID_RE.search(stdout) if process.returncode == 0 else None
+        job_id = int(match.group(1)) if match is not None else None
+        if job_id is not None:
+            print(outstring)
+        elif any(error in outstring.lower() for error in AMBIGUOUS_ERRORS):
+            checked, job_id = await _find_queued_job(job_dir)
+            if job_id is not None:
+                print(f"{job_dir}: {outstring} Job {job_id} found in the queue, not submitting again.")
+            elif not checked:
+                print(f"{job_dir}: {outstring} The queue could not be checked, not submitting again.")
+                break
+
+        if job_id is not None:
+            # a single write with O_APPEND: the ids are never interleaved or truncated
+            os.write(ids_fd, f'{job_id}\n'.encode())
+            return job_id
+
+        if attempt < settings['retries'] and \
+            any(error in outstring.lower() for error in TRANSIENT_ERRORS + AMBIGUOUS_ERRORS):
+            wait = settings['backoff'] * 2**attempt
+            print(f"{job_dir}: {outstring} Retrying in {wait:g} s.")
+            await asyncio.sleep(wait)
+        else:
+            break
+
+    print(f"{job_dir}: submission failed: {outstring}")
+    return None
+
+
+async def _submit_jobs(job_dirs : list[str], launch_strings : list[str], settings : dict, ids_paths : list[str]):
+    '''
+    Submit the jobs concurrently (see _submit_job), sharing the limits of settings
+
+    Returns:
+    - job_ids: ids of the jobs, in the order of job_dirs (None for the failed submissions)
+    '''
+    semaphore = asyncio.Semaphore(settings['max_in_flight'])
+    limiter = RateLimiter(settings['rate'])
+
+    ids_fds = {path: os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644) for path in set(ids_paths)}
+    try:
+        return await asyncio.gather(*(_submit_job(job_dir, launch_string, settings, semaphore, limiter, ids_fds[path])
+                                      for job_dir, launch_string, path in zip(job_dirs, launch_strings, ids_paths)))
+    finally:
+        for ids_fd in ids_fds.values():
+            os.close(ids_fd)
+
+
+def _run_coroutine(coroutine):
+    '''
+    Run a coroutine to completion, also when an event loop is already running
+    in this thread (e.g. in a Jupyter notebook), in which case it is run in another thread.
+    '''
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def stage_jobs(*,
+               subdir_paths : list[str],
+               jobscript_path : str,
+               jobnames : list[str],
+               incar_tags : str,
+               root : str = '.',
+               escalations : dict[str, dict] | None = None):
+    '''
+    Stage the directories of the calculations in parallel (see _stage_job).
+
+    Returns:
+    - job_dirs : paths of the directories (root joined with subdir_paths)
+    '''
+
+    job_dirs = [os.path.join(root, j_dir) for j_dir in subdir_paths]
+    escalations = escalations or {}
+
+    with Timer('launch_jobs.stage'), ThreadPoolExecutor() as executor:
+        list(executor.map(lambda job_dir, jobname, subdir:
+                            _stage_job(job_dir, jobscript_path, jobname, incar_tags, root,
+                                       escalations.get(subdir)),
+                          job_dirs, jobnames, subdir_paths))
+
+    return job_dirs
+
+
+def submit_jobs(job_dirs : list[str], submit_commands : list[str], ids_paths : list[str], settings : dict):
+    '''
+    Submit the staged jobs concurrently from their directories, all sharing
+    the same limits (see the module docstring), without changing the working directory.
+
+    Args:
+    - job_dirs : directories of the jobs, with jobscript.sh
+    - submit_commands : command to launch the jobscript of each job
+    - ids_paths : file to which the id of each job is appended
+    - settings : settings of the submitter (see read_submission_settings)
+
+    Returns:
+    - submitted_jobs : list of the ids of the jobs, in the order of job_dirs,
+        None for the failed submissions (empty in TEST mode)
+    '''
 
+    launch_strings = [f"{submit_command} jobscript.sh" for submit_command in submit_commands]
+    if TEST:
+        for launch_string in launch_strings:
+            print(launch_string)
+        return []
+
+    submitted_jobs = _run_coroutine(_submit_jobs(job_dirs, launch_strings, settings, ids_paths))
+
+    nfailed = submitted_jobs.count(None)
+    if nfailed:
+        print(f"{nfailed} of {len(job_dirs)} submissions failed.")
+
+    return submitted_jobs
+
+
+@Timer('launch_jobs')
 def launch_jobs(*,
                 subdir_paths : list[str],
                 jobscript_path : str,
                 submit_command : str,
                 jobnames : list[str],
-                incar_tags : str):
+                incar_tags : str,
+                root : str = '.',
+                escalations : dict[str, dict] | None = None,
+                submission : dict | None = None):
     '''
     Launch the calculations.
-    Writes the job ids in a txt file
+    Writes the job ids in a txt file.
+    The directories are staged in parallel (see stage_jobs), then the jobs
+    are submitted concurrently (see submit_jobs).
 
     Args:
-    - subdir_paths : list of paths to the directories where the calculations are to be launched
+    - subdir_paths : list of paths (relative to root) to the directories where the calculations are to be launched
     - jobscript_path : path to the jobscript
     - submit_command : command to launch the jobscript
     - jobnames : list of jobnames (for Slurm only)
+    - incar_tags : tags appended to the INCAR
+    - root : directory of the project, with INCAR, KPOINTS and POTCAR
+    - escalations : {subdir: escalation} for the calculations submitted again (see triage)
+    - submission : settings of the submitter (default: see read_submission_settings)
 
+    Returns:
+    - submitted_jobs : list of the ids of the jobs, in the order of subdir_paths,
+        None for the failed submissions (empty in TEST mode)
     '''
-    main_dir = os.getcwd()
-
-    submitted_jobs = []
-    for j_dir, jobname in zip(subdir_paths, jobnames):
 
-        shutil.copyfile(jobscript_path, f'{j_dir}/jobscript.sh')
-        shutil.copyfile('INCAR', f'{j_dir}/INCAR')
-        shutil.copyfile('KPOINTS', f'{j_dir}/KPOINTS')
-        shutil.copyfile('POTCAR', f'{j_dir}/POTCAR')
+    job_dirs = stage_jobs(subdir_paths=subdir_paths,
+                          jobscript_path=jobscript_path,
+                          jobnames=jobnames,
+                          incar_tags=incar_tags,
+                          root=root,
+                          escalations=escalations)
 
-        os.chdir(j_dir)   ####################
-
-        # modify INCAR, adding the tags
-        with open('INCAR', 'r',encoding=sys.getfilesystemencoding()) as f:
-            lines = f.readlines()
-        with open('INCAR', 'w',encoding=sys.getfilesystemencoding()) as f:
-            f.writelines(lines)
-            f.write(incar_tags)
-
-        #change job title (only for slumr jobscripts)
-        with open('jobscript.sh', 'r',encoding=sys.getfilesystemencoding()) as f:
-            lines = f.readlines()
-            for i, line in enumerate(lines):
-                if "job-name" in line:
-                    lines[i] = f"{line.split('=')[0]}={jobname}\n"
-                    break
-        with open('jobscript.sh', 'w',encoding=sys.getfilesystemencoding()) as f:
-            f.writelines(lines)
-
-        launch_string = f"{submit_command} jobscript.sh"
-        if TEST: print(launch_string) #pylint: disable=multiple-statements
-        else:
-            outstring = subprocess.getoutput(launch_string) #launches the jobscript from j_dir
-            print(outstring)
-            submitted_jobs.append(int(outstring.split()[-1]))
-        os.chdir(main_dir) ####################
+    settings = read_submission_settings(root)
+    settings.update(submission or {})
 
-    with open("submitted_jobs.txt", "a",encoding=sys.getfilesystemencoding()) as f:
-        f.writelines([f'{job}\n' for job in submitted_jobs])
+    return submit_jobs(job_dirs,
+                       [submit_command] * len(job_dirs),
+                       [f"{root}/submitted_jobs.txt"] * len(job_dirs),
+                       settings)
 
 
 def get_running_jobs():
@@ -93,15 +395,15 @@ def _cancel_jobs(ids : list[int]):
         os.system(f"scancel {job_id}")
 
 
-def scancel():
+def scancel(root : str = '.'):
     '''
     Cancel all the running jobs For the current xphon session.
     Associated to the command 'xphon scancel' in the CLI.
     '''
 
     #read submitted jobs from .submitted_jobs.txt
-    if Path("submitted_jobs.txt").exists():
-        with open("submitted_jobs.txt", "r",encoding=sys.getfilesystemencoding()) as f:
+    if Path(f"{root}/submitted_jobs.txt").exists():
+        with open(f"{root}/submitted_jobs.txt", "r",encoding=sys.getfilesystemencoding()) as f:
             submitted_jobs = f.readlines()
             submitted_job_ids = [int(job.strip()) for job in submitted_jobs]
     else:
@@ -0,0 +1,151 @@
+'''
+Fast probes of the state of a VASP calculation, reading only the
+end of vasprun.xml and OUTCAR instead of parsing the whole files.
+'''
+
+from __future__ import annotations
+import os
+import re
+
+import numpy as np
+
+from xphon.calculations.archive import read_archived_epsilon
+
+
+# states of a calculation
+MISSING = 'missing'        # no vasprun.xml
+COMPLETE = 'complete'      # vasprun.xml closed and dielectric tensor found
+INCOMPLETE = 'incomplete'  # vasprun.xml truncated (killed or still running)
+FAILED = 'failed'          # error message in OUTCAR
+UNKNOWN = 'unknown'        # quick check not conclusive, full parse needed
+QUEUED = 'queued'          # not complete, with a job in the scheduler queue (see jobs.get_queued_jobs)
+
+# markers written by VASP at the end of OUTCAR of a finished run
+OUTCAR_DONE_MARKER = 'General timing and accounting informations for this job'
+# markers of fatal errors in OUTCAR
+OUTCAR_ERROR_MARKERS = ('VERY BAD NEWS',
+                        'ZBRENT: fatal error',
+                        'Error EDDDAV',
+                        'EDDDAV: Call to ZHEGV failed',
+                        'Sub-Space-Matrix is not hermitian',
+                        'internal error in subroutine')
+# electronic loop not converged within NELM steps (vasp 6)
+OUTCAR_UNCONVERGED_MARKER = 'EDIFF was not reached'
+
+EPSILON_MARKER = b'<varray name="dielectric_dft"'
+
+TAIL_BYTES = 16 * 1024
+BLOCK_BYTES = 1024**2
+MAX_SEARCH_BYTES = 16 * 1024**2
+
+
+def read_tail(path : str, nbytes : int = TAIL_BYTES):
+    '''
+    Read the last nbytes of a file, as text.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - nbytes))
+        return f.read().decode('latin-1')
+
+
+def _find_last(path : str, marker : bytes, max_bytes : int = MAX_SEARCH_BYTES):
+    '''
+    Offset of the last occurrence of marker in the file, searching backwards
+    in blocks from the end, up to max_bytes. Returns None if not found.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        searched = 0
+        while end > 0 and searched < max_bytes:
+            start = max(0, end - BLOCK_BYTES)
+            f.seek(start)
+            # overlap with the previous block, so that markers across blocks are found
+            block = f.read(end - start + len(marker))
+            position = block.rfind(marker)
+            if position >= 0:
+                return start + position
+            searched += end - start
+            end = start
+    return None
+
+
+def read_epsilon_fast(vasprun_path : str):
+    '''
+    Read the (last) dielectric tensor of vasprun.xml, seeking directly
+    to the dielectric block near the end of the file.
+
+    Returns:
+    - epsilon: (3, 3) array, or None if the block was not found
+    '''
+
+    offset = _find_last(vasprun_path, EPSILON_MARKER)
+    if offset is None:
+        return None
+
+    with open(vasprun_path, 'rb') as f:
+        f.seek(offset)
+        block = f.read(2048).decode('latin-1')
+
+    rows = re.findall(r'<v>([^<]*)</v>', block.split('</varray>')[0])
+    if len(rows) != 3:
+        return None
+
+    try:
+        epsilon = np.array([[float(x) for x in row.split()] for row in rows])
+    except ValueError:
+        return None
+
+    return epsilon if epsilon.shape == (3, 3) else None
+
+
+def probe_outcar(outcar_path : str):
+    '''
+    Quick check of the end of OUTCAR.
+
+    Returns:
+    - state: COMPLETE if the final timing summary is present, FAILED if a fatal
+        error marker is found or the electronic loop did not converge,
+        INCOMPLETE otherwise, MISSING if there is no OUTCAR.
+    '''
+
+    if not os.path.isfile(outcar_path):
+        return MISSING
+
+    tail = read_tail(outcar_path)
+    if any(marker in tail for marker in OUTCAR_ERROR_MARKERS + (OUTCAR_UNCONVERGED_MARKER,)):
+        return FAILED
+    if OUTCAR_DONE_MARKER in tail:
+        return COMPLETE
+    return INCOMPLETE
+
+
+def probe_calculation(directory : str):
+    '''
+    Quick check of the state of the calculation of a dielectric tensor in directory,
+    reading only the end of vasprun.xml and OUTCAR.
+    Archived calculations (see archive) are complete.
+
+    Returns:
+    - state: one of MISSING, COMPLETE, INCOMPLETE, FAILED, UNKNOWN
+    '''
+
+    vasprun_path = f'{directory}/vasprun.xml'
+    if not os.path.isfile(vasprun_path):
+        return COMPLETE if read_archived_epsilon(directory) is not None else MISSING
+
+    outcar_state = probe_outcar(f'{directory}/OUTCAR')
+    if outcar_state == FAILED:
+        return FAILED
+
+    closed = '</modeling>' in read_tail(vasprun_path, 1024)
+    if not closed:
+        # a truncated vasprun.xml with a finished OUTCAR is unexpected
+        return UNKNOWN if outcar_state == COMPLETE else INCOMPLETE
+
+    if outcar_state == INCOMPLETE or read_epsilon_fast(vasprun_path) is None:
+        return UNKNOWN
+
+    return COMPLETE
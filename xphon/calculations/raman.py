@@ -7,93 +7,202 @@
 # URL: http://raman-sc.github.io
 
 
+from __future__ import annotations
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+import io
 import os
 from math import pi
 
+import numpy as np
+
 from ase.io import write
 from ase import Atoms
 
 from xphon.calculations.utils import Mode, read_input_parameters, \
-    get_modes, get_epsilon
-from xphon.calculations.jobs import launch_jobs
+    get_modes, get_epsilon, iter_mode_chunks
+from xphon.calculations.jobs import launch_jobs, get_queued_jobs
+from xphon.calculations.probe import probe_calculation, COMPLETE, UNKNOWN, MISSING, FAILED, QUEUED
+from xphon.calculations.triage import triage, get_escalations, record_resubmissions
 from xphon import RAMAN_DIR, PHONONS_DIR
+from xphon.profiling import Timer
 
 
 DISPS = (-1, 1)      # hardcoded for
 COEFFS = (-0.5, 0.5) # three point stencil (nderiv=2)
 
 
+RAMAN_TENSORS_FILE = 'raman_tensors.npz'
+
 INCAR_TAGS = """
  LEPSILON=.TRUE.
 """
 
-def write_displaced_POSCARS(atoms : Atoms, step_size: int):
+def get_poscar_template(atoms : Atoms):
     '''
-    Write displaced POSCARs for each phonon mode and displacement
-    for the cases not already calculated.
+    Template to write the POSCARs of structures with the same cell, species and
+    constraints of atoms, but different positions, without going through ase.io.write.
+    The header and the selective dynamics flags are the ones written by ase.
+
+    Returns:
+    - header: text of the POSCAR before the positions
+    - positions_format: format string of the positions of all the atoms (3N floats)
     '''
+    buffer = io.StringIO()
+    write(buffer, atoms, format='vasp')
+    lines = buffer.getvalue().splitlines(keepends=True)
 
-    natoms = len(atoms)
+    header = ''.join(lines[:-len(atoms)])
+    flags = [''.join(f'{flag:>4s}' for flag in line.split()[3:]) for line in lines[-len(atoms):]]
+    positions_format = ''.join(f' %19.16f %19.16f %19.16f{atom_flags}\n' for atom_flags in flags)
+
+    return header, positions_format
+
+
+def format_poscar(template : tuple[str, str], positions : np.ndarray):
+    '''
+    Text of the POSCAR with the given (N, 3) positions (see get_poscar_template)
+    '''
+    header, positions_format = template
+    return header + positions_format % tuple(positions.ravel().tolist())
+
+
+def _stage_displacement(template : tuple[str, str],
+                        root : str,
+                        subdir : str,
+                        positions : np.ndarray,
+                        label : str,
+                        queued : dict[str, int]):
+    '''
+    Write the displaced POSCAR in subdir, unless the calculation is already complete
+    or its job is in the scheduler queue.
+
+    Returns:
+    - state: state of the previous calculation (see probe), COMPLETE if it does not
+        have to be run, FAILED if it could not be read, QUEUED if its job is in queued
+        ({working directory: job id}, see get_queued_jobs)
+    '''
+
+    vasprun_path = f'{root}/{subdir}/vasprun.xml'
+
+    # quick check of the end of vasprun.xml and OUTCAR,
+    # full parse only if the quick check is not conclusive
+    with Timer('write_displaced_POSCARS.check_existing'):
+        state = probe_calculation(f'{root}/{subdir}')
+    if state == COMPLETE:
+        return state
+    if state == UNKNOWN:
+        try:
+            with Timer('write_displaced_POSCARS.check_existing_full'):
+                get_epsilon(vasprun_path)
+            return COMPLETE
+        except Exception as e:
+            print(f"{vasprun_path}: {e}")
+            state = FAILED
+
+    job_id = queued.get(os.path.realpath(f'{root}/{subdir}'))
+    if job_id is not None:
+        print(f"{root}/{subdir}: job {job_id} in the queue, skipping.")
+        return QUEUED
+
+    mode_id, displacement = label.split('.')
+    print(f"Writing files for mode {int(mode_id)}, displacement {displacement}")
+
+    # write displaced POSCAR
+    os.makedirs(f'{root}/{subdir}', exist_ok=True)
+    with Timer('write_displaced_POSCARS.write_poscar'), open(f'{root}/{subdir}/POSCAR', 'w') as f:
+        f.write(format_poscar(template, positions))
+
+    return state
 
-    # read (non-imaginary) phonon modes
-    modes_list = get_modes(PHONONS_DIR)
 
+@Timer('write_displaced_POSCARS')
+def write_displaced_POSCARS(atoms : Atoms, step_size: int, root : str = '.'):
+    '''
+    Write displaced POSCARs for each phonon mode and displacement
+    for the cases not already calculated.
+    The displaced positions of each chunk of modes are computed at once, and the
+    directories are checked and the POSCARs written (from a template, see
+    get_poscar_template) by a pool of threads.
+    The calculations that were run before and did not complete are triaged
+    (see triage): they are run again, with the escalation for the cause of the
+    failure, unless they failed too many times. The calculations with a job in
+    the scheduler queue (pending or running, see get_queued_jobs) are skipped.
 
-    #loop over phonon modes and write displaced POSCARs
-    os.makedirs(RAMAN_DIR, exist_ok=True)
+    Returns:
+    - dirs_to_run: directories (relative to root) of the calculations to run
+    - labels: labels (mode.displacement) of the calculations to run
+    - failures: dict {subdir: failure} of the calculations to run again
+        (see triage), to be recorded once submitted (see record_resubmissions)
+    '''
+
+    # read (non-imaginary) phonon modes
+    modes_list = get_modes(f'{root}/{PHONONS_DIR}')
 
-    dirs_to_run, labels = [], []
-    for mode in modes_list:
 
-        #loop over displacements (+/- step_size)
-        for j, displacement in enumerate(DISPS):
+    template = get_poscar_template(atoms)
+    queued = get_queued_jobs()
+    disps = np.array(DISPS)[np.newaxis, :, np.newaxis, np.newaxis]
 
-            subdir = f'{RAMAN_DIR}/{mode.id:04d}.{displacement:+d}'
-            os.makedirs(subdir, exist_ok=True)
+    #loop over (chunks of) phonon modes and write displaced POSCARs
+    dirs_to_run, labels, failed = [], [], []
+    with ThreadPoolExecutor() as executor:
+        for modes_chunk, eigvecs in iter_mode_chunks(modes_list):
 
-            vasprun_path = f'{subdir}/vasprun.xml'
+            # displaced positions for all the modes of the chunk and displacements (+/- step_size)
+            # at once, with shape (modes, displacements, atoms, 3)
+            norms = np.array([mode.norm for mode in modes_chunk])[:, np.newaxis, np.newaxis, np.newaxis]
+            with Timer('write_displaced_POSCARS.positions'):
+                positions = atoms.positions + eigvecs[:, np.newaxis]*step_size*disps/norms
+            chunk_positions = positions.reshape(-1, len(atoms), 3)
+            chunk_labels = [f'{mode.id:04d}.{displacement:+d}' for mode in modes_chunk for displacement in DISPS]
 
-            if os.path.isfile(vasprun_path):
-                try:
-                    get_epsilon(vasprun_path)
-                    continue
-                except RuntimeError as e:
-                    print(f"{vasprun_path}: {e}, re-running.")
+            chunk_dirs = [f'{RAMAN_DIR}/{label}' for label in chunk_labels]
+            states = executor.map(lambda subdir, positions, label:
+                                    _stage_displacement(template, root, subdir, positions, label, queued),
+                                  chunk_dirs, chunk_positions, chunk_labels)
 
-            print(f"Writing files for mode {mode.id}, displacement {displacement:+d}")
+            for subdir, label, state in zip(chunk_dirs, chunk_labels, states):
+                if state not in (COMPLETE, QUEUED):
+                    dirs_to_run.append(subdir)
+                    labels.append(label)
+                if state not in (COMPLETE, MISSING, QUEUED):
+                    failed.append(subdir)
 
-            # write displaced POSCAR
-            atoms_displaced = atoms.copy()
-            atoms_displaced.positions = [ [ atoms.positions[k][l] + mode.eigvec[k][l]*step_size*displacement/mode.norm \
-                                            for l in range(3)] for k in range(natoms)]
-            write(f'{subdir}/POSCAR', atoms_displaced, format='vasp')
-            dirs_to_run.append(subdir)
-            labels.append(f'{mode.id:04d}.{displacement:+d}')
+    failures, given_up = triage(failed, root)
+    if given_up:
+        print(f"{len(given_up)} calculations failed too many times and will not be submitted again.")
+        labels = [label for subdir, label in zip(dirs_to_run, labels) if subdir not in given_up]
+        dirs_to_run = [subdir for subdir in dirs_to_run if subdir not in given_up]
 
-    return dirs_to_run, labels
+    return dirs_to_run, labels, failures
 
 
-def launch_raman_calculations(write_only : bool = False):
+def launch_raman_calculations(write_only : bool = False, root : str = '.'):
     '''
     Generate displaced POSCARs and launch the calculations in parallel
     '''
 
     # read settings from json file and initialize parameters###################
-    atoms, step_size, jobscript_path, submit_command = read_input_parameters()
+    atoms, step_size, jobscript_path, submit_command = read_input_parameters(root)
 
     # write displaced POSCARs for each phonon mode and displacement
-    dirs_to_run, labels = write_displaced_POSCARS(atoms, step_size)
+    dirs_to_run, labels, failures = write_displaced_POSCARS(atoms, step_size, root)
 
     # launch the calculations
     if not write_only:
-        launch_jobs(subdir_paths=dirs_to_run,
-                    jobscript_path=jobscript_path,
-                    submit_command=submit_command,
-                    jobnames=labels,
-                    incar_tags=INCAR_TAGS)
-
-
-def get_raman_tensor_for_mode(mode : Mode, step_size : float, volume : float):
+        job_ids = launch_jobs(subdir_paths=dirs_to_run,
+                              jobscript_path=jobscript_path,
+                              submit_command=submit_command,
+                              jobnames=labels,
+                              incar_tags=INCAR_TAGS,
+                              root=root,
+                              escalations=get_escalations(failures, root))
+        record_resubmissions(failures, dirs_to_run, job_ids, root)
+
+
+@Timer('get_raman_tensor_for_mode')
+def get_raman_tensor_for_mode(mode : Mode, step_size : float, volume : float, root : str = '.'):
     '''
     Calculate Raman tensor for a given mode, reading the displaced epsilons
 
@@ -101,6 +210,7 @@ def get_raman_tensor_for_mode(mode : Mode, step_size : float, volume : float):
     - mode: Mode object
     - step_size: displacement step size
     - volume: volume of the unit cell
+    - root: directory of the project
 
     Returns:
     - ra: Raman tensor (polarizability derivatives) (3x3 matrix)
@@ -111,7 +221,7 @@ def get_raman_tensor_for_mode(mode : Mode, step_size : float, volume : float):
     #loop over displacements (+/- step_size)
     for j, displacement in enumerate(DISPS):
 
-        subdir = f'{RAMAN_DIR}/{mode.id:04d}.{displacement:+d}'
+        subdir = f'{root}/{RAMAN_DIR}/{mode.id:04d}.{displacement:+d}'
         vasprun_path = f'{subdir}/vasprun.xml'
 
         try:
@@ -162,23 +272,76 @@ def get_raman_data_for_mode(ra):
     return a, gamma2, delta2, Iraman
 
 
-def write_raman_spectrum():
+def get_corrected_raman_intensities(frequencies : np.ndarray,
+                                    activities : np.ndarray,
+                                    laser_freqs : np.ndarray,
+                                    temperatures : np.ndarray):
+    '''
+    Raman intensities corrected with the laser frequency and the
+    Bose-Einstein occupation factor (prefactor as calculated in CRYSTAL),
+    for all the combinations of laser frequencies and temperatures at once.
+
+    Args:
+    - frequencies: (M,) frequencies of the modes in cm-1
+    - activities: (M,) Raman activities of the modes
+    - laser_freqs: (L,) laser frequencies in cm-1
+    - temperatures: (T,) temperatures in K
+
+    Returns:
+    - intensities: (M, L, T) array of corrected intensities
+    '''
+
+    x = np.asarray(frequencies, dtype=float)[:, np.newaxis, np.newaxis]
+    y = np.asarray(activities, dtype=float)[:, np.newaxis, np.newaxis]
+    laser = np.asarray(laser_freqs, dtype=float)[np.newaxis, :, np.newaxis]
+    temp = np.asarray(temperatures, dtype=float)[np.newaxis, np.newaxis, :]
+
+    # Bose occupancy factor
+    one_plus_n = 1/( 1 - np.exp(-1.9865e-23 * x / (1.38064852e-23 * temp) ))
+
+    return y * one_plus_n/(30*x) * (x - laser)**4
+
+
+@Timer('write_raman_spectrum')
+def write_raman_spectrum(laser_freqs : list[float] | None = None,
+                         temperatures : Sequence[float] = (300,),
+                         root : str = '.'):
     '''
-    Write the Raman activity, reading the displaced files
+    Write the Raman activity, reading the displaced files.
+    The Raman tensors of the modes are also saved to raman_tensors.npz
+    (arrays mode_ids, frequencies and raman_tensors), e.g. for polarized Raman.
+
+    If laser frequencies are given, the intensities corrected with the laser
+    frequency and Bose-Einstein factor are also written, for all the combinations
+    of laser frequencies and temperatures, to raman_intensities.npz, containing
+    the arrays: mode_ids, frequencies, activities, laser_freqs, temperatures
+    and intensities (with shape (modes, lasers, temperatures)).
+
+    Args:
+    - laser_freqs: laser frequencies in cm-1
+    - temperatures: temperatures in K
+    - root: directory of the project
+
+    Returns:
+    - frequencies: (M,) frequencies of the (non-imaginary) modes in cm-1
+    - activities: (M,) Raman activities of the modes
+    - raman_tensors: (M, 3, 3) Raman tensors of the modes
     '''
 
     print("Reading Raman data from vasprun.xml files...")
-    atoms, step_size, _, _ = read_input_parameters()
-    modes_list = get_modes(PHONONS_DIR)
+    atoms, step_size, _, _ = read_input_parameters(root)
+    modes_list = get_modes(f'{root}/{PHONONS_DIR}')
+
+    mode_ids, frequencies, activities, raman_tensors = [], [], [], []
 
     print('Calculating Raman activity...')
-    with open('raman_spectrum.dat', 'w') as f:
+    with open(f'{root}/raman_spectrum.dat', 'w') as f:
         f.write("mode    mode_vasp    freq(cm-1)    a    gamma2    delta2    activity\n")
 
         #loop over phonon modes
         for mode in modes_list:
 
-            ra = get_raman_tensor_for_mode(mode, step_size, atoms.get_volume())
+            ra = get_raman_tensor_for_mode(mode, step_size, atoms.get_volume(), root)
 
             #calculate Raman activity
             a, gamma2, delta2, activity = get_raman_data_for_mode(ra)
@@ -187,4 +350,31 @@ def write_raman_spectrum():
             f.write(f"{mode.id:03d}  {mode.id_vasp:03d}  {mode.frequency:10.5f}  "\
                     f"{a:10.7f}  {gamma2:10.7f}  {delta2:10.7f}  {activity:10.7f}\n")
 
-    print("Raman spectrum written to raman_spectrum.dat")
+            mode_ids.append(mode.id)
+            frequencies.append(mode.frequency)
+            activities.append(activity)
+            raman_tensors.append(ra)
+
+    print(f"Raman spectrum written to {root}/raman_spectrum.dat")
+
+    raman_tensors = np.array(raman_tensors).reshape(-1, 3, 3)
+    np.savez(f'{root}/{RAMAN_TENSORS_FILE}',
+             mode_ids=np.array(mode_ids),
+             frequencies=np.array(frequencies),
+             raman_tensors=raman_tensors)
+    print(f"Raman tensors written to {root}/{RAMAN_TENSORS_FILE}")
+
+    if laser_freqs:
+        print('Applying laser frequency correction for '\
+              f'{len(laser_freqs)} laser frequencies and {len(temperatures)} temperatures...')
+        intensities = get_corrected_raman_intensities(frequencies, activities, laser_freqs, temperatures)
+        np.savez(f'{root}/raman_intensities.npz',
+                 mode_ids=np.array(mode_ids),
+                 frequencies=np.array(frequencies),
+                 activities=np.array(activities),
+                 laser_freqs=np.array(laser_freqs, dtype=float),
+                 temperatures=np.array(temperatures, dtype=float),
+                 intensities=intensities)
+        print(f"Corrected Raman intensities written to {root}/raman_intensities.npz")
+
+    return np.array(frequencies), np.array(activities), raman_tensors
@@ -0,0 +1,391 @@
+'''
+Triage of the failed calculations and escalation-based resubmission.
+
+The cause of the failure of a calculation is guessed from the end of OUTCAR
+and from the most recent standard output/error files of the job
+(vasp.out, slurm-*.out, ...):
+- walltime: the job was killed by the scheduler for exceeding the time limit
+- memory: the job ran out of memory
+- scf: the electronic loop did not converge, or the diagonalization failed
+- unknown: none of the above (e.g. node failure)
+
+Each class has a ladder of escalations, applied to the inputs of the job when
+it is submitted again: at the n-th retry for a class, the steps up to the n-th
+are combined (the factors are multiplied, the INCAR tags of later steps override
+the earlier ones), and the last step is repeated if the ladder is shorter.
+A step can contain:
+- "walltime_factor": multiply the time limit of the jobscript
+- "nodes_factor": multiply the number of nodes of the jobscript
+- "incar": tags set in the INCAR (e.g. {"ALGO": "All", "NELM": 200})
+
+The ladders and the maximum number of retries can be overridden with the
+optional key "resubmission" of settings.json, e.g.:
+
+    "resubmission": {"max_retries": 2, "scf": [{"incar": {"ALGO": "All", "NELM": 300}}]}
+
+The failures are classified when the directories are scanned, but they are
+recorded in resubmission_history.json (with the applied escalation and the id
+of the new job) only when the calculation is actually submitted again (see
+record_resubmissions), so that scanning the directories again, e.g. with
+xphon raman -write-only, does not count as a retry. The calculations with a job
+in the scheduler queue are not triaged (see jobs.get_queued_jobs). When a
+calculation is submitted again, the outputs of the failed run are moved to
+failed_runs/<retry>/ (see rotate_failed_outputs), so that they are not read
+again when the new run is classified.
+'''
+
+from __future__ import annotations
+import glob
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import time
+
+from xphon.calculations.probe import read_tail, OUTCAR_UNCONVERGED_MARKER
+
+
+# classes of failures
+WALLTIME = 'walltime'
+MEMORY = 'memory'
+SCF = 'scf'
+UNKNOWN_FAILURE = 'unknown'
+
+HISTORY_FILE = 'resubmission_history.json'
+FAILED_RUNS_DIR = 'failed_runs'
+
+DEFAULT_POLICY = {
+    'max_retries': 3,
+    WALLTIME: [{'walltime_factor': 2}],
+    MEMORY: [{'nodes_factor': 2}],
+    SCF: [{'incar': {'ALGO': 'Normal', 'NELM': 200}},
+          {'incar': {'ALGO': 'All', 'NELM': 300}}],
+    UNKNOWN_FAILURE: [],
+}
+
+# standard output/error of the job: only the most recent file of each pattern is read
+STDOUT_PATTERNS = ('vasp.out', 'slurm-*.out', '*.o[0-9]*', '*.e[0-9]*')
+# outputs of a run, moved away before it is submitted again
+OUTPUT_FILES = ('OUTCAR', 'vasprun.xml', 'OSZICAR')
+
+# markers of each class (lower case) in OUTCAR and in the output of the job
+WALLTIME_MARKERS = ('due to time limit', 'job killed: walltime', 'time limit exceeded')
+MEMORY_MARKERS = ('oom-kill', 'oom_kill', 'out of memory', 'out_of_memory',
+                  'cannot allocate memory', 'insufficient virtual memory',
+                  'killed by signal: 9')
+# only convergence and diagonalization errors: the other fatal errors of VASP are unknown
+SCF_MARKERS = ('error edddav',
+               'call to zhegv failed',
+               'sub-space-matrix is not hermitian',
+               OUTCAR_UNCONVERGED_MARKER.lower())
+
+TIME_RE = re.compile(r'^(#SBATCH\s+(?:--time[=\s]|-t\s+))(\S+)(.*)$')
+PBS_TIME_RE = re.compile(r'^(#PBS\s+-l\s+.*walltime=)([\d:]+)(.*)$')
+NODES_RE = re.compile(r'^(#SBATCH\s+(?:--nodes[=\s]|-N\s+))(\d+)(.*)$')
+PBS_NODES_RE = re.compile(r'^(#PBS\s+-l\s+.*nodes=)(\d+)(.*)$')
+
+
+def classify_failure(directory : str):
+    '''
+    Guess the cause of the failure of the calculation in directory.
+
+    Returns:
+    - failure: one of WALLTIME, MEMORY, SCF, UNKNOWN_FAILURE
+    '''
+
+    texts = []
+    if os.path.isfile(f'{directory}/OUTCAR'):
+        texts.append(read_tail(f'{directory}/OUTCAR'))
+    for pattern in STDOUT_PATTERNS:
+        paths = [p for p in glob.glob(f'{directory}/{pattern}') if os.path.isfile(p)]
+        if paths:
+            texts.append(read_tail(max(paths, key=os.path.getmtime)))
+    text = '\n'.join(texts).lower()
+
+    # killed by the scheduler first: the other markers could be a consequence
+    for failure, markers in ((WALLTIME, WALLTIME_MARKERS),
+                             (MEMORY, MEMORY_MARKERS),
+                             (SCF, SCF_MARKERS)):
+        if any(marker in text for marker in markers):
+            return failure
+
+    return UNKNOWN_FAILURE
+
+
+def read_policy(root : str = '.'):
+    '''
+    Resubmission policy: DEFAULT_POLICY, updated with the optional key
+    "resubmission" of settings.json.
+    '''
+    policy = dict(DEFAULT_POLICY)
+    with open(os.path.join(root, 'settings.json')) as f:
+        policy.update(json.load(f).get('resubmission', {}))
+
+    unknown = set(policy) - set(DEFAULT_POLICY)
+    if unknown:
+        raise ValueError(f"Unknown keys {sorted(unknown)} in resubmission of settings.json, "\
+                         f"must be among {list(DEFAULT_POLICY)}.")
+
+    return policy
+
+
+def read_history(root : str = '.'):
+    '''
+    Returns:
+    - history: dict {job directory: list of failures {time, failure, retry, escalation}}
+    '''
+    path = os.path.join(root, HISTORY_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_history(history : dict, root : str = '.'):
+    '''
+    Save the history of the failures to resubmission_history.json
+    '''
+    path = os.path.join(root, HISTORY_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(history, f, indent=4)
+    os.replace(f'{path}.tmp', path)
+
+
+def get_escalation(failures : list[dict], policy : dict):
+    '''
+    Combine the escalation steps for the failures of a calculation.
+
+    Args:
+    - failures: list of the failures of the calculation (see read_history)
+    - policy: resubmission policy (see read_policy)
+
+    Returns:
+    - escalation: dict with walltime_factor, nodes_factor and incar (tags)
+    '''
+    escalation = {'walltime_factor': 1, 'nodes_factor': 1, 'incar': {}}
+    retries = {}
+    for entry in failures:
+        failure = entry['failure']
+        retries[failure] = retries.get(failure, 0) + 1
+        ladder = policy.get(failure, [])
+        if not ladder:
+            continue
+        step = ladder[min(retries[failure], len(ladder)) - 1]
+        escalation['walltime_factor'] *= step.get('walltime_factor', 1)
+        escalation['nodes_factor'] *= step.get('nodes_factor', 1)
+        escalation['incar'].update(step.get('incar', {}))
+
+    return escalation
+
+
+def triage(subdirs : list[str], root : str = '.'):
+    '''
+    Classify the failures of the calculations in subdirs (relative to root)
+    and decide which ones are submitted again. Nothing is recorded in the
+    history until the calculations are submitted (see record_resubmissions).
+    The calculations with a job in the scheduler queue must be excluded
+    by the caller (see jobs.get_queued_jobs).
+
+    Args:
+    - subdirs: directories of the calculations that did not complete
+    - root: directory of the project
+
+    Returns:
+    - failures: dict {subdir: failure} of the calculations to submit again
+    - given_up: subdirs that failed more than max_retries times
+    '''
+
+    if not subdirs:
+        return {}, []
+
+    policy = read_policy(root)
+    history = read_history(root)
+
+    failures, given_up = {}, []
+    for subdir in subdirs:
+        path = os.path.relpath(os.path.join(root, subdir))
+        failure = classify_failure(os.path.join(root, subdir))
+        retries = len(history.get(subdir, []))
+        if retries >= policy['max_retries']:
+            print(f"{path}: failed ({failure}) after {retries} retries, giving up.")
+            given_up.append(subdir)
+            continue
+
+        failures[subdir] = failure
+        escalation = get_escalation(history.get(subdir, []) + [{'failure': failure}], policy)
+        print(f"{path}: failed ({failure}), retry {retries + 1}/{policy['max_retries']}"\
+              f"{_describe(escalation)}.")
+
+    return failures, given_up
+
+
+def get_escalations(failures : dict[str, str], root : str = '.'):
+    '''
+    Escalations to apply to the calculations submitted again, combining
+    the failures in the history with the new ones
+
+    Args:
+    - failures: dict {subdir: failure} of the calculations to submit again (see triage)
+    - root: directory of the project
+
+    Returns:
+    - escalations: dict {subdir: escalation}
+    '''
+    if not failures:
+        return {}
+
+    policy = read_policy(root)
+    history = read_history(root)
+    return {subdir: get_escalation(history.get(subdir, []) + [{'failure': failure}], policy)
+            for subdir, failure in failures.items()}
+
+
+def record_resubmissions(failures : dict[str, str],
+                         subdirs : list[str],
+                         job_ids : list[int | None],
+                         root : str = '.'):
+    '''
+    Record in the history the failures of the calculations that were
+    submitted again, i.e. for which the submission returned a job id.
+
+    Args:
+    - failures: dict {subdir: failure} of the calculations submitted again (see triage)
+    - subdirs: directories of the submitted calculations
+    - job_ids: ids of the jobs, in the order of subdirs (None for the failed submissions,
+        see jobs.launch_jobs)
+    - root: directory of the project
+    '''
+    submitted = {subdir: job_id for subdir, job_id in zip(subdirs, job_ids)
+                 if subdir in failures and job_id is not None}
+    if not submitted:
+        return
+
+    policy = read_policy(root)
+    history = read_history(root)
+    for subdir, job_id in submitted.items():
+        entries = history.setdefault(subdir, [])
+        entries.append({'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                        'failure': failures[subdir],
+                        'retry': len(entries) + 1,
+                        'job_id': job_id})
+        entries[-1]['escalation'] = get_escalation(entries, policy)
+
+    write_history(history, root)
+
+
+def rotate_failed_outputs(job_dir : str):
+    '''
+    Move the outputs of the failed run in job_dir (OUTCAR, vasprun.xml, OSZICAR
+    and the standard output/error of the job) to failed_runs/<n>/, with n the
+    number of failed runs moved so far.
+    '''
+    paths = [os.path.join(job_dir, name) for name in OUTPUT_FILES]
+    for pattern in STDOUT_PATTERNS:
+        paths += glob.glob(os.path.join(job_dir, pattern))
+    paths = [path for path in paths if os.path.isfile(path)]
+    if not paths:
+        return
+
+    failed_runs = os.path.join(job_dir, FAILED_RUNS_DIR)
+    os.makedirs(failed_runs, exist_ok=True)
+    destination = os.path.join(failed_runs, str(len(os.listdir(failed_runs)) + 1))
+    os.makedirs(destination)
+    for path in paths:
+        shutil.move(path, destination)
+
+
+def _describe(escalation : dict):
+    '''
+    Short description of an escalation
+    '''
+    changes = []
+    if escalation['walltime_factor'] != 1:
+        changes.append(f"walltime x{escalation['walltime_factor']:g}")
+    if escalation['nodes_factor'] != 1:
+        changes.append(f"nodes x{escalation['nodes_factor']:g}")
+    changes += [f'{tag}={value}' for tag, value in escalation['incar'].items()]
+    return f" with {', '.join(changes)}" if changes else ''
+
+
+def _parse_walltime(walltime : str, pbs : bool = False):
+    '''
+    Time limit in seconds, or None if it is not a number of seconds (e.g. UNLIMITED).
+    Slurm formats: M, M:S, H:M:S, D-H, D-H:M, D-H:M:S.
+    PBS format: [[H:]M:]S.
+    '''
+    days, _, walltime = walltime.rpartition('-')
+    fields = walltime.split(':')
+    if (pbs and days) or len(fields) > 3 or not all(x.isdigit() for x in [*fields, days or '0']):
+        return None
+    fields = [int(field) for field in fields]
+
+    if pbs:
+        units = (3600, 60, 1)[-len(fields):]
+    elif days:
+        units = (3600, 60, 1)[:len(fields)]
+    else:
+        units = {1: (60,), 2: (60, 1), 3: (3600, 60, 1)}[len(fields)]
+    return sum(field * unit for field, unit in zip(fields, units)) + int(days or 0) * 86400
+
+
+def _format_walltime(seconds : int, days_format : bool = True):
+    '''
+    Time limit in [D-]HH:MM:SS format (HH:MM:SS with more than 24 hours for PBS)
+    '''
+    days, seconds = divmod(int(seconds), 86400) if days_format else (0, int(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    walltime = f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+    return f'{days}-{walltime}' if days else walltime
+
+
+def apply_escalation(job_dir : str, escalation : dict):
+    '''
+    Apply an escalation to the (staged) INCAR and jobscript.sh of job_dir.
+    The time limit and the number of nodes are changed in the #SBATCH or #PBS lines.
+    '''
+
+    if escalation['incar']:
+        tags = {tag.upper(): value for tag, value in escalation['incar'].items()}
+        with open(f'{job_dir}/INCAR', 'r', encoding=sys.getfilesystemencoding()) as f:
+            lines = f.readlines()
+        # remove the previous values of the tags, also from lines with several tags (;)
+        new_lines = []
+        for line in lines:
+            statements = [s for s in line.rstrip('\n').split(';')
+                          if s.split('=')[0].strip().upper() not in tags or '=' not in s]
+            if statements and any(s.strip() for s in statements):
+                new_lines.append(';'.join(statements) + '\n')
+            elif not line.strip():
+                new_lines.append(line)
+        new_lines += [f'{tag} = {value}\n' for tag, value in tags.items()]
+        with open(f'{job_dir}/INCAR', 'w', encoding=sys.getfilesystemencoding()) as f:
+            f.writelines(new_lines)
+
+    if escalation['walltime_factor'] == 1 and escalation['nodes_factor'] == 1:
+        return
+
+    with open(f'{job_dir}/jobscript.sh', 'r', encoding=sys.getfilesystemencoding()) as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        # the same #PBS line can contain both walltime and nodes
+        line = line.rstrip('\n')
+        if escalation['walltime_factor'] != 1:
+            for regex in (TIME_RE, PBS_TIME_RE):
+                match = regex.match(line)
+                seconds = _parse_walltime(match.group(2), pbs=regex is PBS_TIME_RE) if match else None
+                if seconds is not None:  # non-numeric limits (e.g. UNLIMITED) are left unchanged
+                    walltime = _format_walltime(seconds * escalation['walltime_factor'],
+                                                days_format=regex is TIME_RE)
+                    line = f'{match.group(1)}{walltime}{match.group(3)}'
+        if escalation['nodes_factor'] != 1:
+            for regex in (NODES_RE, PBS_NODES_RE):
+                match = regex.match(line)
+                if match:
+                    nodes = math.ceil(int(match.group(2)) * escalation['nodes_factor'])
+                    line = f'{match.group(1)}{nodes}{match.group(3)}'
+        lines[i] = line + '\n'
+    with open(f'{job_dir}/jobscript.sh', 'w', encoding=sys.getfilesystemencoding()) as f:
+        f.writelines(lines)
@@ -2,14 +2,23 @@
 Common utility functions for IR and Raman calculations
 '''
 
+from __future__ import annotations
+import os
 import warnings
 import json
 from pathlib import Path
 from dataclasses import dataclass
 
 import numpy as np
+from ase import units
+from ase.constraints import FixAtoms
 from ase.io import read
 from ase.calculators.vasp import Vasp
+from ase.vibrations import VibrationsData
+
+from xphon.calculations.probe import read_tail, read_epsilon_fast
+from xphon.calculations.archive import get_archive, read_archived_epsilon, read_archived_structure
+from xphon.profiling import Timer
 
 
 @dataclass
@@ -20,50 +29,243 @@ class Mode:
     - id: index of the mode, starting from 1 for the lowest freq mode
     - id: index of the mode as written in VASP OUTCAR (reverse order)
     - frequency: mode freq. in cm-1
-    - eigvec: eigenvector of the mode (list of displacements [[dx dy dz], ...] for each atom)
+    - eigvec: eigenvector of the mode (array of displacements [[dx dy dz], ...] for each atom),
+        usually a view of the memory-mapped eigenvectors.npy
     - norm: norm of the N-dimensional eigenvector
     '''
 
     id: int
     id_vasp: int
     frequency: float
-    eigvec: list
+    eigvec: np.ndarray
     norm: float
 
 
+# cache of the phonon calculation, written next to vasprun.xml
+FREQUENCIES_FILE = 'frequencies.npy'
+EIGENVECTORS_FILE = 'eigenvectors.npy'
+HESSIAN_FILE = 'hessian.npy'
+
+# max size (bytes) of the chunks of eigenvectors loaded in memory at once
+CHUNK_BYTES = 64 * 1024**2
+
+
+def read_structure(directory: str):
+    '''
+    Read the structure of the phonon calculation from POSCAR (or from the archive, if any)
+    '''
+    if not os.path.isfile(f'{directory}/POSCAR'):
+        atoms = read_archived_structure(directory)
+        if atoms is not None:
+            return atoms
+    return read(f'{directory}/POSCAR')
+
+
+def write_fake_ase_sort(directory: str):
+    '''
+    Write fake ase-sort.dat (identity) to make ase happy
+    '''
+    if not Path(f'{directory}/ase-sort.dat').is_file():
+        atoms = read(f'{directory}/POSCAR')
+        with open(f'{directory}/ase-sort.dat', 'w') as f:
+            for n in range(len(atoms)):
+                f.write('%5i %5i \n' % (n, n))
+
+
+def _is_cache_valid(directory: str, filenames: list[str]):
+    '''
+    Check if all the cache files exist and are newer than vasprun.xml
+    '''
+    vasprun_mtime = Path(f'{directory}/vasprun.xml').stat().st_mtime
+    return all(Path(f'{directory}/{filename}').is_file()
+               and Path(f'{directory}/{filename}').stat().st_mtime >= vasprun_mtime
+               for filename in filenames)
+
+
+def _save_cache(directory: str, arrays: dict):
+    '''
+    Save the arrays {filename: array} in directory. They are written to
+    temporary files first, so that an interrupted write does not leave a valid cache.
+    '''
+    for filename, array in arrays.items():
+        np.save(f'{directory}/{filename}.tmp.npy', array)
+    for filename in arrays:
+        os.replace(f'{directory}/{filename}.tmp.npy', f'{directory}/{filename}')
+
+
+def _read_ase_vibrations(directory: str):
+    '''
+    Read the VibrationsData (Hessian) of the phonon calculation with ASE
+    '''
+
+    write_fake_ase_sort(directory)
+
+    with Timer('read_vibrations.read_outputs'):
+        vasp = Vasp(directory=directory)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            vasp.read()
+
+    with Timer('read_vibrations.read_hessian'):
+        return vasp.get_vibrations()
+
+
+@Timer('read_vibrations')
+def read_vibrations(directory: str):
+    '''
+    Read frequencies and eigenvectors of all the modes of the phonon calculation.
+
+    The first time, the Hessian is read from vasprun.xml and diagonalized,
+    and the results are cached in frequencies.npy and eigenvectors.npy,
+    in the same directory. Then (as long as vasprun.xml is not modified),
+    they are read from the cache, with the eigenvectors memory-mapped, so that
+    they are never fully loaded in memory. If the project was archived, they
+    are read (memory-mapped) from the archive.
+
+    Args:
+    - directory: path to the directory containing the calculation results
+
+    Returns:
+    - frequencies: (3n,) complex array of frequencies in cm-1, for the n atoms
+        free to move (imaginary modes have non-zero imaginary part)
+    - eigenvectors: (3n, N, 3) read-only memory-mapped array of the eigenvectors
+        (with zero displacement for the fixed atoms)
+    '''
+
+    if not os.path.isfile(f'{directory}/vasprun.xml'):
+        archive = get_archive(directory)
+        if archive is not None:
+            return archive['frequencies'], archive['eigenvectors']
+
+    if not _is_cache_valid(directory, [FREQUENCIES_FILE, EIGENVECTORS_FILE]):
+
+        vibr = _read_ase_vibrations(directory)
+
+        with Timer('read_vibrations.diagonalize'):
+            # eigenvectors of the 3n modes of the n free atoms, with zero displacement for the fixed ones
+            energies, eigenvectors = vibr.get_energies_and_modes(all_atoms=True)
+            frequencies = energies / units.invcm
+            del vibr
+
+        with Timer('read_vibrations.write_cache'):
+            _save_cache(directory, {FREQUENCIES_FILE: frequencies,
+                                    EIGENVECTORS_FILE: eigenvectors})
+            del eigenvectors
+
+    frequencies = np.load(f'{directory}/{FREQUENCIES_FILE}')
+    eigenvectors = np.load(f'{directory}/{EIGENVECTORS_FILE}', mmap_mode='r')
+
+    return frequencies, eigenvectors
+
+
+@Timer('read_hessian')
+def read_hessian(directory: str):
+    '''
+    Read the (non mass-weighted) Hessian of the phonon calculation.
+    The first time, it is read from vasprun.xml and cached in hessian.npy.
+
+    Note that, as in ase Vasp.get_vibrations, the Hessian is obtained
+    from the mass-weighted one in vasprun.xml using the standard ASE masses.
+
+    Args:
+    - directory: path to the directory containing the calculation results
+
+    Returns:
+    - atoms: equilibrium structure (with the constraints, if any)
+    - hessian: (3n, 3n) Hessian in eV/A^2 for the n free atoms
+    - indices: indices of the n free atoms
+    '''
+
+    if not os.path.isfile(f'{directory}/vasprun.xml'):
+        archive = get_archive(directory)
+        if archive is not None:
+            return read_archived_structure(directory), archive['hessian'], archive['indices']
+
+    if not _is_cache_valid(directory, [HESSIAN_FILE]):
+        vibr = _read_ase_vibrations(directory)
+        with Timer('read_hessian.write_cache'):
+            _save_cache(directory, {HESSIAN_FILE: vibr.get_hessian_2d()})
+        del vibr
+
+    atoms = read(f'{directory}/POSCAR')
+    indices = VibrationsData.indices_from_constraints(atoms)
+
+    return atoms, np.load(f'{directory}/{HESSIAN_FILE}'), indices
+
+
+def get_chunk_size(eigenvectors: np.ndarray):
+    '''
+    Number of eigenvectors that fit in a chunk of CHUNK_BYTES
+    '''
+    return max(1, CHUNK_BYTES // max(1, eigenvectors[0].nbytes))
+
+
+def iter_mode_chunks(modes_list: list, chunk_size: int | None = None):
+    '''
+    Iterate over the modes in chunks, loading the eigenvectors of
+    each chunk from the (memory-mapped) storage into a single array.
+
+    Args:
+    - modes_list: list of Mode objects
+    - chunk_size: number of modes per chunk (default: see get_chunk_size)
+
+    Yields:
+    - modes: list of the Mode objects of the chunk
+    - eigvecs: (len(modes), N, 3) array with their eigenvectors
+    '''
+
+    if not modes_list:
+        return
+    if chunk_size is None:
+        chunk_size = get_chunk_size(np.asarray(modes_list[0].eigvec)[np.newaxis])
+
+    for start in range(0, len(modes_list), chunk_size):
+        chunk = modes_list[start:start + chunk_size]
+        yield chunk, np.array([mode.eigvec for mode in chunk])
+
+
+@Timer('get_modes')
 def get_modes(directory: str):
     '''
     Read phonon modes from vasprun.xml file, excluding imaginary modes.
+    The eigenvectors of the modes are views of the memory-mapped
+    eigenvectors.npy cache (see read_vibrations).
 
     Args:
     - directory: path to the directory containing the calculation results
-    - natoms: number of atoms in the structure
 
     Returns:
     - modes_list: list of Mode objects
     '''
 
-    modes_list : list[Mode] = []
+    frequencies, eigenvectors = read_vibrations(directory)
 
-    if not Path(f'{directory}/ase-sort.dat').is_file():
-        #write fake ase-sort.dat to make ase happy
-        atoms = read(f'{directory}/POSCAR')
-        with open(f'{directory}/ase-sort.dat', 'w') as f:
-            for n in range(len(atoms)):
-                f.write('%5i %5i \n' % (n, n))
+    return build_modes_list(frequencies, eigenvectors)
+
+
+def build_modes_list(frequencies: np.ndarray, eigenvectors: np.ndarray):
+    '''
+    Build the list of Mode objects from frequencies and eigenvectors,
+    excluding imaginary modes.
+
+    Args:
+    - frequencies: (3N,) complex array of frequencies in cm-1
+    - eigenvectors: (3N, N, 3) array of the eigenvectors (can be memory-mapped)
 
-    vasp = Vasp(directory=directory)
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        vasp.read()
+    Returns:
+    - modes_list: list of Mode objects
+    '''
 
-    vibr = vasp.get_vibrations()
+    modes_list : list[Mode] = []
 
-    frequencies = vibr.get_frequencies()
     frequencies_vasp = np.array([len(frequencies)-i for i in range(len(frequencies))])
-    eigenvectors = vibr.get_modes()
-    norms = np.array([np.linalg.norm(eig) for eig in eigenvectors])
 
+    # norms computed in chunks, to avoid loading all the eigenvectors at once
+    chunk_size = get_chunk_size(eigenvectors)
+    norms = np.empty(len(eigenvectors))
+    for start in range(0, len(eigenvectors), chunk_size):
+        chunk = eigenvectors[start:start + chunk_size]
+        norms[start:start + chunk_size] = np.linalg.norm(chunk.reshape(len(chunk), -1), axis=1)
 
     real_frequencies_idxs = [i for i in range(len(frequencies)) if frequencies[i].imag == 0]
 
@@ -77,46 +279,84 @@ def get_modes(directory: str):
     return modes_list
 
 
+@Timer('get_epsilon')
 def get_epsilon(vasprun_path : str):
     '''
-    Read dielectric tensor from vasprun.xml file
+    Read dielectric tensor from vasprun.xml file.
+    If the file is complete, the dielectric block is read directly
+    from the end of the file, otherwise the whole file is parsed.
+    If the file is not present, the tensor is read from the archive, if any.
     '''
 
+    if not os.path.isfile(vasprun_path):
+        epsilon = read_archived_epsilon(os.path.dirname(vasprun_path))
+        if epsilon is not None:
+            return epsilon
+
+    if '</modeling>' in read_tail(vasprun_path, 1024):
+        epsilon = read_epsilon_fast(vasprun_path)
+        if epsilon is not None:
+            return epsilon
+
     atoms = read(vasprun_path)
 
     return atoms.calc.results['dielectric_tensor']
 
 
+@Timer('get_born_charges')
 def get_born_charges(vasprun_path : str):
     '''
-    Read Born charges from vasprun.xml file
+    Read Born charges from vasprun.xml file (or from the archive, if any)
     '''
 
+    if not os.path.isfile(vasprun_path):
+        archive = get_archive(os.path.dirname(vasprun_path))
+        if archive is not None:
+            return archive['born_charges']
+
     atoms = read(vasprun_path)
 
     return atoms.calc.results['born_effective_charges']
 
 
-def read_input_parameters():
+@Timer('read_input_parameters')
+def read_input_parameters(root : str = '.'):
     '''
-    Reads input parameters from json file, and atoms from POSCAR
+    Reads input parameters from json file, and atoms from POSCAR.
+
+    Only the active atoms are displaced in the phonon calculation: these are the
+    atoms listed in the optional key 'active_atoms' of settings.json (indices
+    starting from 1, in the order of POSCAR), or otherwise the atoms that are
+    free to move according to the selective dynamics flags of POSCAR.
+
+    Args:
+    - root: directory of the project
 
     Returns:
-    - atoms: atoms object
+    - atoms: atoms object (with the inactive atoms fixed by a FixAtoms constraint)
     - step_size: step size for finite difference
-    - jobscript_path: path to jobscript template
+    - jobscript_path: path to jobscript template (relative paths in settings.json
+        are relative to root)
     - submit_command: command to submit job
     '''
 
     #read settings from json file and initialize parameters####################
-    with open('settings.json') as f:
+    with open(os.path.join(root, 'settings.json')) as f:
         settings : dict = json.load(f)
 
         step_size = settings.get('step_size', 0.01)
-        jobscript_path = settings['jobscript_path']
+        jobscript_path = os.path.join(root, settings['jobscript_path'])
         submit_command = settings.get('submit_command', 'sbatch')
+        active_atoms = settings.get('active_atoms', None)
+
 
+    atoms = read(os.path.join(root, 'POSCAR'))
 
-    atoms = read('POSCAR')
+    if active_atoms is not None:
+        if any(not 1 <= i <= len(atoms) for i in active_atoms):
+            raise ValueError(f"active_atoms in settings.json must be between 1 and {len(atoms)}.")
+        mask = np.ones(len(atoms), dtype=bool)
+        mask[np.array(active_atoms, dtype=int) - 1] = False
+        atoms.set_constraint(FixAtoms(mask=mask))
 
     return atoms, step_size, jobscript_path, submit_command
@@ -0,0 +1,43 @@
+'''
+CLI parser for command: archive
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase
+
+
+class CLICommand(CLICommandBase):
+    """Archive a finished project, to save disk space and inodes.
+
+    The data needed by xphon (eigenvectors, Hessian, Born charges and dielectric
+    tensors) are extracted to xphon_archive.npz, the raw outputs of phonons/ and
+    raman_calcs/ are packed in xphon_raw_outputs.tar.gz, and the directories are deleted.
+    All the write/plot commands then read the data from the archive.
+
+    Example usage:
+    xphon archive
+    xphon archive -compression xz
+    xphon archive -restore
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        parser.add_argument('-compression', choices=['gz', 'xz', 'none'], default='gz',
+                            help='Compression of the tarball with the raw outputs.')
+        parser.add_argument('-restore', action='store_true',
+                            help='Extract the raw outputs from the tarball and remove the archive.')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        from xphon.project import Project
+
+        if args.restore:
+            Project('.').restore()
+        else:
+            Project('.').archive(compression=args.compression)
+
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
@@ -0,0 +1,57 @@
+'''
+CLI parser for command: benchmark
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase, nonnegative_int, positive_int
+
+
+class CLICommand(CLICommandBase):
+    """Benchmark the pipeline on synthetic projects (no VASP needed).
+
+    Synthetic phonons/ and raman_calcs/ trees are generated for each
+    number of atoms, and every stage of the pipeline is timed.
+
+    Example usage:
+    xphon benchmark
+    xphon benchmark -sizes 10 100 1000 -max-raman-modes 100
+    xphon benchmark -stages get_modes write_ir_spectrum -no-memory
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        from xphon.benchmarks.suite import STAGES
+        parser.add_argument('-sizes', type=positive_int, nargs='+', default=[10, 30, 100],
+                            help='Numbers of atoms of the synthetic projects.')
+        parser.add_argument('-stages', choices=STAGES, nargs='+',
+                            help='Stages to benchmark (default: all).')
+        parser.add_argument('-repeats', type=positive_int, default=1,
+                            help='Number of timed runs of each stage (the best one is reported).')
+        parser.add_argument('-max-raman-modes', type=nonnegative_int,
+                            help='Only generate the Raman displacements for the first modes (default: all).')
+        parser.add_argument('-workdir', default='xphon_benchmark',
+                            help='Directory where the synthetic projects are generated.')
+        parser.add_argument('-no-memory', action='store_true', default=False,
+                            help='Do not measure the peak memory of each stage.')
+        parser.add_argument('-no-plot', action='store_true', default=False,
+                            help='Do not plot the scaling curves.')
+        parser.add_argument('-keep', action='store_true', default=False,
+                            help='Keep the synthetic projects after the benchmark.')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        from xphon.benchmarks.suite import run_benchmarks
+        run_benchmarks(sizes=args.sizes,
+                       workdir=args.workdir,
+                       stages=args.stages,
+                       repeats=args.repeats,
+                       memory=not args.no_memory,
+                       max_raman_modes=args.max_raman_modes,
+                       plot=not args.no_plot,
+                       keep=args.keep)
+
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
@@ -0,0 +1,70 @@
+'''
+CLI parser for command: campaign
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase, positive_int, nonnegative_float
+
+
+MIN_POLL_INTERVAL = 10
+
+
+def poll_interval(value):
+    '''
+    Check if a value is a time (s) between two checks of the scheduler queue,
+    long enough not to flood the scheduler.
+    '''
+    fvalue = float(value)
+    if fvalue < MIN_POLL_INTERVAL:
+        raise argparse.ArgumentTypeError(f"{value} is shorter than {MIN_POLL_INTERVAL} s")
+    return fvalue
+
+
+class CLICommand(CLICommandBase):
+    """Run IR and Raman calculations for many structures, sharing one submission queue.
+
+    The manifest lists the directories of the structures (each one with the usual
+    input files), either one per line in a text file or as a json list.
+    The phonon calculations are submitted first, and the Raman calculations of each
+    structure are submitted as soon as its phonon calculation is finished, keeping at
+    most -max-jobs jobs in the scheduler queue. When all the calculations are finished,
+    the spectra of all the structures are collected in campaign_ir.dat and campaign_raman.dat.
+    The state is saved in campaign_state.json, so an interrupted campaign can be resumed.
+    These files are written in the directory of the manifest.
+
+    Example usage:
+    xphon campaign structures.txt
+    xphon campaign structures.json -max-jobs 200 -poll 300
+    xphon campaign structures.txt -once
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        parser.add_argument('manifest',
+                            help='File with the list of structure directories (txt or json).')
+        parser.add_argument('-max-jobs', type=positive_int, default=50,
+                            help='Maximum number of jobs of the campaign in the scheduler queue.')
+        parser.add_argument('-poll', type=poll_interval, default=60,
+                            help=f'Time (s) between two checks of the scheduler queue (at least {MIN_POLL_INTERVAL}).')
+        parser.add_argument('-once', action='store_true',
+                            help='Do a single update and submission step and exit (e.g. for a cron job).')
+        parser.add_argument('-broaden', choices=['gauss', 'lorentz'], default='lorentz',
+                            help='Type of broadening of the spectra in the comparison tables.')
+        parser.add_argument('-fwhm', type=nonnegative_float, default=10.0,
+                            help='Broadening FWHM of the spectra in the comparison tables.')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        from xphon.calculations.campaign import run_campaign
+        run_campaign(args.manifest,
+                     max_jobs=args.max_jobs,
+                     poll_interval=args.poll,
+                     once=args.once,
+                     fwhm=args.fwhm,
+                     function=args.broaden)
+
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
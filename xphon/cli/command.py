@@ -2,7 +2,8 @@
 Small module to define an abstract base class for CLI commands.
 This is useful to ensure that all CLI commands have the same interface.
 
-It also defines two helper functions to check if a value is a positive integer or float.
+It also defines helper functions to check if a value is a non-negative integer,
+a positive integer or a positive float.
 '''
 
 from abc import ABC, abstractmethod
@@ -39,6 +40,15 @@ def nonnegative_int(value):
         raise argparse.ArgumentTypeError(f"{value} is negative")
     return ivalue
 
+def positive_int(value):
+    '''
+    Check if a value is a strictly positive integer.
+    '''
+    ivalue = int(value)
+    if ivalue < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not positive")
+    return ivalue
+
 def nonnegative_float(value):
     '''
     Check if a value is a positive float.
@@ -48,6 +58,15 @@ def nonnegative_float(value):
         raise argparse.ArgumentTypeError(f"{value} is not positive")
     return fvalue
 
+def positive_float(value):
+    '''
+    Check if a value is a strictly positive (finite) float.
+    '''
+    fvalue = float(value)
+    if not 0 < fvalue < float('inf'):
+        raise argparse.ArgumentTypeError(f"{value} is not positive")
+    return fvalue
+
 class CustomFormatter(argparse.RawDescriptionHelpFormatter,
                       argparse.ArgumentDefaultsHelpFormatter):
     '''
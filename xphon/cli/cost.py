@@ -0,0 +1,35 @@
+'''
+CLI parser for command: cost
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase, nonnegative_int
+
+
+class CLICommand(CLICommandBase):
+    """Core-hours used by the finished calculations and projection for the pending ones.
+
+    The timings are read from the OUTCARs of phonons/ and raman_calcs/ and cached in
+    cost_cache.json. The statistics are written to cost_report.json, and the timings
+    of each job to cost_jobs.dat.
+
+    Example usage:
+    xphon cost
+    xphon cost -max-jobs 50
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        parser.add_argument('-max-jobs', type=nonnegative_int,
+                            help='Number of jobs running at the same time, to project the wall time.')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        from xphon.project import Project
+        Project('.').cost(max_jobs=args.max_jobs)
+
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
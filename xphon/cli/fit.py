@@ -0,0 +1,91 @@
+'''
+CLI parser for command: fit
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase, positive_int, positive_float
+
+
+class GridAction(argparse.Action):
+    '''
+    Check a grid MIN MAX [STEP]: MIN must not exceed MAX, and STEP must be positive.
+    '''
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values[0] > values[1]:
+            parser.error(f"argument {option_string}: MIN {values[0]:g} is greater than MAX {values[1]:g}")
+        if len(values) == 3 and values[2] <= 0:
+            parser.error(f"argument {option_string}: STEP {values[2]:g} is not positive")
+        setattr(namespace, self.dest, values)
+
+
+class CLICommand(CLICommandBase):
+    """Fit the computed spectrum to an experimental one (after xphon write).
+
+    The scale factor and shift of the frequencies (f -> scale*f + shift) and the FWHM
+    of the broadening are searched on a grid, scoring each combination by the cosine
+    similarity with the experimental spectrum (a two-column file). The best candidates
+    are written to <spectrum>_fit.dat, and the overlays are plotted to <spectrum>_fit.png.
+
+    Example usage:
+    xphon fit ir experimental_ir.dat
+    xphon fit raman exp.txt -scale 0.95 1.02 0.001 -shift -20 20 -fwhm 2 30 0.5 -range 200 1800
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        parser.add_argument('spectrum',
+                            choices=['ir', 'raman'],
+                            help='Which spectrum to fit.')
+        parser.add_argument('experiment',
+                            help='Two-column file (frequency in cm-1, intensity) with the experimental spectrum.')
+        parser.add_argument('-scale', type=float, action=GridAction, nargs=3, default=[0.9, 1.05, 0.0025],
+                            metavar=('MIN', 'MAX', 'STEP'),
+                            help='Grid of the scale factors of the frequencies.')
+        parser.add_argument('-shift', type=float, action=GridAction, nargs=2, default=[-50, 50],
+                            metavar=('MIN', 'MAX'),
+                            help='Range of the shifts (cm-1) of the frequencies, in steps of -step.')
+        parser.add_argument('-fwhm', type=float, action=GridAction, nargs=3, default=[2, 40, 1],
+                            metavar=('MIN', 'MAX', 'STEP'),
+                            help='Grid of the FWHMs (cm-1) of the broadening.')
+        parser.add_argument('-step', type=positive_float, default=0.5,
+                            help='Spacing (cm-1) of the frequency grid on which the spectra are compared.')
+        parser.add_argument('-broaden', choices=['gauss', 'lorentz'], default='lorentz',
+                            help='Type of broadening.')
+        parser.add_argument('-range', type=float, nargs=2,
+                            help='Frequency range (cm-1) of the experimental spectrum to fit.')
+        parser.add_argument('-laser-freq', type=float,
+                            help='Frequency in cm^-1 of the laser used to excite the Raman spectrum.')
+        parser.add_argument('-temperature', type=float, default=300,
+                            help='Temperature in K for the Raman spectrum.')
+        parser.add_argument('-top', type=positive_int, default=5,
+                            help='Number of best candidates reported and plotted.')
+        parser.add_argument('-no-plot', action='store_true', default=False,
+                            help='Do not plot the overlays.')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        import numpy as np
+        from xphon.project import Project
+
+        def grid(start, stop, step):
+            return np.arange(start, stop + step/2, step)
+
+        Project('.').fit(spectrum=args.spectrum,
+                         experiment_path=args.experiment,
+                         scales=grid(*args.scale),
+                         shift_range=args.shift,
+                         fwhms=grid(*args.fwhm),
+                         function=args.broaden,
+                         step=args.step,
+                         freq_range=args.range,
+                         laser_freq=args.laser_freq,
+                         temperature=args.temperature,
+                         top=args.top,
+                         plot=not args.no_plot)
+
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
@@ -20,8 +20,8 @@ class CLICommand(CLICommandBase):
 
     @staticmethod
     def run(args : argparse.Namespace):
-        from xphon.calculations.ir import launch_ir_calculation
-        launch_ir_calculation()
+        from xphon.project import Project
+        Project('.').launch_ir()
 
 
     @staticmethod
@@ -0,0 +1,51 @@
+'''
+CLI parser for command: isotope
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase
+
+
+class CLICommand(CLICommandBase):
+    """IR spectra of isotopologues, from the Hessian of the phonon calculation (no new VASP runs).
+
+    The masses can be substituted for all the atoms of an element (e.g. H=2.014),
+    or for single atoms, by index starting from 1 (e.g. 3=13.00335).
+    The spectra are written to ir_spectrum_<label>.dat.
+
+    Example usage:
+    xphon isotope -masses H=2.014 -label d6
+    xphon isotope -masses 1=13.00335 2=13.00335 -label 13C2
+    xphon isotope -batch isotopologues.json
+
+    where isotopologues.json contains e.g.:
+    {"d6": {"H": 2.014}, "13C2": {"1": 13.00335, "2": 13.00335}}
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('-masses', nargs='+',
+                            help='Mass substitutions, as X=mass (amu), with X element symbol or atom index.')
+        group.add_argument('-batch',
+                            help='Json file with the mass substitutions of several isotopologues.')
+        parser.add_argument('-label', default='isotope',
+                            help='Label of the isotopologue (only with -masses).')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        from xphon.calculations.isotope import read_isotopologues, parse_masses
+        from xphon.project import Project
+
+        if args.batch:
+            isotopologues = read_isotopologues(args.batch)
+        else:
+            isotopologues = {args.label: parse_masses(args.masses)}
+
+        Project('.').isotope_spectra(isotopologues)
+
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
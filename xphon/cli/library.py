@@ -0,0 +1,97 @@
+'''
+CLI parser for command: library
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase, positive_int, positive_float
+
+
+class CLICommand(CLICommandBase):
+    """Library of the computed spectra of many projects, to find the structures
+    that best match a measured spectrum.
+
+    add: broaden the IR and Raman spectra (ir_spectrum.dat, raman_spectrum.dat) of the
+    projects found in the given directories (and their subdirectories) on the common grid
+    of the library, and add them to it. Projects already in the library are updated only
+    if their spectra were modified.
+    query: find the k entries whose spectra best match the given two-column spectra.
+    list: list the entries of the library.
+
+    Example usage:
+    xphon library add conformers/ adsorption_sites/
+    xphon library add new_project -library ~/spectra_library
+    xphon library query measured_ir.dat -k 10
+    xphon library query measured_raman.dat -spectrum raman -metric shift -max-shift 20
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        parser.add_argument('action',
+                            choices=['add', 'query', 'list'],
+                            help='Add projects, query the library, or list its entries.')
+        parser.add_argument('paths', nargs='*',
+                            help='add: directories of the projects (or containing them); '\
+                                 'query: files with the spectra to match.')
+        parser.add_argument('-library', default='xphon_library',
+                            help='Directory of the library.')
+        parser.add_argument('-spectrum', choices=['ir', 'raman'], default='ir',
+                            help='(query only) Which spectra to compare.')
+        parser.add_argument('-k', type=positive_int, default=5,
+                            help='(query only) Number of matches.')
+        parser.add_argument('-metric', choices=['cosine', 'shift'], default='cosine',
+                            help='(query only) Cosine similarity, or cosine similarity maximized over rigid shifts.')
+        parser.add_argument('-max-shift', type=float, default=30,
+                            help='(query only) Maximum shift (cm-1) for the shift metric.')
+        parser.add_argument('-range', type=float, nargs=2,
+                            help='(query only) Frequency range (cm-1) of the query spectrum to compare.')
+        parser.add_argument('-grid-range', type=float, nargs=2,
+                            help='(add, new library only) Frequency range (cm-1) of the grid (default 0 4000).')
+        parser.add_argument('-step', type=positive_float,
+                            help='(add, new library only) Spacing (cm-1) of the grid (default 2).')
+        parser.add_argument('-fwhm', type=positive_float,
+                            help='(add, new library only) Broadening FWHM (default 10).')
+        parser.add_argument('-broaden', choices=['gauss', 'lorentz'],
+                            help='(add, new library only) Type of broadening (default lorentz).')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        from xphon.postprocess import library
+
+        if args.action == 'add':
+            if not args.paths:
+                raise ValueError("Give the directories of the projects to add.")
+            grid_settings = {}
+            if args.grid_range is not None:
+                grid_settings['fmin'], grid_settings['fmax'] = args.grid_range
+            for key, value in (('step', args.step), ('fwhm', args.fwhm), ('function', args.broaden)):
+                if value is not None:
+                    grid_settings[key] = value
+            library.update_library(args.paths, library_dir=args.library, grid_settings=grid_settings)
+
+        elif args.action == 'query':
+            if not args.paths:
+                raise ValueError("Give the files with the spectra to match.")
+            from xphon.postprocess.fit import read_experimental_spectrum
+            index_and_spectra = library.read_library(args.library)
+            for path in args.paths:
+                x, y = read_experimental_spectrum(path, args.range)
+                matches = library.query_library(x, y,
+                                                spectrum=args.spectrum,
+                                                k=args.k,
+                                                metric=args.metric,
+                                                max_shift=args.max_shift,
+                                                library=index_and_spectra)
+                library.print_matches(matches, title=f"Best matches of {path} ({args.spectrum}, {args.metric}):")
+
+        elif args.action == 'list':
+            index, _ = library.read_library(args.library)
+            print(f"Library {args.library}: {len(index['entries'])} entries, grid {index['grid']}")
+            for entry in index['entries']:
+                print(f"  {entry['name']:<24} {entry['formula'] or '-':<14} "\
+                      f"IR {entry['ir_modes']:4d} modes, Raman {entry['raman_modes']:4d} modes  {entry['path']}")
+
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
@@ -4,7 +4,7 @@ CLI parser for command: plot
 
 import argparse
 
-from xphon.cli.command import CLICommandBase
+from xphon.cli.command import CLICommandBase, nonnegative_int
 
 
 class CLICommand(CLICommandBase):
@@ -32,17 +32,20 @@ class CLICommand(CLICommandBase):
                             help='Frequency range (cm-1) of the spectrum to plot.')
         parser.add_argument('-no-peaks', action='store_true', default=False,
                             help='Show the peaks in the spectrum.')
+        parser.add_argument('-assign-modes', type=nonnegative_int, default=3,
+                            help='Max number of dominant modes listed for each peak in <spectrum>_peaks.dat.')
 
     @staticmethod
     def run(args : argparse.Namespace):
-        from xphon.postprocess.plot import plot_spectrum
-        plot_spectrum(spectrum=args.spectrum,
-                        broaden_type=args.broaden,
-                        fwhm=args.fwhm,
-                        laser_freq=args.laser_freq,
-                        temperature=args.temperature,
-                        freq_range=args.range,
-                        show_peaks= not args.no_peaks)
+        from xphon.project import Project
+        Project('.').plot(spectrum=args.spectrum,
+                          broaden_type=args.broaden,
+                          fwhm=args.fwhm,
+                          laser_freq=args.laser_freq,
+                          temperature=args.temperature,
+                          freq_range=args.range,
+                          show_peaks=not args.no_peaks,
+                          assign_modes=args.assign_modes)
 
 
     @staticmethod
@@ -0,0 +1,68 @@
+'''
+CLI parser for command: polarized
+'''
+
+import argparse
+
+from xphon.cli.command import CLICommandBase, nonnegative_int
+
+
+class CLICommand(CLICommandBase):
+    """Polarized Raman intensities for oriented samples (after xphon write raman).
+
+    sweep: parallel and crossed intensities as a function of the angle of the
+    incident polarization, for a fixed orientation of the sample (Euler angles
+    phi theta psi, ZYZ convention), written to raman_polarization_sweep.dat.
+    map: intensities as a function of the orientation (theta, phi) of the sample,
+    for a fixed polarization configuration, written to raman_orientation_map.npz.
+
+    Example usage:
+    xphon polarized sweep -modes 7 8
+    xphon polarized sweep -orientation 0 90 0
+    xphon polarized map -config crossed -ntheta 181 -nphi 361 -plot-modes 7
+    """
+
+    @staticmethod
+    def add_arguments(parser : argparse.ArgumentParser):
+        parser.add_argument('what',
+                            choices=['sweep', 'map'],
+                            help='Polarization sweep or orientation map.')
+        parser.add_argument('-modes', type=int, nargs='+',
+                            help='Ids of the modes (default: all). For sweep, the selected modes are also plotted.')
+        parser.add_argument('-orientation', type=float, nargs=3, default=[0, 0, 0],
+                            metavar=('PHI', 'THETA', 'PSI'),
+                            help='(sweep only) Euler angles (deg) of the sample.')
+        parser.add_argument('-npoints', type=nonnegative_int, default=361,
+                            help='(sweep only) Number of polarization angles between 0 and 360 deg.')
+        parser.add_argument('-config', choices=['parallel', 'crossed'], default='parallel',
+                            help='(map only) Polarization configuration.')
+        parser.add_argument('-polarization-angle', type=float, default=0,
+                            help='(map only) Angle (deg) of the incident polarization from the x axis.')
+        parser.add_argument('-ntheta', type=nonnegative_int, default=91,
+                            help='(map only) Number of polar angles between 0 and 180 deg.')
+        parser.add_argument('-nphi', type=nonnegative_int, default=181,
+                            help='(map only) Number of azimuthal angles between 0 and 360 deg.')
+        parser.add_argument('-plot-modes', type=int, nargs='+',
+                            help='(map only) Ids of the modes whose map is plotted.')
+
+    @staticmethod
+    def run(args : argparse.Namespace):
+        from xphon.project import Project
+
+        project = Project('.')
+        if args.what == 'sweep':
+            project.polarization_sweep(orientation=args.orientation,
+                                       npoints=args.npoints,
+                                       mode_ids=args.modes,
+                                       plot=args.modes is not None)
+        elif args.what == 'map':
+            project.orientation_map(config=args.config,
+                                    polarization_angle=args.polarization_angle,
+                                    ntheta=args.ntheta,
+                                    nphi=args.nphi,
+                                    mode_ids=args.modes,
+                                    plot_modes=args.plot_modes)
+
+    @staticmethod
+    def bind_function(parser: argparse.ArgumentParser):
+        parser.set_defaults(func=CLICommand.run)
@@ -24,8 +24,8 @@ class CLICommand(CLICommandBase):
 
     @staticmethod
     def run(args : argparse.Namespace):
-        from xphon.calculations.raman import launch_raman_calculations
-        launch_raman_calculations(args.write_only)
+        from xphon.project import Project
+        Project('.').launch_raman(write_only=args.write_only)
 
 
     @staticmethod
@@ -18,8 +18,8 @@ class CLICommand(CLICommandBase):
 
     @staticmethod
     def run(args : argparse.Namespace):
-        from xphon.calculations.jobs import scancel
-        scancel()
+        from xphon.project import Project
+        Project('.').scancel()
 
 
     @staticmethod
@@ -13,7 +13,10 @@ class CLICommand(CLICommandBase):
     Example usage:
     xphon write ir
     xphon write raman
+    xphon write raman -laser-freqs 12700 18800 -temperatures 77 300
     xphon write trajs
+    xphon write trajs -modes 7 8 9 -traj-format single
+    xphon write trajs -freq-range 1500 1800 -traj-format npz
     """
 
     @staticmethod
@@ -21,18 +24,33 @@ class CLICommand(CLICommandBase):
         parser.add_argument('what',
                             choices=['ir', 'raman', 'trajs'],
                             help='What to write to file: ir/raman spectrum or trajectories of vibrational modes')
+        parser.add_argument('-laser-freqs', type=float, nargs='+',
+                            help='(raman only) Also write to raman_intensities.npz the intensities corrected '\
+                                'for these laser frequencies (cm-1) and the temperatures of -temperatures.')
+        parser.add_argument('-temperatures', type=float, nargs='+', default=[300],
+                            help='(raman only) Temperatures (K) for the Bose-Einstein correction.')
+        parser.add_argument('-modes', type=int, nargs='+',
+                            help='(trajs only) Ids of the modes to animate (default: all).')
+        parser.add_argument('-freq-range', type=float, nargs=2,
+                            help='(trajs only) Only animate the modes with frequency (cm-1) in this range.')
+        parser.add_argument('-traj-format', choices=['xyz', 'single', 'npz'], default='xyz',
+                            help='(trajs only) One xyz file per mode, a single multi-frame xyz file '\
+                                'or a single binary npz file with all the frames.')
 
     @staticmethod
     def run(args : argparse.Namespace):
+        from xphon.project import Project
+        project = Project('.')
+
         if args.what == 'ir':
-            from xphon.calculations.ir import write_ir_spectrum
-            write_ir_spectrum()
+            project.ir_spectrum()
         elif args.what == 'raman':
-            from xphon.calculations.raman import write_raman_spectrum
-            write_raman_spectrum()
+            project.raman_spectrum(laser_freqs=args.laser_freqs,
+                                   temperatures=args.temperatures)
         elif args.what == 'trajs':
-            from xphon.postprocess.trajectories import write_vibrations
-            write_vibrations()
+            project.write_trajectories(mode_ids=args.modes,
+                                       freq_range=args.freq_range,
+                                       traj_format=args.traj_format)
 
 
     @staticmethod
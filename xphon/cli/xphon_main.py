@@ -21,6 +21,15 @@ def main():
     parser = build_xphon_parser()
     args = parser.parse_args()
 
+    if args.profile:
+        from xphon import profiling
+        profiling.enable()
+
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     #run the command
     try:
         args.func(args)
@@ -30,6 +39,13 @@ def main():
         else:
             print(f'Error: {e}')
             return 1
+    finally:
+        if args.cprofile:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            print(f'cProfile stats written to {args.cprofile}')
+        if args.profile:
+            profiling.write_report(args.profile_output)
 
 if __name__ == '__main__':
     sys.exit(main())
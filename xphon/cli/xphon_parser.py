@@ -22,6 +22,12 @@ def build_xphon_parser():
         allow_abbrev=False)
     parser.add_argument('-v', '--version',action='version',version=f'%(prog)s-{xphon.__version__}')
     parser.add_argument('-T', '--traceback',action='store_true',help='Print traceback on error')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record calls, wall time, bytes read and peak memory of each stage')
+    parser.add_argument('--profile-output', metavar='FILE', default='xphon_profile.json',
+                        help='File where the profiling data is written (default: xphon_profile.json)')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='Also run the command under cProfile and write the stats to FILE')
 
 
     # subparsers
@@ -32,7 +38,15 @@ def build_xphon_parser():
         ('raman', 'xphon.cli.raman'),
         ('write', 'xphon.cli.write'),
         ('plot', 'xphon.cli.plot'),
-        ('scancel', 'xphon.cli.scancel')
+        ('polarized', 'xphon.cli.polarized'),
+        ('fit', 'xphon.cli.fit'),
+        ('library', 'xphon.cli.library'),
+        ('isotope', 'xphon.cli.isotope'),
+        ('campaign', 'xphon.cli.campaign'),
+        ('archive', 'xphon.cli.archive'),
+        ('cost', 'xphon.cli.cost'),
+        ('scancel', 'xphon.cli.scancel'),
+        ('benchmark', 'xphon.cli.benchmark')
     ]
 
     for command, module_name in commands:
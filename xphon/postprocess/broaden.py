@@ -1,14 +1,55 @@
 #!/usr/bin/env python3
 #
 
+from __future__ import annotations
 
 import numpy as np
+from scipy.sparse import csr_matrix
 
+from xphon.profiling import Timer
+
+
+def _line_shape(delta : np.ndarray, fwhm : float, function : str):
+    """
+    Evaluate the normalized line shape (integral is 1) at the given
+    distances from the peak center.
+
+    Args:
+    - delta : np.ndarray
+        Distance(s) from the peak center, in the same units as fwhm.
+    - fwhm : float
+        Full width at half maximum of the line shape.
+    - function : str
+        Type of broadening function ('gauss' or 'lorentz').
+    """
+
+    if function=='gauss':
+        #normalized gaussian (integral is 1)
+        sigma = fwhm / (2 * np.sqrt(2 * np.log(2.)))
+        return 1 / (np.sqrt(2*np.pi)*sigma) * np.exp(-delta**2/(2*sigma**2))
+
+        #non normalized f(0)=1
+        #x = delta/(fwhm/2)
+        #return np.exp(-np.log(2) * x**2)
+
+    if function=='lorentz':
+        #normalized lorentzian (integral is 1)
+        gam = fwhm/2
+        return (gam/np.pi) / (delta**2 + gam**2)
+
+        #non normalized f(0)=1
+        #return 1 / (1 + x**2)
+
+    raise ValueError("Function must be 'gauss' or 'lorentz'.")
+
+
+@Timer('get_broadened_spectrum')
 def get_broadened_spectrum(frequencies : np.ndarray,
                            intensities : np.ndarray,
                            fwhm : float = 10.0,
                            function : str ='lorentz',
-                           normalize : bool = True):
+                           normalize : bool = True,
+                           erange : np.ndarray | None = None):
     """
     Broaden the spectrum using a Gaussian or Lorentzian function.
 
@@ -21,40 +62,118 @@ def get_broadened_spectrum(frequencies : np.ndarray,
         The broadening parameter (half of FWHM)
     - function : str
         Type of broadening function ('Gaussian' or 'Lorentzian').
+    - normalize : bool
+        Whether to normalize the spectrum to a maximum of 1.
+    - erange : np.ndarray
+        Frequency grid on which the spectrum is evaluated. By default, a grid
+        with spacing fwhm/10 extending 5*fwhm beyond the extreme frequencies.
     """
 
     if fwhm < 1e-8:
         raise ValueError("FWHM must be greater than 0.")
 
-    # Make space for broadened spectrum at boundaries
-    fmin = max(min(frequencies) - 5*fwhm, 0)
-    fmax = max(frequencies) + 5*fwhm
-    erange = np.arange(fmin, fmax, fwhm/10)
+    if erange is None:
+        # Make space for broadened spectrum at boundaries
+        fmin = max(min(frequencies) - 5*fwhm, 0)
+        fmax = max(frequencies) + 5*fwhm
+        erange = np.arange(fmin, fmax, fwhm/10)
 
     spectrum = 0.0*erange
     for freq, intensity in zip(frequencies, intensities):
+        spectrum += intensity * _line_shape(erange - freq, fwhm, function)
 
-        if function=='gauss':
-            #normalized gaussian (integral is 1)
-            sigma = fwhm / (2 * np.sqrt(2 * np.log(2.)))
-            spectrum += intensity / (np.sqrt(2*np.pi)*sigma) * np.exp(-(erange - freq)**2/(2*sigma**2))
+    if normalize:
+        spectrum /= np.max(np.abs(spectrum))
 
-            #non normalized f(0)=1
-            #x = (erange - freq)/(fwhm/2)
-            #spectrum += intensity * np.exp(-np.log(2) * x**2)
+    return erange, spectrum
 
-        elif function=='lorentz':
-            #normalized lorentzian (integral is 1)
-            gam = fwhm/2
-            spectrum += intensity * (gam/np.pi) / ((erange - freq)**2 + gam**2)
 
-            #non normalized f(0)=1
-            #spectrum += intensity / (1 + x**2)
+@Timer('get_mode_contributions')
+def get_mode_contributions(frequencies : np.ndarray,
+                           intensities : np.ndarray,
+                           erange : np.ndarray,
+                           fwhm : float = 10.0,
+                           function : str = 'lorentz',
+                           cutoff : float = 5.0):
+    """
+    Build the sparse (grid x modes) matrix of the contributions of each
+    mode to the broadened spectrum. The line shape of each mode is truncated
+    at +/- cutoff*fwhm from its center, so that each column only has
+    ~20*cutoff non-zero entries (grid spacing is fwhm/10), regardless of
+    the number of modes.
 
-        else:
-            raise ValueError("Function must be 'gauss' or 'lorentz'.")
+    Args:
+    - frequencies : np.ndarray
+        Array of frequencies of the modes.
+    - intensities : np.ndarray
+        Array of intensities of the modes.
+    - erange : np.ndarray
+        Sorted frequency grid on which the spectrum is evaluated.
+    - fwhm : float
+        Broadening FWHM.
+    - function : str
+        Type of broadening function ('gauss' or 'lorentz').
+    - cutoff : float
+        Half-width of the line-shape window, in units of fwhm.
 
-    if normalize:
-        spectrum /= np.max(np.abs(spectrum))
+    Returns:
+    - contributions : scipy.sparse.csr_matrix
+        Matrix of shape (len(erange), len(frequencies)), where element [i, j]
+        is the contribution of mode j to the spectrum at erange[i].
+    """
 
-    return erange, spectrum
+    if fwhm < 1e-8:
+        raise ValueError("FWHM must be greater than 0.")
+
+    frequencies = np.asarray(frequencies, dtype=float)
+    intensities = np.asarray(intensities, dtype=float)
+
+    # first and last (excluded) grid index of the window of each mode
+    lo = np.searchsorted(erange, frequencies - cutoff*fwhm, side='left')
+    hi = np.searchsorted(erange, frequencies + cutoff*fwhm, side='right')
+    counts = hi - lo
+
+    # flatten the variable-length windows into (row, col) pairs
+    cols = np.repeat(np.arange(len(frequencies)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    rows = np.repeat(lo, counts) + offsets
+
+    values = intensities[cols] * _line_shape(erange[rows] - frequencies[cols], fwhm, function)
+
+    return csr_matrix((values, (rows, cols)), shape=(len(erange), len(frequencies)))
+
+
+def assign_peaks(contributions,
+                 peaks : np.ndarray,
+                 mode_ids : np.ndarray,
+                 max_modes : int = 3):
+    """
+    Find the dominant modes contributing to each peak of the spectrum.
+
+    Args:
+    - contributions : scipy.sparse.csr_matrix
+        (grid x modes) contribution matrix, see get_mode_contributions
+    - peaks : np.ndarray
+        Grid indices of the peaks.
+    - mode_ids : np.ndarray
+        Ids of the modes, corresponding to the columns of the matrix.
+    - max_modes : int
+        Maximum number of modes reported for each peak.
+
+    Returns:
+    - assignments : list of lists of (mode_id, weight) tuples, one list per peak,
+        sorted by decreasing fractional weight.
+    """
+
+    assignments = []
+    for peak in peaks:
+        row = contributions.getrow(peak)
+        total = row.data.sum()
+        if total == 0:
+            assignments.append([])
+            continue
+
+        order = np.argsort(-np.abs(row.data))[:max_modes]
+        assignments.append([(int(mode_ids[row.indices[k]]), row.data[k]/total) for k in order])
+
+    return assignments
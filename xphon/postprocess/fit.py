@@ -0,0 +1,317 @@
+"""Module for fitting the computed spectra to an experimental spectrum.
+
+The computed frequencies are scaled and shifted (f -> scale*f + shift), the
+sticks are broadened with a given FWHM, and the result is compared with the
+experimental spectrum by the cosine similarity (1 for identical line shapes,
+independently of the absolute intensities).
+
+All the combinations of a grid of scales, shifts and FWHMs are evaluated at once
+on a uniform frequency grid (spacing step) with FFTs:
+- for each scale, the sticks are binned on the grid and convolved with the line
+  shapes of all the FWHMs;
+- the broadened spectra are correlated with the experimental one, giving the
+  overlaps for all the shifts (multiples of step) at once.
+The best candidates are then evaluated exactly, broadening the sticks directly
+on the same grid.
+"""
+
+from __future__ import annotations
+import math
+import os
+import sys
+
+import numpy as np
+from scipy.fft import rfft, irfft, next_fast_len
+
+from xphon.postprocess.broaden import get_broadened_spectrum, _line_shape
+from xphon.profiling import Timer
+
+
+# maximum number of complex elements of the batched FFTs (memory ~16 bytes each)
+MAX_FFT_ELEMENTS = 2**24
+
+
+def read_experimental_spectrum(path : str, freq_range : tuple[float, float] | None = None):
+    """Read an experimental spectrum from a two-column (frequency, intensity) file.
+    Lines starting with # and a header line are skipped.
+
+    Args:
+        - path (str): Path of the file.
+        - freq_range (tuple): Frequency range (cm-1) of the data to keep.
+
+    Returns:
+        - x (np.ndarray): Sorted frequencies in cm-1.
+        - y (np.ndarray): Intensities.
+    """
+    if not os.path.isfile(path):
+        sys.exit(f"{path} not found.")
+
+    try:
+        data = np.loadtxt(path, usecols=(0, 1), ndmin=2)
+    except ValueError:
+        data = np.loadtxt(path, usecols=(0, 1), ndmin=2, skiprows=1)
+
+    data = data[np.argsort(data[:, 0])]
+    if freq_range is not None:
+        data = data[(data[:, 0] >= freq_range[0]) & (data[:, 0] <= freq_range[1])]
+    if len(data) < 2:
+        raise ValueError(f"Not enough experimental points in {path} (in the selected range).")
+
+    return data[:, 0], data[:, 1]
+
+
+def get_uniform_grid(x_exp : np.ndarray, y_exp : np.ndarray, step : float):
+    """Experimental spectrum interpolated on the uniform grid x_exp[0] + i*step,
+    on which the candidates are scored.
+
+    Returns:
+        - x, y (np.ndarray): Uniform grid and interpolated intensities.
+    """
+    npoints = int(math.floor((x_exp[-1] - x_exp[0]) / step)) + 1
+    x = x_exp[0] + step*np.arange(npoints)
+    return x, np.interp(x, x_exp, y_exp)
+
+
+def _bin_sticks(frequencies : np.ndarray, intensities : np.ndarray, y0 : float, step : float, npoints : int):
+    """Sticks on the uniform grid y0 + j*step, each one split linearly
+    between the two nearest points.
+
+    Args:
+        - frequencies (np.ndarray): (S, M) frequencies (one row for each scale).
+        - intensities (np.ndarray): (M,) intensities.
+
+    Returns:
+        - sticks (np.ndarray): (S, npoints) binned sticks.
+    """
+    position = (frequencies - y0) / step
+    index = np.floor(position).astype(int)
+    fraction = position - index
+    rows = np.broadcast_to(np.arange(len(frequencies))[:, np.newaxis], position.shape)
+    weights = np.broadcast_to(intensities, position.shape)
+
+    sticks = np.zeros((len(frequencies), npoints))
+    for i, w in ((index, 1 - fraction), (index + 1, fraction)):
+        inside = (i >= 0) & (i < npoints)
+        np.add.at(sticks, (rows[inside], i[inside]), (weights * w)[inside])
+
+    return sticks
+
+
+@Timer('get_fit_scores')
+def get_fit_scores(frequencies : np.ndarray,
+                   intensities : np.ndarray,
+                   x_exp : np.ndarray,
+                   y_exp : np.ndarray,
+                   scales : np.ndarray,
+                   shift_range : tuple[float, float],
+                   fwhms : np.ndarray,
+                   function : str = 'lorentz',
+                   step : float = 0.5):
+    """Cosine similarity between the experimental spectrum and the computed one,
+    for all the combinations of scales, shifts and FWHMs.
+
+    Args:
+        - frequencies, intensities (np.ndarray): (M,) computed sticks.
+        - x_exp, y_exp (np.ndarray): Sorted experimental spectrum.
+        - scales (np.ndarray): (S,) scale factors of the frequencies.
+        - shift_range (tuple): Minimum and maximum shift (cm-1); the shifts are the multiples of step.
+        - fwhms (np.ndarray): (W,) FWHMs of the broadening.
+        - function (str): Type of broadening ('gauss' or 'lorentz').
+        - step (float): Spacing (cm-1) of the uniform grid.
+
+    Returns:
+        - shifts (np.ndarray): (C,) shifts in cm-1.
+        - scores (np.ndarray): (S, C, W) cosine similarities.
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    intensities = np.asarray(intensities, dtype=float)
+    scales = np.atleast_1d(np.asarray(scales, dtype=float))
+    fwhms = np.atleast_1d(np.asarray(fwhms, dtype=float))
+    if np.any(fwhms < 1e-8):
+        raise ValueError("FWHM must be greater than 0.")
+
+    # experimental spectrum on the uniform grid x0 + i*step
+    x, e = get_uniform_grid(x_exp, y_exp, step)
+    x0, npoints = x[0], len(x)
+
+    shift_ids = np.arange(math.ceil(shift_range[0] / step), math.floor(shift_range[1] / step) + 1)
+    if len(shift_ids) == 0:
+        raise ValueError(f"No multiple of the step {step} in the shift range {shift_range}.")
+    shifts = shift_ids * step
+
+    # grid y0 + j*step of the unshifted spectra, covering the experimental range for
+    # all the shifts and all the scaled sticks (with their tails)
+    margin = 5 * fwhms.max()
+    y_min = min(x0 - shifts[-1], scales.min() * frequencies.min() - margin)
+    y_max = max(x[-1] - shifts[0], scales.max() * frequencies.max() + margin)
+    offset = int(math.ceil((x0 - y_min) / step))
+    y0 = x0 - offset * step
+    ngrid = int(math.ceil((y_max - y0) / step)) + 1
+
+    # the spectrum shifted by shifts[k], at x0 + i*step, is the unshifted one at index starts[k] + i
+    starts = offset - shift_ids
+
+    # line shapes on the offsets -(ngrid-1)..(ngrid-1), in circular order
+    nfft = next_fast_len(2*ngrid - 1, real=True)
+    distances = np.zeros(nfft)
+    distances[:ngrid] = step * np.arange(ngrid)
+    distances[nfft-ngrid+1:] = -step * np.arange(ngrid-1, 0, -1)
+    kernels_hat = rfft(_line_shape(distances[np.newaxis, :], fwhms[:, np.newaxis], function), axis=-1)
+    e_hat = np.conj(rfft(e, nfft))
+    e_norm = np.linalg.norm(e)
+
+    chunk_size = max(1, MAX_FFT_ELEMENTS // (len(fwhms) * kernels_hat.shape[-1]))
+    scores = np.empty((len(scales), len(shifts), len(fwhms)))
+    for start in range(0, len(scales), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        sticks = _bin_sticks(scales[chunk, np.newaxis] * frequencies, intensities, y0, step, ngrid)
+
+        # broadened spectra (scales, fwhms, grid) and their overlaps with the experimental one
+        spectra_hat = rfft(sticks, nfft, axis=-1)[:, np.newaxis, :] * kernels_hat[np.newaxis]
+        spectra = irfft(spectra_hat, nfft, axis=-1)[..., :ngrid]
+        overlaps = irfft(spectra_hat * e_hat, nfft, axis=-1)[..., starts]
+
+        # norms of the windows of the spectra seen by each shift
+        cumulative = np.concatenate([np.zeros(spectra.shape[:-1] + (1,)),
+                                     np.cumsum(spectra**2, axis=-1)], axis=-1)
+        norms2 = cumulative[..., starts + npoints] - cumulative[..., starts]
+        norms = np.sqrt(np.clip(norms2, 0, None)) * e_norm
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            chunk_scores = np.where(norms > 0, overlaps / norms, 0.0)
+        scores[chunk] = chunk_scores.transpose(0, 2, 1)
+
+    return shifts, scores
+
+
+def get_exact_score(frequencies : np.ndarray,
+                    intensities : np.ndarray,
+                    x : np.ndarray,
+                    y : np.ndarray,
+                    scale : float,
+                    shift : float,
+                    fwhm : float,
+                    function : str = 'lorentz'):
+    """Cosine similarity of a single candidate, with the spectrum broadened
+    exactly (without binning the sticks) on the frequencies x.
+
+    Returns:
+        - score (float): Cosine similarity.
+    """
+    _, model = get_broadened_spectrum(scale*np.asarray(frequencies) + shift, intensities,
+                                      fwhm=fwhm, function=function, normalize=False, erange=x)
+    norms = np.linalg.norm(model) * np.linalg.norm(y)
+    return float(np.dot(model, y) / norms) if norms > 0 else 0.0
+
+
+@Timer('fit_spectrum')
+def fit_spectrum(spectrum : str,
+                 experiment_path : str,
+                 scales : np.ndarray,
+                 shift_range : tuple[float, float],
+                 fwhms : np.ndarray,
+                 function : str = 'lorentz',
+                 step : float = 0.5,
+                 freq_range : tuple[float, float] | None = None,
+                 laser_freq : float | None = None,
+                 temperature : float = 300,
+                 top : int = 5,
+                 plot : bool = True,
+                 root : str = '.'):
+    """Fit the computed spectrum to an experimental one, searching the best
+    scale factor, shift and FWHM on a grid. The best candidates are written to
+    <spectrum>_fit.dat, the experimental spectrum and the best fit (both normalized)
+    to <spectrum>_fit_overlay.dat, and the overlays are plotted to <spectrum>_fit.png.
+
+    Args:
+        - spectrum (str): Which spectrum ('ir' or 'raman').
+        - experiment_path (str): Two-column file with the experimental spectrum.
+        - scales (np.ndarray): Scale factors of the frequencies.
+        - shift_range (tuple): Minimum and maximum shift (cm-1), in steps of step.
+        - fwhms (np.ndarray): FWHMs of the broadening.
+        - function (str): Type of broadening ('gauss' or 'lorentz').
+        - step (float): Spacing (cm-1) of the grid of the search.
+        - freq_range (tuple): Frequency range (cm-1) of the experimental spectrum to fit.
+        - laser_freq (float): Frequency in cm^-1 of the laser, for the correction of the Raman intensities.
+        - temperature (float): Temperature in K for the Raman correction.
+        - top (int): Number of best candidates reported (and plotted).
+        - plot (bool): Whether to plot the overlays.
+        - root (str): Directory of the project.
+
+    Returns:
+        - best (list): Best candidates as dicts with scale, shift, fwhm and score, best first.
+    """
+    from xphon.postprocess.plot import COLUMNS
+
+    spectrum_path = os.path.join(root, f'{spectrum}_spectrum.dat')
+    if not os.path.isfile(spectrum_path):
+        sys.exit(f"{spectrum_path} not found, run 'xphon write {spectrum}' first.")
+
+    data = np.loadtxt(spectrum_path, skiprows=1, usecols=COLUMNS[spectrum], ndmin=2)
+    frequencies, intensities = data[:, 0], data[:, 1]
+    if spectrum == 'raman' and laser_freq is not None:
+        from xphon.calculations.raman import get_corrected_raman_intensities
+        intensities = get_corrected_raman_intensities(frequencies, intensities,
+                                                      [laser_freq], [temperature])[:, 0, 0]
+
+    x_exp, y_exp = read_experimental_spectrum(experiment_path, freq_range)
+
+    print(f"Evaluating {len(scales)} scales x {len(fwhms)} FWHMs x shifts "\
+          f"{shift_range[0]:g}..{shift_range[1]:g} cm-1 (step {step:g} cm-1)...")
+    shifts, scores = get_fit_scores(frequencies, intensities, x_exp, y_exp,
+                                    scales, shift_range, fwhms, function, step)
+    print(f"{scores.size} combinations evaluated.")
+
+    # re-evaluate the best candidates exactly
+    x_uniform, y_uniform = get_uniform_grid(x_exp, y_exp, step)
+    order = np.argsort(scores, axis=None)[::-1][:max(top, 1)]
+    best = []
+    for i, j, k in zip(*np.unravel_index(order, scores.shape)):
+        score = get_exact_score(frequencies, intensities, x_uniform, y_uniform,
+                                scales[i], shifts[j], fwhms[k], function)
+        best.append({'scale': float(scales[i]), 'shift': float(shifts[j]),
+                     'fwhm': float(fwhms[k]), 'score': score})
+    best.sort(key=lambda candidate: -candidate['score'])
+
+    # fitted spectra on the experimental frequencies, normalized
+    models = []
+    for candidate in best:
+        _, model = get_broadened_spectrum(candidate['scale']*frequencies + candidate['shift'], intensities,
+                                          fwhm=candidate['fwhm'], function=function, erange=x_exp)
+        models.append(model)
+
+    filename = os.path.join(root, f'{spectrum}_fit.dat')
+    with open(filename, 'w') as f:
+        f.write('rank    scale    shift(cm-1)    fwhm(cm-1)    score\n')
+        for rank, candidate in enumerate(best, start=1):
+            f.write(f"{rank:4d}  {candidate['scale']:8.5f}  {candidate['shift']:10.3f}  "\
+                    f"{candidate['fwhm']:10.3f}  {candidate['score']:8.5f}\n")
+
+    overlay_name = os.path.join(root, f'{spectrum}_fit_overlay.dat')
+    np.savetxt(overlay_name, np.column_stack([x_exp, y_exp / np.max(np.abs(y_exp)), models[0]]),
+               fmt='%.6f', header='freq(cm-1)  experimental  fit', comments='')
+
+    b = best[0]
+    print(f"Best fit: scale {b['scale']:.5f}, shift {b['shift']:.3f} cm-1, "\
+          f"FWHM {b['fwhm']:.3f} cm-1, score {b['score']:.5f}")
+    print(f"Best {len(best)} candidates written to {filename}, overlay to {overlay_name}")
+
+    if plot:
+        from matplotlib.figure import Figure
+
+        fig = Figure()
+        ax = fig.add_subplot()
+        ax.plot(x_exp, y_exp / np.max(np.abs(y_exp)), color='black', label='experimental')
+        for candidate, model in zip(best, models):
+            ax.plot(x_exp, model, linewidth=0.8,
+                    label=f"scale {candidate['scale']:.4f}, shift {candidate['shift']:.1f}, "\
+                          f"FWHM {candidate['fwhm']:.1f}: {candidate['score']:.3f}")
+        ax.set_xlabel('Frequency (cm-1)')
+        ax.set_ylabel('Intensity (a.u.)')
+        ax.set_title(f'{spectrum.capitalize()} spectrum fit')
+        ax.legend(fontsize=6)
+        figname = os.path.join(root, f'{spectrum}_fit.png')
+        fig.savefig(figname, dpi=300, bbox_inches='tight')
+        print(f'Plot saved in {figname}.')
+
+    return best
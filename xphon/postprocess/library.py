@@ -0,0 +1,337 @@
+"""Module for an indexed library of computed spectra, to find the structures
+whose spectra best match a measured one.
+
+The IR and Raman spectra of each project (ir_spectrum.dat, raman_spectrum.dat) are
+broadened on a common frequency grid and normalized to unit norm, and stored as the
+rows of two float32 matrices (ir.npy and raman.npy) in the library directory,
+together with index.json, with the parameters of the grid and the metadata of each
+project (path, formula, number of modes, modification time of the spectra).
+Adding projects is incremental: only the new projects and those whose spectra
+were modified since they were added are broadened again.
+
+A query spectrum is interpolated on the grid, and compared with all the entries
+at once, restricted to its frequency window:
+- cosine: cosine similarity, i.e. a single matrix-vector product;
+- shift: maximum of the cosine similarity over rigid shifts of the query up to
+  max_shift cm-1, i.e. a single matrix product with the matrix of the shifted queries.
+"""
+
+from __future__ import annotations
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from xphon.postprocess.broaden import get_broadened_spectrum
+from xphon.profiling import Timer
+
+
+LIBRARY_DIR = 'xphon_library'
+INDEX_FILE = 'index.json'
+SPECTRA = ('ir', 'raman')
+METRICS = ('cosine', 'shift')
+
+DEFAULT_GRID = {'fmin': 0.0, 'fmax': 4000.0, 'step': 2.0, 'fwhm': 10.0, 'function': 'lorentz'}
+
+
+def get_grid(settings : dict):
+    """Frequency grid of the library.
+
+    Args:
+        - settings (dict): Parameters of the grid (fmin, fmax, step).
+
+    Returns:
+        - grid (np.ndarray): Frequencies in cm-1.
+    """
+    npoints = int(round((settings['fmax'] - settings['fmin']) / settings['step'])) + 1
+    return settings['fmin'] + settings['step'] * np.arange(npoints)
+
+
+def read_library(library_dir : str = LIBRARY_DIR, mmap : bool = True):
+    """Read the library.
+
+    Args:
+        - library_dir (str): Directory of the library.
+        - mmap (bool): Whether to memory-map the matrices of the spectra.
+
+    Returns:
+        - index (dict): Grid parameters ('grid') and metadata of the entries ('entries').
+        - spectra (dict): {'ir': (P, G) array, 'raman': (P, G) array}, rows of unit norm
+            (zero for the missing spectra).
+    """
+    index_path = os.path.join(library_dir, INDEX_FILE)
+    if not os.path.isfile(index_path):
+        sys.exit(f"{index_path} not found, create the library with 'xphon library add' first.")
+
+    with open(index_path) as f:
+        index = json.load(f)
+
+    npoints = len(get_grid(index['grid']))
+    spectra = {}
+    for spectrum in SPECTRA:
+        path = os.path.join(library_dir, f'{spectrum}.npy')
+        if index['entries']:
+            spectra[spectrum] = np.load(path, mmap_mode='r' if mmap else None)
+        else:
+            spectra[spectrum] = np.zeros((0, npoints), dtype=np.float32)
+
+    return index, spectra
+
+
+def _write_library(library_dir : str, index : dict, spectra : dict):
+    """Write the matrices and the index, replacing the previous ones."""
+    os.makedirs(library_dir, exist_ok=True)
+    for spectrum in SPECTRA:
+        path = os.path.join(library_dir, f'{spectrum}.npy')
+        np.save(f'{path}.tmp.npy', spectra[spectrum])
+        os.replace(f'{path}.tmp.npy', path)
+
+    # the index is written last: it refers to the rows of the matrices
+    path = os.path.join(library_dir, INDEX_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(f'{path}.tmp', path)
+
+
+def _spectrum_mtimes(project_dir : str):
+    """Modification times of the spectrum files of a project (None if missing)."""
+    mtimes = {}
+    for spectrum in SPECTRA:
+        path = os.path.join(project_dir, f'{spectrum}_spectrum.dat')
+        mtimes[spectrum] = os.stat(path).st_mtime if os.path.isfile(path) else None
+    return mtimes
+
+
+def _read_formula(project_dir : str):
+    """Chemical formula of the POSCAR of the project, if present."""
+    path = os.path.join(project_dir, 'POSCAR')
+    if not os.path.isfile(path):
+        return None
+    from ase.io import read
+    try:
+        return read(path, format='vasp').get_chemical_formula()
+    except Exception: #pylint: disable=broad-exception-caught
+        return None
+
+
+def get_library_vector(frequencies : np.ndarray, intensities : np.ndarray, grid : np.ndarray, settings : dict):
+    """Broadened spectrum on the grid of the library, normalized to unit norm.
+
+    Args:
+        - frequencies, intensities (np.ndarray): Sticks of the spectrum.
+        - grid (np.ndarray): Frequency grid of the library.
+        - settings (dict): Parameters of the grid (fwhm, function).
+
+    Returns:
+        - vector (np.ndarray): (G,) float32 vector (zero if the spectrum is empty).
+    """
+    _, vector = get_broadened_spectrum(frequencies, intensities, fwhm=settings['fwhm'],
+                                       function=settings['function'], normalize=False, erange=grid)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).astype(np.float32)
+
+
+def find_projects(directories : list[str]):
+    """Directories containing ir_spectrum.dat or raman_spectrum.dat,
+    among the given ones and their subdirectories.
+
+    Returns:
+        - projects (list): Sorted absolute paths.
+    """
+    projects = set()
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            # do not descend into the directories of the calculations
+            dirnames[:] = [d for d in dirnames if d not in ('phonons', 'raman_calcs', 'trajectories')]
+            if any(f'{spectrum}_spectrum.dat' in filenames for spectrum in SPECTRA):
+                projects.add(os.path.abspath(dirpath))
+
+    return sorted(projects)
+
+
+@Timer('update_library')
+def update_library(directories : list[str],
+                   library_dir : str = LIBRARY_DIR,
+                   grid_settings : dict | None = None):
+    """Add the projects found in directories (see find_projects) to the library,
+    creating it if needed. The projects already in the library are broadened again
+    only if their spectra were modified.
+
+    Args:
+        - directories (list): Directories of the projects, or containing them.
+        - library_dir (str): Directory of the library.
+        - grid_settings (dict): Parameters of the grid (fmin, fmax, step, fwhm, function)
+            of a new library (default: DEFAULT_GRID). Ignored for an existing library.
+
+    Returns:
+        - added, updated (int): Number of new and updated entries.
+    """
+    from xphon.postprocess.plot import COLUMNS
+
+    if os.path.isfile(os.path.join(library_dir, INDEX_FILE)):
+        index, spectra = read_library(library_dir, mmap=False)
+        if grid_settings:
+            print(f"Using the grid of the existing library {library_dir}: {index['grid']}")
+    else:
+        settings = dict(DEFAULT_GRID)
+        settings.update(grid_settings or {})
+        if not (settings['step'] > 0 and settings['fwhm'] > 0 and settings['fmax'] > settings['fmin']):
+            raise ValueError(f"Invalid grid {settings}: step and fwhm must be positive, and fmax greater than fmin.")
+        index = {'grid': settings, 'entries': []}
+        spectra = {spectrum: np.zeros((0, len(get_grid(settings))), dtype=np.float32)
+                   for spectrum in SPECTRA}
+
+    settings = index['grid']
+    grid = get_grid(settings)
+    rows = {entry['path']: i for i, entry in enumerate(index['entries'])}
+
+    new_entries, new_vectors = [], {spectrum: [] for spectrum in SPECTRA}
+    updated = 0
+    for project_dir in find_projects(directories):
+        mtimes = _spectrum_mtimes(project_dir)
+        row = rows.get(project_dir)
+        if row is not None and index['entries'][row]['mtimes'] == mtimes:
+            continue
+
+        entry = {'name': os.path.basename(project_dir),
+                 'path': project_dir,
+                 'formula': _read_formula(project_dir),
+                 'mtimes': mtimes,
+                 'added': time.strftime('%Y-%m-%d %H:%M:%S')}
+        vectors = {}
+        for spectrum in SPECTRA:
+            if mtimes[spectrum] is None:
+                vectors[spectrum] = np.zeros(len(grid), dtype=np.float32)
+                entry[f'{spectrum}_modes'] = 0
+                continue
+            data = np.loadtxt(os.path.join(project_dir, f'{spectrum}_spectrum.dat'),
+                              skiprows=1, usecols=COLUMNS[spectrum], ndmin=2)
+            vectors[spectrum] = get_library_vector(data[:, 0], data[:, 1], grid, settings)
+            entry[f'{spectrum}_modes'] = len(data)
+
+        if row is None:
+            new_entries.append(entry)
+            for spectrum in SPECTRA:
+                new_vectors[spectrum].append(vectors[spectrum])
+        else:
+            index['entries'][row] = entry
+            for spectrum in SPECTRA:
+                spectra[spectrum][row] = vectors[spectrum]
+            updated += 1
+
+    if not new_entries and not updated:
+        print(f"Library {library_dir} is up to date ({len(index['entries'])} entries).")
+        return 0, 0
+
+    index['entries'] += new_entries
+    for spectrum in SPECTRA:
+        if new_vectors[spectrum]:
+            spectra[spectrum] = np.vstack([spectra[spectrum], np.array(new_vectors[spectrum])])
+    _write_library(library_dir, index, spectra)
+    print(f"Library {library_dir}: {len(new_entries)} entries added, {updated} updated, "\
+          f"{len(index['entries'])} in total.")
+
+    return len(new_entries), updated
+
+
+def get_query_vectors(x : np.ndarray,
+                      y : np.ndarray,
+                      grid : np.ndarray,
+                      max_shift : float = 0):
+    """Query spectrum interpolated on the grid of the library, within its frequency
+    window, and rigidly shifted by all the multiples of the grid step up to max_shift.
+
+    Args:
+        - x, y (np.ndarray): Sorted query spectrum.
+        - grid (np.ndarray): Frequency grid of the library.
+        - max_shift (float): Maximum shift in cm-1.
+
+    Returns:
+        - window (slice): Columns of the grid within the frequency window of the query.
+        - shifts (np.ndarray): (S,) shifts in cm-1.
+        - queries (np.ndarray): (S, len(window)) float32 shifted queries, of unit norm.
+    """
+    inside = np.flatnonzero((grid >= x[0]) & (grid <= x[-1]))
+    if len(inside) < 2:
+        raise ValueError("The frequency range of the query does not overlap with the grid of the library.")
+    window = slice(inside[0], inside[-1] + 1)
+
+    step = grid[1] - grid[0]
+    nshifts = int(np.floor(max_shift / step + 1e-9))
+    shifts = step * np.arange(-nshifts, nshifts + 1)
+
+    # query shifted back by s, so that it matches the entries whose frequencies are lower by s
+    queries = np.interp(grid[window][np.newaxis, :] + shifts[:, np.newaxis], x, y, left=0.0, right=0.0)
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries = np.divide(queries, norms, out=np.zeros_like(queries), where=norms > 0)
+
+    return window, shifts, queries.astype(np.float32)
+
+
+@Timer('query_library')
+def query_library(x : np.ndarray,
+                  y : np.ndarray,
+                  spectrum : str = 'ir',
+                  k : int = 5,
+                  metric : str = 'cosine',
+                  max_shift : float = 30,
+                  library_dir : str = LIBRARY_DIR,
+                  library : tuple[dict, dict] | None = None):
+    """Find the entries of the library whose spectra best match the query.
+
+    Args:
+        - x, y (np.ndarray): Sorted query spectrum (e.g. measured).
+        - spectrum (str): Which spectrum ('ir' or 'raman').
+        - k (int): Number of matches.
+        - metric (str): 'cosine', or 'shift' for the cosine maximized over shifts up to max_shift.
+        - max_shift (float): Maximum shift (cm-1) for the shift metric.
+        - library_dir (str): Directory of the library.
+        - library (tuple): (index, spectra) already read with read_library, to run
+            several queries without reading the library again.
+
+    Returns:
+        - matches (list): Best matches as dicts with rank, score, shift (cm-1, to be added to
+            the frequencies of the entry to match the query) and the metadata of the entry.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}, must be one of {METRICS}.")
+
+    index, spectra = library if library is not None else read_library(library_dir)
+    if not index['entries']:
+        return []
+
+    grid = get_grid(index['grid'])
+    window, shifts, queries = get_query_vectors(x, y, grid, max_shift if metric == 'shift' else 0)
+
+    # entries restricted to the window of the query, and their norms in the window
+    entries = np.asarray(spectra[spectrum][:, window])
+    norms = np.sqrt(np.einsum('pg,pg->p', entries, entries))
+
+    with Timer('query_library.scores'):
+        scores = entries @ queries.T                         # (P, S)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores = np.where(norms[:, np.newaxis] > 0, scores / norms[:, np.newaxis], -np.inf)
+        best_shift = np.argmax(scores, axis=1)
+        scores = scores[np.arange(len(scores)), best_shift]
+
+    k = min(k, int(np.sum(np.isfinite(scores))))
+    top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.array([], dtype=int)
+    top = top[np.argsort(-scores[top], kind='stable')]
+
+    return [{'rank': rank, 'score': float(scores[i]), 'shift': float(shifts[best_shift[i]]),
+             **index['entries'][i]} for rank, i in enumerate(top, start=1)]
+
+
+def print_matches(matches : list[dict], title : str = ''):
+    """Print a table of the matches of a query."""
+    if title:
+        print(title)
+    if not matches:
+        print("  no matches.")
+        return
+    print(f"  {'rank':>4}  {'score':>7}  {'shift':>7}  {'formula':<14} {'name':<24} path")
+    for match in matches:
+        print(f"  {match['rank']:4d}  {match['score']:7.4f}  {match['shift']:7.1f}  "\
+              f"{match['formula'] or '-':<14} {match['name']:<24} {match['path']}")
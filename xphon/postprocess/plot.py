@@ -2,11 +2,14 @@
 """Module for plotting the IR and Raman spectra."""
 
 from __future__ import annotations
+import os
 
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 from scipy.signal import find_peaks
 
+from xphon.profiling import Timer
+
 
 COLORS = {
     'ir': 'orangered',
@@ -18,13 +21,55 @@ COLUMNS = {
     'raman': (2, 6)
 }
 
+def write_peak_assignments(spectrum : str,
+                           x : np.ndarray,
+                           y : np.ndarray,
+                           peaks : np.ndarray,
+                           freqs : np.ndarray,
+                           intensities : np.ndarray,
+                           mode_ids : np.ndarray,
+                           fwhm : float,
+                           broaden_type : str,
+                           max_modes : int = 3,
+                           root : str = '.'):
+    """Write the table of the dominant modes contributing to each peak.
+
+    Args:
+        - spectrum (str): Which spectrum ('ir' or 'raman').
+        - x, y (np.ndarray): Broadened spectrum (frequency grid and intensity).
+        - peaks (np.ndarray): Grid indices of the peaks.
+        - freqs, intensities (np.ndarray): Frequencies and intensities of the modes.
+        - mode_ids (np.ndarray): Ids of the modes.
+        - fwhm (float): Broadening FWHM.
+        - broaden_type (str): Type of broadening ('gauss' or 'lorentz').
+        - max_modes (int): Max number of modes reported for each peak.
+        - root (str): Directory of the project.
+    """
+    from xphon.postprocess.broaden import get_mode_contributions, assign_peaks
+
+    print('Assigning peaks to modes...')
+    contributions = get_mode_contributions(freqs, intensities, x, fwhm, function=broaden_type)
+    assignments = assign_peaks(contributions, peaks, mode_ids, max_modes=max_modes)
+
+    filename = os.path.join(root, f'{spectrum}_peaks.dat')
+    print(f'Writing {filename}...')
+    with open(filename, 'w') as f:
+        f.write('peak(cm-1)    intensity    modes(id:weight)\n')
+        for peak, assignment in zip(peaks, assignments):
+            modes_str = '  '.join(f'{mode_id:03d}:{weight:.3f}' for mode_id, weight in assignment)
+            f.write(f'{x[peak]:10.5f}    {y[peak]:10.5f}    {modes_str}\n')
+
+
+@Timer('plot_spectrum')
 def plot_spectrum(spectrum : str,
                   broaden_type : str | None = None,
                   fwhm : float = 0,
                   laser_freq : float | None = None,
                   temperature : float = 300,
                   freq_range : tuple[float, float] | None = None,
-                  show_peaks : bool = False):
+                  show_peaks : bool = False,
+                  assign_modes : int = 3,
+                  root : str = '.'):
     """Plot the spectrum with the given parameters.
 
     Args:
@@ -35,63 +80,83 @@ def plot_spectrum(spectrum : str,
         - temperature (float): Temperature in K for the Raman spectrum.
         - freq_range (tuple): Frequency range (cm-1) of the spectrum to plot.
         - show_peaks (bool): Whether to show the peaks in the spectrum.
+        - assign_modes (int): Max number of dominant modes reported for each peak
+            in the peak assignment table (only with broadening and show_peaks).
+        - root (str): Directory of the project.
+
+    Returns:
+        - x, y (np.ndarray): Plotted spectrum (frequencies and intensities).
     """
 
     # Read the data
-    print(f'Reading {spectrum}_spectrum.dat...')
-    data = np.loadtxt(fname=f'{spectrum}_spectrum.dat',
+    filename = os.path.join(root, f'{spectrum}_spectrum.dat')
+    print(f'Reading {filename}...')
+    data = np.loadtxt(fname=filename,
                       dtype=float,
                       skiprows=1,
-                      usecols=COLUMNS[spectrum])
+                      usecols=(0, *COLUMNS[spectrum]))
 
     if freq_range is not None:
-        data = data[(data[:, 0] >= freq_range[0]) & (data[:, 0] <= freq_range[1])]
-    x = data[:, 0]
-    y = data[:, 1]
+        data = data[(data[:, 1] >= freq_range[0]) & (data[:, 1] <= freq_range[1])]
+    mode_ids = data[:, 0].astype(int)
+    x = data[:, 1]
+    y = data[:, 2]
 
 
     # Prefactor as calculated in CRYSTAL
     if spectrum == 'raman' and laser_freq is not None:
+        from xphon.calculations.raman import get_corrected_raman_intensities
+
         print('Applying Laser frequency correction...')
-        # Bose occupancy factor
-        one_plus_n = 1/( 1 - np.exp(-1.9865e-23 * x / (1.38064852e-23 * temperature) ))
-        y = y * one_plus_n/(30*x) * (x - laser_freq)**4 # Correct the Raman spectrum
+        y = get_corrected_raman_intensities(x, y, [laser_freq], [temperature])[:, 0, 0]
 
 
-    # Plot the data
+    # Plot the data (on a figure not managed by pyplot, so that several
+    # projects can be plotted at the same time from different threads)
     print(f'Plotting {spectrum}...')
+    fig = Figure()
+    ax = fig.add_subplot()
     if broaden_type is None:
-        _, stemlines, baseline = plt.stem(x, y, markerfmt=' ')
-        plt.setp(stemlines, 'color', COLORS[spectrum])
-        plt.setp(stemlines, 'linewidth', 0.5)
-        plt.setp(baseline, 'color', COLORS[spectrum])
+        _, stemlines, baseline = ax.stem(x, y, markerfmt=' ')
+        stemlines.set_color(COLORS[spectrum])
+        stemlines.set_linewidth(0.5)
+        baseline.set_color(COLORS[spectrum])
 
     else:
         from xphon.postprocess.broaden import get_broadened_spectrum
 
+        freqs, intensities = x, y
         x, y = get_broadened_spectrum(x, y, fwhm, function=broaden_type)
 
-        plt.plot(x, y, color=COLORS[spectrum])
+        ax.plot(x, y, color=COLORS[spectrum])
 
         if show_peaks: #plot the peaks points and also the frequency labels
             print('Finding peaks...')
             peaks, _ = find_peaks(y, prominence=0.01, distance=20, wlen=20)
-            plt.plot(x[peaks], y[peaks], 'ro', markersize=3)
+            ax.plot(x[peaks], y[peaks], 'ro', markersize=3)
             for i, peak in enumerate(peaks):
-                plt.text(x[peak], y[peak]+0.01, f'{int(x[peak])}',
-                         fontsize=8, ha='center', va='bottom')
+                ax.text(x[peak], y[peak]+0.01, f'{int(x[peak])}',
+                        fontsize=8, ha='center', va='bottom')
+
+            write_peak_assignments(spectrum, x, y, peaks, freqs, intensities, mode_ids,
+                                   fwhm=fwhm, broaden_type=broaden_type, max_modes=assign_modes,
+                                   root=root)
 
     #write x and y to file
-    print(f'Writing {spectrum}_spectrum_plotted.dat...')
-    with open(f'{spectrum}_spectrum_plotted.dat', 'w') as f:
+    filename = os.path.join(root, f'{spectrum}_spectrum_plotted.dat')
+    print(f'Writing {filename}...')
+    with open(filename, 'w') as f:
         f.write(f'Frequency (cm-1)    Intensity (a.u.)\n')
         for i in range(len(x)):
             f.write(f'{x[i]:10.5f}    {y[i]:10.5f}\n')
 
-    plt.xlabel('Frequency (cm-1)')
-    plt.ylabel('Intensity (a.u.)')
-    plt.title(f'{spectrum.capitalize()} spectrum')
-    figname = f'{spectrum}_spectrum{"_broaden" if broaden_type else ""}.png'
-    plt.savefig(figname, dpi=300, bbox_inches='tight')
+    ax.set_xlabel('Frequency (cm-1)')
+    ax.set_ylabel('Intensity (a.u.)')
+    ax.set_title(f'{spectrum.capitalize()} spectrum')
+    figname = os.path.join(root, f'{spectrum}_spectrum{"_broaden" if broaden_type else ""}.png')
+    with Timer('plot_spectrum.savefig'):
+        fig.savefig(figname, dpi=300, bbox_inches='tight')
 
     print(f'Plot saved in {figname}.')
+
+    return x, y
@@ -0,0 +1,262 @@
+"""Module for polarized and orientation-resolved Raman intensities.
+
+The intensity of mode m for a sample rotated by R, with incident and scattered
+polarizations e_i and e_s (in the laboratory frame), is
+
+    I = |e_s . (R a R^T) . e_i|^2 = |(R^T e_s) . a . (R^T e_i)|^2
+
+where a is the Raman tensor of the mode (see raman_tensors.npz, written by
+xphon write raman). The polarization vectors are rotated to the frame of the
+sample, so that the intensities of all the modes for all the rotations and
+polarization pairs are obtained with a single batched contraction.
+
+The laboratory frame is that of a backscattering experiment along z: the
+polarizations lie in the xy plane, and the scattered one is either parallel
+or crossed (perpendicular) to the incident one.
+"""
+
+from __future__ import annotations
+import os
+import sys
+
+import numpy as np
+
+from xphon.profiling import Timer
+
+
+CONFIGS = ('parallel', 'crossed')
+
+
+def read_raman_tensors(root : str = '.'):
+    """Read the Raman tensors written by xphon write raman.
+
+    Args:
+        - root (str): Directory of the project.
+
+    Returns:
+        - mode_ids (np.ndarray): (M,) ids of the modes.
+        - frequencies (np.ndarray): (M,) frequencies of the modes in cm-1.
+        - raman_tensors (np.ndarray): (M, 3, 3) Raman tensors.
+    """
+    from xphon.calculations.raman import RAMAN_TENSORS_FILE
+
+    path = os.path.join(root, RAMAN_TENSORS_FILE)
+    if not os.path.isfile(path):
+        sys.exit(f"{path} not found, run 'xphon write raman' first.")
+
+    with np.load(path) as data:
+        return data['mode_ids'], data['frequencies'], data['raman_tensors']
+
+
+def get_rotation_matrices(phi : np.ndarray, theta : np.ndarray, psi : np.ndarray = 0.0):
+    """Rotation matrices R = Rz(phi) Ry(theta) Rz(psi) (ZYZ Euler angles),
+    broadcasting over the angles.
+
+    Args:
+        - phi, theta, psi (np.ndarray): Euler angles in degrees.
+
+    Returns:
+        - rotations (np.ndarray): (..., 3, 3) rotation matrices.
+    """
+    phi, theta, psi = np.broadcast_arrays(*(np.deg2rad(np.asarray(angle, dtype=float))
+                                            for angle in (phi, theta, psi)))
+    c1, s1 = np.cos(phi), np.sin(phi)
+    c2, s2 = np.cos(theta), np.sin(theta)
+    c3, s3 = np.cos(psi), np.sin(psi)
+
+    rotations = np.empty(phi.shape + (3, 3))
+    rotations[..., 0, 0] = c1*c2*c3 - s1*s3
+    rotations[..., 0, 1] = -c1*c2*s3 - s1*c3
+    rotations[..., 0, 2] = c1*s2
+    rotations[..., 1, 0] = s1*c2*c3 + c1*s3
+    rotations[..., 1, 1] = -s1*c2*s3 + c1*c3
+    rotations[..., 1, 2] = s1*s2
+    rotations[..., 2, 0] = -s2*c3
+    rotations[..., 2, 1] = s2*s3
+    rotations[..., 2, 2] = c2
+
+    return rotations
+
+
+def get_polarization_vectors(angles : np.ndarray, config : str = 'parallel'):
+    """Incident and scattered polarization vectors in the xy plane.
+
+    Args:
+        - angles (np.ndarray): (P,) angles (degrees) of the incident polarization from the x axis.
+        - config (str): 'parallel' or 'crossed' scattered polarization.
+
+    Returns:
+        - e_in, e_out (np.ndarray): (P, 3) unit vectors.
+    """
+    if config not in CONFIGS:
+        raise ValueError(f"Unknown polarization configuration {config}, must be one of {CONFIGS}.")
+
+    angles = np.deg2rad(np.atleast_1d(np.asarray(angles, dtype=float)))
+    cos, sin, zero = np.cos(angles), np.sin(angles), np.zeros_like(angles)
+
+    e_in = np.stack([cos, sin, zero], axis=-1)
+    e_out = e_in if config == 'parallel' else np.stack([-sin, cos, zero], axis=-1)
+
+    return e_in, e_out
+
+
+@Timer('get_polarized_intensities')
+def get_polarized_intensities(raman_tensors : np.ndarray,
+                              rotations : np.ndarray,
+                              e_in : np.ndarray,
+                              e_out : np.ndarray):
+    """Polarized Raman intensities of all the modes, for all the
+    orientations and polarization pairs at once.
+
+    Args:
+        - raman_tensors (np.ndarray): (M, 3, 3) Raman tensors.
+        - rotations (np.ndarray): (R, 3, 3) rotation matrices of the sample.
+        - e_in, e_out (np.ndarray): (P, 3) incident and scattered polarizations.
+
+    Returns:
+        - intensities (np.ndarray): (M, R, P) intensities.
+    """
+    # polarizations in the frame of the sample, R^T e
+    u = np.einsum('rji,pj->rpi', rotations, e_out)
+    v = np.einsum('rji,pj->rpi', rotations, e_in)
+
+    amplitudes = np.einsum('rpi,mij,rpj->mrp', u, raman_tensors, v, optimize=True)
+
+    return amplitudes**2
+
+
+def _select_modes(all_mode_ids : np.ndarray, mode_ids : list[int] | None):
+    """Indices of the requested modes (all if None)."""
+    if mode_ids is None:
+        return np.arange(len(all_mode_ids))
+
+    index = {mode_id: i for i, mode_id in enumerate(all_mode_ids)}
+    missing = [mode_id for mode_id in mode_ids if mode_id not in index]
+    if missing:
+        raise ValueError(f"Modes {missing} not found in the Raman tensors.")
+
+    return np.array([index[mode_id] for mode_id in mode_ids])
+
+
+@Timer('write_polarization_sweep')
+def write_polarization_sweep(orientation : tuple[float, float, float] = (0, 0, 0),
+                             npoints : int = 361,
+                             mode_ids : list[int] | None = None,
+                             plot : bool = True,
+                             root : str = '.'):
+    """Write the parallel and crossed intensities as a function of the
+    angle of the incident polarization, for a fixed orientation of the sample,
+    to raman_polarization_sweep.dat (and plot them in polar coordinates).
+
+    Args:
+        - orientation (tuple): Euler angles (phi, theta, psi) of the sample, in degrees.
+        - npoints (int): Number of polarization angles between 0 and 360 degrees.
+        - mode_ids (list): Ids of the modes (default: all).
+        - plot (bool): Whether to plot the sweeps to raman_polarization_sweep.png.
+        - root (str): Directory of the project.
+
+    Returns:
+        - angles (np.ndarray): (P,) polarization angles in degrees.
+        - intensities (dict): {config: (M, P) intensities}.
+    """
+    all_mode_ids, frequencies, raman_tensors = read_raman_tensors(root)
+    selected = _select_modes(all_mode_ids, mode_ids)
+
+    angles = np.linspace(0, 360, npoints)
+    rotations = get_rotation_matrices(*orientation)[np.newaxis]
+
+    intensities = {}
+    for config in CONFIGS:
+        e_in, e_out = get_polarization_vectors(angles, config)
+        intensities[config] = get_polarized_intensities(raman_tensors[selected], rotations, e_in, e_out)[:, 0, :]
+
+    filename = os.path.join(root, 'raman_polarization_sweep.dat')
+    header = 'angle(deg)  ' + '  '.join(f'{config[:3]}_{all_mode_ids[i]:03d}'
+                                         for i in selected for config in CONFIGS)
+    table = np.column_stack([angles] + [intensities[config][j]
+                                        for j in range(len(selected)) for config in CONFIGS])
+    np.savetxt(filename, table, fmt='%.6e', header=header, comments='')
+    print(f'Polarization sweep written to {filename}')
+
+    if plot:
+        from matplotlib.figure import Figure
+
+        fig = Figure()
+        ax = fig.add_subplot(projection='polar')
+        for j, i in enumerate(selected):
+            for config, style in zip(CONFIGS, ('-', '--')):
+                ax.plot(np.deg2rad(angles), intensities[config][j], style,
+                        label=f'{all_mode_ids[i]} ({frequencies[i]:.0f} cm-1) {config}')
+        ax.legend(fontsize=6, loc='upper left', bbox_to_anchor=(1.05, 1))
+        figname = os.path.join(root, 'raman_polarization_sweep.png')
+        fig.savefig(figname, dpi=300, bbox_inches='tight')
+        print(f'Plot saved in {figname}.')
+
+    return angles, intensities
+
+
+@Timer('write_orientation_map')
+def write_orientation_map(config : str = 'parallel',
+                          polarization_angle : float = 0,
+                          ntheta : int = 91,
+                          nphi : int = 181,
+                          mode_ids : list[int] | None = None,
+                          plot_modes : list[int] | None = None,
+                          root : str = '.'):
+    """Write the polarized intensities as a function of the orientation
+    (polar angle theta and azimuthal angle phi of the z axis of the sample)
+    to raman_orientation_map.npz, with the arrays theta, phi, mode_ids,
+    frequencies and intensities (with shape (modes, ntheta, nphi)).
+
+    Args:
+        - config (str): 'parallel' or 'crossed' polarization.
+        - polarization_angle (float): Angle (degrees) of the incident polarization from the x axis.
+        - ntheta, nphi (int): Number of polar (0-180) and azimuthal (0-360) angles.
+        - mode_ids (list): Ids of the modes (default: all).
+        - plot_modes (list): Ids of the modes whose map is plotted to raman_orientation_map_<id>.png.
+        - root (str): Directory of the project.
+
+    Returns:
+        - theta, phi (np.ndarray): Angles of the grid in degrees.
+        - intensities (np.ndarray): (M, ntheta, nphi) intensities.
+    """
+    all_mode_ids, frequencies, raman_tensors = read_raman_tensors(root)
+    selected = _select_modes(all_mode_ids, mode_ids)
+
+    theta = np.linspace(0, 180, ntheta)
+    phi = np.linspace(0, 360, nphi)
+    thetas, phis = np.meshgrid(theta, phi, indexing='ij')
+    rotations = get_rotation_matrices(phis.ravel(), thetas.ravel())
+
+    e_in, e_out = get_polarization_vectors([polarization_angle], config)
+    intensities = get_polarized_intensities(raman_tensors[selected], rotations, e_in, e_out)
+    intensities = intensities.reshape(len(selected), ntheta, nphi)
+
+    filename = os.path.join(root, 'raman_orientation_map.npz')
+    np.savez(filename,
+             theta=theta,
+             phi=phi,
+             mode_ids=all_mode_ids[selected],
+             frequencies=frequencies[selected],
+             intensities=intensities,
+             config=np.array(config),
+             polarization_angle=polarization_angle)
+    print(f'Orientation map written to {filename}')
+
+    if plot_modes:
+        from matplotlib.figure import Figure
+
+        for mode_id in plot_modes:
+            j = _select_modes(all_mode_ids[selected], [mode_id])[0]
+            fig = Figure()
+            ax = fig.add_subplot()
+            mesh = ax.pcolormesh(phi, theta, intensities[j], shading='auto')
+            fig.colorbar(mesh, label='Intensity (a.u.)')
+            ax.set_xlabel('phi (deg)')
+            ax.set_ylabel('theta (deg)')
+            ax.set_title(f'Mode {mode_id} ({frequencies[selected][j]:.0f} cm-1), {config}')
+            figname = os.path.join(root, f'raman_orientation_map_{mode_id:03d}.png')
+            fig.savefig(figname, dpi=300, bbox_inches='tight')
+            print(f'Plot saved in {figname}.')
+
+    return theta, phi, intensities
@@ -1,55 +1,222 @@
-
 '''
 Module to write the animated trajectories of the vibrational modes
 '''
 
-from pathlib import Path
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 import os
-import warnings
 
-from ase.calculators.vasp import Vasp
-from ase import units
-from ase.vibrations import VibrationsData
-from ase.io import read, write
+import numpy as np
+from ase import Atoms, units
 
 from xphon import PHONONS_DIR
+from xphon.calculations.utils import read_vibrations, read_structure, get_chunk_size
+from xphon.profiling import Timer
+
+
+TRAJ_FORMATS = ('xyz', 'single', 'npz')
 
 
-def write_mode(vibrations : VibrationsData, directory : str, n=None, kT=units.kB * 300, nimages=30):
-    """Write mode number n to trajectory file. If n is not specified,
-    writes all non-zero modes."""
-    if n is None:
-        for index, energy in enumerate(vibrations.get_energies()):
-            if abs(energy) > 1e-5:
-                write_mode(vibrations, directory, n=index, kT=kT, nimages=nimages)
+def get_animated_modes(positions : np.ndarray,
+                       modes : np.ndarray,
+                       amplitudes : np.ndarray,
+                       nimages : int = 30):
+    """
+    Compute all the frames of the animations of the given modes at once,
+    as positions = equilibrium + sin(phase) * amplitude * mode
+    (same as ase VibrationsData.iter_animated_mode).
+
+    Args:
+    - positions: equilibrium positions, shape (N, 3)
+    - modes: mode displacements, shape (M, N, 3)
+    - amplitudes: amplitude of each mode, shape (M,)
+    - nimages: number of frames per mode
+
+    Returns:
+    - frames: positions for every frame of every mode, shape (M, nimages, N, 3)
+    """
+
+    phases = np.linspace(0, 2*np.pi, nimages, endpoint=False)
+    scale = np.sin(phases)[np.newaxis, :] * amplitudes[:, np.newaxis]  # (M, F)
+
+    return positions + scale[:, :, np.newaxis, np.newaxis] * modes[:, np.newaxis, :, :]
+
+
+def _xyz_header(cell : np.ndarray, pbc : np.ndarray):
+    '''
+    Extended xyz keys shared by all the frames
+    '''
+    lattice = ' '.join(f'{x:.8f}' for x in cell.ravel())
+    pbc_str = ' '.join('T' if p else 'F' for p in pbc)
+    return f'Lattice="{lattice}" Properties=species:S:1:pos:R:3 pbc="{pbc_str}"'
+
+
+def _xyz_blocks(symbols : list, frames : np.ndarray, comments : list[str]):
+    '''
+    Serialize a series of frames (F, N, 3) to extended xyz text,
+    with one comment line per frame.
+    '''
+    natoms = len(symbols)
+    line_fmt = '%-2s %16.8f %16.8f %16.8f\n' * natoms
+
+    table = np.empty((natoms, 4), dtype=object)
+    table[:, 0] = symbols
+
+    blocks = []
+    for frame, comment in zip(frames, comments):
+        table[:, 1:] = frame
+        blocks.append(f'{natoms}\n{comment}\n' + line_fmt % tuple(table.ravel()))
+
+    return ''.join(blocks)
+
+
+def select_modes(frequencies : np.ndarray,
+                 mode_ids : list[int] | None = None,
+                 freq_range : tuple[float, float] | None = None):
+    '''
+    Select the modes to animate. By default, all non-zero modes are selected.
+
+    Args:
+    - frequencies: (complex) frequencies of all the modes in cm-1
+    - mode_ids: ids of the modes to select (from 1 for the lowest freq mode to 3N)
+    - freq_range: only select the (real) modes with frequency (cm-1) in this window
+
+    Returns:
+    - indices: array of the (0-based) indices of the selected modes
+    '''
+
+    selected = np.abs(frequencies * units.invcm) > 1e-5
+
+    if mode_ids is not None:
+        invalid = [i for i in mode_ids if not 1 <= i <= len(frequencies)]
+        if invalid:
+            raise ValueError(f"Invalid mode ids {invalid}: the modes are numbered from 1 to {len(frequencies)}.")
+        requested = np.zeros(len(frequencies), dtype=bool)
+        requested[[i - 1 for i in mode_ids]] = True
+        selected &= requested
+
+    if freq_range is not None:
+        selected &= (frequencies.imag == 0) \
+                    & (frequencies.real >= freq_range[0]) \
+                    & (frequencies.real <= freq_range[1])
+
+    return np.flatnonzero(selected)
+
+
+@Timer('write_mode')
+def write_mode(atoms : Atoms,
+               frequencies : np.ndarray,
+               modes : np.ndarray,
+               directory : str,
+               n : int | list[int] | None = None,
+               kT : float = units.kB * 300,
+               nimages : int = 30,
+               freq_range : tuple[float, float] | None = None,
+               traj_format : str = 'xyz',
+               chunk_size : int | None = None):
+    """Write the animation of mode(s) n to trajectory file(s). If n is not specified,
+    writes all non-zero modes.
+
+    All the frames of a chunk of modes are computed at once with get_animated_modes.
+
+    Args:
+    - atoms: equilibrium structure
+    - frequencies: (complex) frequencies of all the modes in cm-1
+    - modes: (3N, N, 3) array of the modes (can be memory-mapped)
+    - directory: output directory
+    - n: mode id, or list of mode ids (starting from 1 for the lowest freq mode)
+    - kT: temperature in energy units, sets the amplitude of the oscillation
+    - nimages: number of frames per mode
+    - freq_range: only write the modes with frequency (cm-1) in this window
+    - traj_format: 'xyz' for one file per mode (<id>.xyz), written in parallel,
+        'single' for a single multi-block extxyz file (modes.xyz),
+        'npz' for a single binary file (modes.npz) with all the frames as a
+        (modes, frames, N, 3) array
+    - chunk_size: number of modes computed at once (default: as many as
+        fit in CHUNK_BYTES, see xphon.calculations.utils)
+    """
+
+    if traj_format not in TRAJ_FORMATS:
+        raise ValueError(f"traj_format must be one of {TRAJ_FORMATS}.")
+
+    if isinstance(n, int):
+        n = [n]
+    indices = select_modes(frequencies, mode_ids=n, freq_range=freq_range)
+    if len(indices) == 0:
+        print("No modes selected, nothing to write.")
         return
 
-    else:
-        n %= len(vibrations.get_energies())
-
-    traj = [frame for frame in vibrations.iter_animated_mode(n,temperature=kT, frames=nimages)]
-
-    write(f'{directory}/{n+1}.xyz', traj)
+    if chunk_size is None:
+        chunk_size = max(1, get_chunk_size(modes) // nimages)
+
+    energies = frequencies * units.invcm
+    symbols = atoms.get_chemical_symbols()
+    header = _xyz_header(atoms.cell.array, atoms.pbc)
+
+    amplitudes = np.sqrt(kT / np.abs(energies[indices]))
+
+    def comments(index):
+        freq = frequencies[index]
+        freq_str = f'{freq.real:.5f}' if freq.imag == 0 else f'{freq.imag:.5f}i'
+        return [f'{header} mode={index+1} frequency="{freq_str}" frame={k}' for k in range(nimages)]
+
+    def iter_chunks():
+        for start in range(0, len(indices), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            yield indices[chunk], get_animated_modes(atoms.positions, modes[indices[chunk]],
+                                                     amplitudes[chunk], nimages)
+
+    if traj_format == 'npz':
+        # written to a memory-mapped .npy first, so that all the frames are never in memory at once
+        tmp_file = f'{directory}/modes_positions.tmp.npy'
+        frames = np.lib.format.open_memmap(tmp_file, mode='w+',
+                                           shape=(len(indices), nimages, len(atoms), 3))
+        for start, (_, chunk_frames) in zip(range(0, len(indices), chunk_size), iter_chunks()):
+            frames[start:start + len(chunk_frames)] = chunk_frames
+        np.savez(f'{directory}/modes.npz',
+                 positions=frames,
+                 mode_ids=indices + 1,
+                 frequencies=frequencies[indices],
+                 symbols=np.array(symbols),
+                 cell=atoms.cell.array,
+                 pbc=atoms.pbc)
+        del frames
+        os.remove(tmp_file)
+
+    elif traj_format == 'single':
+        with open(f'{directory}/modes.xyz', 'w') as f:
+            for chunk_indices, frames in iter_chunks():
+                for index, mode_frames in zip(chunk_indices, frames):
+                    f.write(_xyz_blocks(symbols, mode_frames, comments(index)))
 
+    else:
+        def write_file(index, mode_frames):
+            with open(f'{directory}/{index+1}.xyz', 'w') as f:
+                f.write(_xyz_blocks(symbols, mode_frames, comments(index)))
 
-def write_vibrations():
-    """Write all vibrational modes to trajectory files."""
+        with ThreadPoolExecutor() as executor:
+            for chunk_indices, frames in iter_chunks():
+                list(executor.map(write_file, chunk_indices, frames))
 
 
-    if not Path(f'{PHONONS_DIR}/ase-sort.dat').is_file():
-        #write fake ase-sort.dat to make ase happy
-        atoms = read(f'{PHONONS_DIR}/POSCAR')
-        with open(f'{PHONONS_DIR}/ase-sort.dat', 'w') as f:
-            for n in range(len(atoms)):
-                f.write('%5i %5i \n' % (n, n))
+@Timer('write_vibrations')
+def write_vibrations(mode_ids : list[int] | None = None,
+                     freq_range : tuple[float, float] | None = None,
+                     traj_format : str = 'xyz',
+                     root : str = '.'):
+    """Write the vibrational modes to trajectory files.
 
-    vasp = Vasp(directory=PHONONS_DIR)
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        vasp.read()
+    Args:
+    - mode_ids: ids of the modes to write (default: all non-zero modes)
+    - freq_range: only write the modes with frequency (cm-1) in this window
+    - traj_format: 'xyz', 'single' or 'npz' (see write_mode)
+    - root: directory of the project
+    """
 
-    vibrations = vasp.get_vibrations()
+    frequencies, modes = read_vibrations(f'{root}/{PHONONS_DIR}')
+    atoms = read_structure(f'{root}/{PHONONS_DIR}')
 
-    os.makedirs('trajectories', exist_ok=True)
+    os.makedirs(f'{root}/trajectories', exist_ok=True)
 
-    write_mode(vibrations, directory='trajectories')
+    write_mode(atoms, frequencies, modes, directory=f'{root}/trajectories', n=mode_ids,
+               freq_range=freq_range, traj_format=traj_format)
@@ -0,0 +1,148 @@
+'''
+Lightweight per-stage timing instrumentation, activated with
+the global option --profile of the xphon command line interface.
+
+Stages are marked in the code either as decorators or as context managers:
+
+    @Timer('get_modes')
+    def get_modes(...):
+        ...
+
+    with Timer('ir_intensities'):
+        ...
+
+For each stage the number of calls, the wall time, the bytes read from disk
+(from /proc/self/io, Linux only) and the growth of the peak resident memory
+of the process during the stage (the largest over the calls) are recorded.
+The growth is zero for a stage that stays below the peak reached by a previous
+one, and includes the memory of the nested stages and of the other threads
+running at the same time. The peak resident memory of the whole process is
+reported separately. When profiling is not enabled, a Timer only costs a
+check of a global flag.
+'''
+
+from __future__ import annotations
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+
+
+ENABLED = False
+
+_stats : dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def enable():
+    '''
+    Enable the recording of the stages
+    '''
+    global ENABLED #pylint: disable=global-statement
+    ENABLED = True
+    _stats.clear()
+
+
+def _bytes_read():
+    '''
+    Total bytes read by the process so far (None if not available)
+    '''
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('rchar'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss_mb():
+    '''
+    Peak resident memory of the process so far, in MB
+    '''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+class Timer:
+    '''
+    Record calls, wall time, bytes read and growth of the peak RSS of a stage.
+    Can be used as context manager or as decorator.
+    '''
+
+    __slots__ = ('name', '_start')
+
+    def __init__(self, name : str):
+        self.name = name
+        self._start = None
+
+    def __enter__(self):
+        if ENABLED:
+            self._start = (time.perf_counter(), _bytes_read(), _peak_rss_mb())
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is None:
+            return False
+
+        start_time, start_bytes, start_rss = self._start
+        self._start = None
+        end_bytes = _bytes_read()
+        elapsed = time.perf_counter() - start_time
+        rss_growth = _peak_rss_mb() - start_rss
+
+        # stages can be run from several threads
+        with _lock:
+            stats = _stats.setdefault(self.name, {'calls': 0,
+                                                  'wall_time': 0.0,
+                                                  'bytes_read': 0,
+                                                  'rss_growth_mb': 0.0})
+            stats['calls'] += 1
+            stats['wall_time'] += elapsed
+            if start_bytes is not None and end_bytes is not None:
+                stats['bytes_read'] += end_bytes - start_bytes
+            stats['rss_growth_mb'] = max(stats['rss_growth_mb'], rss_growth)
+
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with Timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def get_stats():
+    '''
+    Return the recorded statistics of each stage
+    '''
+    return {name: dict(stats) for name, stats in _stats.items()}
+
+
+def write_report(path : str):
+    '''
+    Write the recorded statistics of each stage to a json file,
+    and print a summary table.
+    '''
+
+    stats = get_stats()
+    peak_rss = _peak_rss_mb()
+    with open(path, 'w') as f:
+        json.dump({'stages': stats, 'peak_rss_mb': peak_rss}, f, indent=4)
+
+    print(f"{'stage':<40}{'calls':>8}{'time (s)':>12}{'read (MB)':>12}{'RSS growth (MB)':>17}")
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]['wall_time']):
+        print(f"{name:<40}{s['calls']:8d}{s['wall_time']:12.4f}"
+              f"{s['bytes_read']/1e6:12.2f}{s['rss_growth_mb']:17.1f}")
+    print(f'Peak RSS of the process: {peak_rss:.1f} MB')
+    print(f'Profiling data written to {path}')
@@ -0,0 +1,260 @@
+'''
+Library interface to an xphon project, i.e. a directory with the input files
+(INCAR, POSCAR, KPOINTS, POTCAR, settings.json) and the phonons/ and raman_calcs/
+calculations.
+
+All the paths are relative to the root of the project, which is given explicitly,
+and the working directory is never changed, so that several projects can be
+handled from the same Python process, also from different threads:
+
+    from concurrent.futures import ThreadPoolExecutor
+    from xphon.project import Project
+
+    projects = [Project(path) for path in ('conf1', 'conf2', 'conf3')]
+    with ThreadPoolExecutor() as executor:
+        spectra = list(executor.map(Project.ir_spectrum, projects))
+
+Besides writing the usual output files, the methods return the results as arrays.
+The command line interface is a thin layer over this class, acting on the
+project in the working directory.
+'''
+
+from __future__ import annotations
+from collections.abc import Sequence
+import os
+
+import numpy as np
+
+from xphon import PHONONS_DIR, RAMAN_DIR
+from xphon.calculations.utils import read_input_parameters, read_vibrations, \
+    get_modes, get_born_charges, get_epsilon
+from xphon.calculations.ir import launch_ir_calculation, write_ir_spectrum
+from xphon.calculations.raman import launch_raman_calculations, write_raman_spectrum
+from xphon.calculations.isotope import write_isotope_spectra
+from xphon.calculations.jobs import scancel
+from xphon.calculations.archive import write_archive, restore_archive
+from xphon.calculations.cost import write_cost_report
+from xphon.postprocess.trajectories import write_vibrations
+from xphon.postprocess.plot import plot_spectrum
+from xphon.postprocess.polarized import write_polarization_sweep, write_orientation_map
+from xphon.postprocess.fit import fit_spectrum
+
+
+class Project:
+    '''
+    xphon project in the directory root.
+    A relative root is interpreted with respect to the working directory
+    at the time of each call.
+    '''
+
+    def __init__(self, root : str | os.PathLike = '.'):
+        self.root = os.fspath(root)
+
+    def __repr__(self):
+        return f'Project({self.root!r})'
+
+    @property
+    def phonons_dir(self):
+        return os.path.join(self.root, PHONONS_DIR)
+
+    @property
+    def raman_dir(self):
+        return os.path.join(self.root, RAMAN_DIR)
+
+    def read_input_parameters(self):
+        '''
+        Returns:
+        - atoms, step_size, jobscript_path, submit_command (see utils.read_input_parameters)
+        '''
+        return read_input_parameters(self.root)
+
+    def launch_ir(self):
+        '''
+        Launch the phonon (DFPT) calculation
+        '''
+        launch_ir_calculation(root=self.root)
+
+    def launch_raman(self, write_only : bool = False):
+        '''
+        Write the displaced POSCARs and (unless write_only) launch the
+        calculations that are not complete yet.
+        '''
+        launch_raman_calculations(write_only=write_only, root=self.root)
+
+    def vibrations(self):
+        '''
+        Returns:
+        - frequencies: (3n,) complex frequencies of all the modes in cm-1
+        - eigenvectors: (3n, N, 3) memory-mapped eigenvectors
+        '''
+        return read_vibrations(self.phonons_dir)
+
+    def modes(self):
+        '''
+        Returns:
+        - modes_list: list of the (non-imaginary) Mode objects
+        '''
+        return get_modes(self.phonons_dir)
+
+    def born_charges(self):
+        '''
+        Returns:
+        - born_charges: (N, 3, 3) Born effective charges
+        '''
+        return np.asarray(get_born_charges(os.path.join(self.phonons_dir, 'vasprun.xml')))
+
+    def epsilon(self):
+        '''
+        Returns:
+        - epsilon: (3, 3) dielectric tensor of the equilibrium structure
+        '''
+        return np.asarray(get_epsilon(os.path.join(self.phonons_dir, 'vasprun.xml')))
+
+    def ir_spectrum(self):
+        '''
+        Write ir_spectrum.dat.
+
+        Returns:
+        - frequencies: (M,) frequencies in cm-1
+        - intensities: (M,) IR intensities
+        '''
+        return write_ir_spectrum(root=self.root)
+
+    def raman_spectrum(self,
+                       laser_freqs : list[float] | None = None,
+                       temperatures : Sequence[float] = (300,)):
+        '''
+        Write raman_spectrum.dat (and raman_intensities.npz if laser_freqs are given).
+
+        Returns:
+        - frequencies: (M,) frequencies in cm-1
+        - activities: (M,) Raman activities
+        - raman_tensors: (M, 3, 3) Raman tensors
+        '''
+        return write_raman_spectrum(laser_freqs=laser_freqs,
+                                    temperatures=temperatures,
+                                    root=self.root)
+
+    def isotope_spectra(self, isotopologues : dict):
+        '''
+        Write ir_spectrum_<label>.dat for each isotopologue {label: {element or index: mass}}.
+
+        Returns:
+        - spectra: dict {label: (frequencies, intensities)}
+        '''
+        return write_isotope_spectra(isotopologues, root=self.root)
+
+    def plot(self,
+             spectrum : str,
+             broaden_type : str | None = None,
+             fwhm : float = 0,
+             laser_freq : float | None = None,
+             temperature : float = 300,
+             freq_range : tuple[float, float] | None = None,
+             show_peaks : bool = False,
+             assign_modes : int = 3):
+        '''
+        Plot the spectrum ('ir' or 'raman') to <spectrum>_spectrum[_broaden].png
+        and write <spectrum>_spectrum_plotted.dat (and <spectrum>_peaks.dat with
+        broadening and show_peaks), see plot.plot_spectrum.
+
+        Returns:
+        - x, y: plotted spectrum (frequencies and intensities)
+        '''
+        return plot_spectrum(spectrum, broaden_type=broaden_type, fwhm=fwhm,
+                             laser_freq=laser_freq, temperature=temperature,
+                             freq_range=freq_range, show_peaks=show_peaks,
+                             assign_modes=assign_modes, root=self.root)
+
+    def polarization_sweep(self,
+                           orientation : tuple[float, float, float] = (0, 0, 0),
+                           npoints : int = 361,
+                           mode_ids : list[int] | None = None,
+                           plot : bool = True):
+        '''
+        Write the parallel and crossed Raman intensities as a function of the angle
+        of the incident polarization to raman_polarization_sweep.dat
+        (see polarized.write_polarization_sweep).
+
+        Returns:
+        - angles: (P,) polarization angles in degrees
+        - intensities: dict {config: (M, P) intensities}
+        '''
+        return write_polarization_sweep(orientation=orientation, npoints=npoints,
+                                        mode_ids=mode_ids, plot=plot, root=self.root)
+
+    def orientation_map(self,
+                        config : str = 'parallel',
+                        polarization_angle : float = 0,
+                        ntheta : int = 91,
+                        nphi : int = 181,
+                        mode_ids : list[int] | None = None,
+                        plot_modes : list[int] | None = None):
+        '''
+        Write the polarized Raman intensities as a function of the orientation
+        of the sample to raman_orientation_map.npz (see polarized.write_orientation_map).
+
+        Returns:
+        - theta, phi: angles of the grid in degrees
+        - intensities: (M, ntheta, nphi) intensities
+        '''
+        return write_orientation_map(config=config, polarization_angle=polarization_angle,
+                                     ntheta=ntheta, nphi=nphi, mode_ids=mode_ids,
+                                     plot_modes=plot_modes, root=self.root)
+
+    def fit(self,
+            spectrum : str,
+            experiment_path : str,
+            scales : np.ndarray,
+            shift_range : tuple[float, float],
+            fwhms : np.ndarray,
+            **kwargs):
+        '''
+        Fit the computed spectrum ('ir' or 'raman') to an experimental one,
+        searching the best scale, shift and FWHM on a grid (see fit.fit_spectrum
+        for the other options). Writes <spectrum>_fit.dat and <spectrum>_fit_overlay.dat.
+
+        Returns:
+        - best: best candidates as dicts with scale, shift, fwhm and score, best first
+        '''
+        return fit_spectrum(spectrum, experiment_path, scales, shift_range, fwhms,
+                            root=self.root, **kwargs)
+
+    def write_trajectories(self,
+                           mode_ids : list[int] | None = None,
+                           freq_range : tuple[float, float] | None = None,
+                           traj_format : str = 'xyz'):
+        '''
+        Write the animations of the modes to the trajectories/ directory
+        '''
+        write_vibrations(mode_ids=mode_ids, freq_range=freq_range,
+                         traj_format=traj_format, root=self.root)
+
+    def archive(self, compression : str = 'gz'):
+        '''
+        Extract the data needed by xphon to xphon_archive.npz, pack the raw
+        outputs in a tarball and delete phonons/ and raman_calcs/
+        '''
+        write_archive(root=self.root, compression=compression)
+
+    def restore(self):
+        '''
+        Extract the raw outputs of an archived project
+        '''
+        restore_archive(root=self.root)
+
+    def cost(self, max_jobs : int | None = None):
+        '''
+        Report the core-hours used by the finished calculations and the
+        projected cost of the pending ones.
+
+        Returns:
+        - report: dict with the statistics (see cost.write_cost_report)
+        '''
+        return write_cost_report(max_jobs=max_jobs, root=self.root)
+
+    def scancel(self):
+        '''
+        Cancel the running jobs submitted from this project
+        '''
+        scancel(root=self.root)